@@ -0,0 +1,257 @@
+"""
+Measures the cost of the runtime's hot paths, against the in-memory stand-in for AppDaemon of
+`homeassistant_python_typer_testing` (a real asyncio event loop in its own thread, with AppDaemon's `sync_decorator`).
+
+Run from the repository root (AppDaemon must be installed):
+
+    python benchmarks/hot_path.py [--entities 100] [--listeners 100] [--events 10000] [--local-mirror]
+
+Micro-benchmarks report the time per operation of:
+- `Domain.__getattr__` (first access to an entity) and of the cached entity slot
+- `HaptSharedState.check_caches`
+- `Entity.get_state_repeatable_read`, from the caches and not
+- `Entity.call` (a service call, waited for or fire-and-forget)
+
+Then an event storm changes the state of random entities, each change triggering the listeners of that entity, and
+reports events/s, the p50/p99 latency of the wrapped callbacks, and the memory allocated. The stand-in runs callbacks
+one at a time, so events/s includes its own bookkeeping, while callback latency only covers HAPT and the callback.
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import appdaemon.plugins.hass.hassapi as hass  # noqa: E402
+
+import homeassistant_python_typer_helpers as hapth  # noqa: E402
+import homeassistant_python_typer_testing as hapttest  # noqa: E402
+
+
+class BenchApp(hass.Hass):
+    pass
+
+
+class Light(hapth.OnOffState):
+    __slots__ = ()
+
+
+def domain_class(entity_names: list[str]) -> type:
+    "Builds a domain class like the generated ones"
+    return type(
+        "LightDomain",
+        (hapth.Domain,),
+        {
+            "__annotations__": {name: Light for name in entity_names},
+            "__slots__": tuple(entity_names),
+        },
+    )
+
+
+class TimedAppDaemon(hapttest.StandInAppDaemon):
+    "Records how long each (sync) callback takes, excluding the stand-in's own work"
+
+    def __init__(self, start_time: float | None = None):
+        super().__init__(start_time)
+        # Raw durations rather than a `hapth.Histogram`, whose buckets are too coarse for callbacks that take µs
+        self.callback_durations_s: list[float] = []
+
+    def run(
+        self,
+        app: hapttest.StandInApp,
+        function: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            started_at = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.callback_durations_s.append(time.perf_counter() - started_at)
+
+        return super().run(app, timed, *args, **kwargs)
+
+
+def per_op(label: str, iterations: int, run: Callable[[int], None]) -> None:
+    started_at = time.perf_counter()
+    run(iterations)
+    elapsed_s = time.perf_counter() - started_at
+    print(f"{label:>48}: {elapsed_s / iterations * 1e6:9.3f} µs/op")
+
+
+def micro_benchmarks(entities: int, local_mirror: bool) -> None:
+    names = [f"bench_{i}" for i in range(entities)]
+    domain = domain_class(names)
+    with hapttest.StandInAppDaemon() as AD:
+        for name in names:
+            AD.set_state(f"light.{name}", "on", {"brightness": 255})
+        app: Any = hapttest.stand_in(BenchApp, AD)
+        hapt = hapth.HaptSharedState(app)
+        hapt.local_mirror = local_mirror
+
+        def first_access(iterations: int) -> None:
+            for _ in range(iterations // entities):
+                light = domain(hapt, "light")
+                for name in names:
+                    getattr(light, name)
+
+        per_op("Domain.__getattr__ (first access)", entities * 100, first_access)
+
+        light = domain(hapt, "light")
+        lamp = getattr(light, names[0])
+
+        def cached_access(iterations: int) -> None:
+            for _ in range(iterations):
+                getattr(light, names[0])
+
+        per_op("Domain entity slot (cached)", 1_000_000, cached_access)
+
+        def check_caches(iterations: int) -> None:
+            for _ in range(iterations):
+                hapt.check_caches()
+
+        per_op("check_caches (same callback)", 1_000_000, check_caches)
+
+        lamp.get_state_repeatable_read()
+
+        def cached_read(iterations: int) -> None:
+            for _ in range(iterations):
+                lamp.get_state_repeatable_read()
+
+        per_op("get_state_repeatable_read (cached)", 1_000_000, cached_read)
+
+        def uncached_read(iterations: int) -> None:
+            for _ in range(iterations):
+                app.stand_in_callback_counter += 1
+                lamp.get_state_repeatable_read()
+
+        per_op(
+            f"get_state_repeatable_read (new callback{', mirror' if local_mirror else ''})",
+            10_000,
+            uncached_read,
+        )
+
+        def call(iterations: int) -> None:
+            for _ in range(iterations):
+                lamp.call("light", "turn_on", {})
+            AD.settle()
+
+        per_op("Entity.call (waited for)", 10_000, call)
+        hapt.fire_and_forget_calls = True
+        per_op("Entity.call (fire-and-forget)", 10_000, call)
+
+
+def storm(
+    entities: int,
+    listeners: int,
+    events: int,
+    local_mirror: bool,
+    trace_allocations: bool,
+) -> None:
+    names = [f"bench_{i}" for i in range(entities)]
+    domain = domain_class(names)
+    randomness = random.Random(0)
+    with TimedAppDaemon() as AD:
+        for name in names:
+            AD.set_state(f"light.{name}", "off", {"brightness": 0})
+        app: Any = hapttest.stand_in(BenchApp, AD)
+        hapt = hapth.HaptSharedState(app)
+        hapt.local_mirror = local_mirror
+        light = domain(hapt, "light")
+        lights = [getattr(light, name) for name in names]
+
+        for index in range(listeners):
+            watched = lights[index % entities]
+            neighbour = lights[(index + 1) % entities]
+
+            def on_change(watched: Any = watched, neighbour: Any = neighbour) -> None:
+                # A typical automation: look at the entity that changed and at another one
+                watched.get_state_repeatable_read("brightness")
+                neighbour.get_state_repeatable_read()
+
+            watched.listen_state(on_change)
+
+        changes = [
+            (
+                f"light.{names[randomness.randrange(entities)]}",
+                "on" if step % 2 else "off",
+                {"brightness": step % 256},
+            )
+            for step in range(events)
+        ]
+        gc.collect()
+        before = 0
+        if trace_allocations:
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+        started_at = time.perf_counter()
+        for entity_id, state, attributes in changes:
+            AD.set_state(entity_id, state, attributes)
+        elapsed_s = time.perf_counter() - started_at
+        allocated: tuple[int, int] | None = None
+        "Peak and retained allocations during the storm, in bytes"
+        if trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocated = (peak - before, current - before)
+        durations_s = sorted(AD.callback_durations_s)
+        print(
+            f"{events} events on {entities} entities with {listeners} listeners"
+            f"{' (local mirror)' if local_mirror else ''}:"
+        )
+        print(f"{'events/s':>20}: {events / elapsed_s:12.0f}")
+        print(f"{'callbacks':>20}: {len(durations_s):12}")
+        if durations_s:
+            for label, fraction in (("p50", 0.5), ("p99", 0.99)):
+                duration_s = durations_s[int(fraction * (len(durations_s) - 1))]
+                print(f"{'callback ' + label:>20}: {duration_s * 1e6:12.1f} µs")
+        if allocated is not None:
+            peak_bytes, retained_bytes = allocated
+            print(f"{'peak allocated':>20}: {peak_bytes / 1024:12.1f} KiB")
+            print(f"{'retained':>20}: {retained_bytes / events:12.1f} bytes/event")
+        if AD.errors:
+            print(AD.errors[0])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n\n")[0])
+    parser.add_argument("--entities", type=int, default=100)
+    parser.add_argument("--listeners", type=int, default=100)
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--local-mirror", action="store_true")
+    parser.add_argument(
+        "--no-allocations",
+        action="store_true",
+        help="don't trace allocations during the storm, which slows it down",
+    )
+    args = parser.parse_args()
+
+    micro_benchmarks(args.entities, args.local_mirror)
+    print()
+    storm(
+        args.entities,
+        args.listeners,
+        args.events,
+        args.local_mirror,
+        trace_allocations=False,
+    )
+    if not args.no_allocations:
+        print()
+        storm(
+            args.entities,
+            args.listeners,
+            min(args.events, 10_000),
+            args.local_mirror,
+            trace_allocations=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares the two ways `HaptSharedState.listen_many` can subscribe to the entities of a domain, against the in-memory
+stand-in for AppDaemon of `homeassistant_python_typer_testing`: one AppDaemon subscription per entity, or a single one
+to the whole domain (`domain_wide=True`).
+
+Run from the repository root (AppDaemon must be installed):
+
+    python benchmarks/listen_many.py [--domain-size 200] [--events 5000]
+
+For several shares of the domain being watched, random entities of the domain change state, and the benchmark reports
+events/s and how many times AppDaemon invoked the wrapper. Like AppDaemon, the stand-in checks every subscription on
+each state change, which is what a domain-wide subscription saves, while each change of an entity that isn't watched
+costs it an invocation. The stand-in invokes callbacks in the calling thread, whereas AppDaemon hands them to a worker
+thread, so the invocations are cheaper here than they are for real.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import appdaemon.plugins.hass.hassapi as hass  # noqa: E402
+
+import homeassistant_python_typer_helpers as hapth  # noqa: E402
+import homeassistant_python_typer_testing as hapttest  # noqa: E402
+
+
+class BenchApp(hass.Hass):
+    pass
+
+
+class CountingAppDaemon(hapttest.StandInAppDaemon):
+    "Counts the callback invocations"
+
+    invocations = 0
+
+    def invoke(
+        self,
+        app: hapttest.StandInApp,
+        callback: Callable[..., Any],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+    ) -> None:
+        self.invocations += 1
+        super().invoke(app, callback, args, kwargs)
+
+
+def run(domain_size: int, watched: int, events: int, domain_wide: bool) -> None:
+    entity_ids = [f"light.bench_{i}" for i in range(domain_size)]
+    randomness = random.Random(0)
+    AD = CountingAppDaemon()
+    with AD:
+        for entity_id in entity_ids:
+            AD.set_state(entity_id, "off", run_callbacks=False)
+        app: Any = hapttest.stand_in(BenchApp, AD)
+        hapt = hapth.HaptSharedState(app)
+        hapt.adaptive_prefetch = False
+        AD.run(
+            app,
+            lambda: hapt.listen_many(
+                [
+                    hapth.OnOffState(hapt, entity_id)
+                    for entity_id in entity_ids[:watched]
+                ],
+                lambda entity: None,
+                domain_wide=domain_wide,
+            ),
+        )
+        changes = [
+            (entity_ids[randomness.randrange(domain_size)], "on" if step % 2 else "off")
+            for step in range(events)
+        ]
+        AD.invocations = 0
+        started_at = time.perf_counter()
+        for entity_id, state in changes:
+            AD.set_state(entity_id, state)
+        elapsed_s = time.perf_counter() - started_at
+        print(
+            f"{watched:>5}/{domain_size} watched, {'domain-wide' if domain_wide else 'per entity':>11}:"
+            f" {events / elapsed_s:9.0f} events/s, {AD.invocations:6} invocations"
+        )
+        if AD.errors:
+            print(AD.errors[0])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n\n")[0])
+    parser.add_argument("--domain-size", type=int, default=200)
+    parser.add_argument("--events", type=int, default=5_000)
+    args = parser.parse_args()
+
+    for share in (0.1, 0.5, 0.9, 1.0):
+        watched = max(1, int(args.domain_size * share))
+        for domain_wide in (False, True):
+            run(args.domain_size, watched, args.events, domain_wide)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the memory used by the runtime object model: the `HomeAssistant` object graph that each app builds, with the
+entities it uses.
+
+Run from the repository root (AppDaemon must be installed):
+
+    python benchmarks/memory.py [--apps 40] [--entities 300]
+
+The same graph is also built with entity classes that have a `__dict__` and copy `name`/`AD` onto each instance, as
+entities did before they used `__slots__`, for comparison.
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from types import SimpleNamespace
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import homeassistant_python_typer_helpers as hapth  # noqa: E402
+
+
+class FakeApp:
+    "Just what `HaptSharedState` needs from an AppDaemon app"
+
+    def __init__(self, name: str, AD: Any):
+        self.name = name
+        self.namespace = "default"
+        self.AD = AD
+
+    def get_ad_api(self) -> Any:
+        return SimpleNamespace(name=self.name, AD=self.AD, namespace=self.namespace)
+
+
+class SlottedLight(hapth.OnOffState):
+    __slots__ = ()
+
+
+class DictLight(hapth.OnOffState):
+    "Entity layout before `__slots__`: a per-instance `__dict__` holding copies of `name` and `AD`"
+
+    def __init__(self, hapt: hapth.HaptSharedState, entity_id: str):
+        super().__init__(hapt, entity_id)
+        self.name = hapt.ad.name  # pyright: ignore[reportIncompatibleMethodOverride]
+        self.AD = hapt.ad.AD  # pyright: ignore[reportConstantRedefinition]
+
+    # Plain attributes instead of the properties, as before
+    name: str = ""
+    AD: Any = None
+
+
+def domain_class(entity_class: type, entity_names: list[str], slotted: bool) -> type:
+    "Builds a domain class like the generated ones"
+    namespace: dict[str, Any] = {
+        "__annotations__": {name: entity_class for name in entity_names}
+    }
+    if slotted:
+        namespace["__slots__"] = tuple(entity_names)
+    return type("LightDomain", (hapth.Domain,), namespace)
+
+
+def build_apps(
+    apps: int, entities: int, entity_class: type, slotted: bool
+) -> Callable[[], list[Any]]:
+    entity_names = [f"light_{i}" for i in range(entities)]
+    domain = domain_class(entity_class, entity_names, slotted)
+    AD = SimpleNamespace()
+
+    def build() -> list[Any]:
+        graphs = []
+        for app in range(apps):
+            hapt = hapth.HaptSharedState(FakeApp(f"app_{app}", AD))  # type: ignore
+            light = domain(hapt, "light")
+            for name in entity_names:
+                getattr(light, name)
+            graphs.append(light)
+        return graphs
+
+    return build
+
+
+def measure(build: Callable[[], list[Any]]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    graphs = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del graphs
+    return after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n\n")[0])
+    parser.add_argument("--apps", type=int, default=40)
+    parser.add_argument("--entities", type=int, default=300)
+    args = parser.parse_args()
+
+    total_entities = args.apps * args.entities
+    print(f"{args.apps} apps using {args.entities} entities each")
+    results = {}
+    for label, entity_class, slotted in (
+        ("__slots__", SlottedLight, True),
+        ("__dict__", DictLight, False),
+    ):
+        used = measure(build_apps(args.apps, args.entities, entity_class, slotted))
+        results[label] = used
+        print(
+            f"{label:>10}: {used / 1024:10.1f} KiB total,"
+            f" {used / total_entities:6.1f} bytes per entity"
+        )
+    print(f"   savings: {1 - results['__slots__'] / results['__dict__']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,13 +13,12 @@ class SensorLight(hass.Hass):
 
     def initialize(self):
         self.ha = HomeAssistant(self)
+        self.ha.hapt.track_pending_commands = True
 
         self.light = self.ha.light.hallway_lamp
         self.sensor = self.ha.binary_sensor.hallway_motion_sensor_occupancy
 
         self.timer = None
-        # Track that we asked turn off otherwise we may skip turn_on command while it's turning off (because is_on())
-        self.gave_order_to_turn_off = False
 
         self.sensor.listen_state(self.check_sensor)
 
@@ -42,14 +41,15 @@ class SensorLight(hass.Hass):
     def set_light(self):
         should_be_on = self.sensor.is_on() or self.timer is not None
         if should_be_on:
-            if not self.light.is_on() or self.gave_order_to_turn_off:
+            # Effective state takes into account the commands we have sent but that haven't been applied yet, so we
+            # don't skip the turn_on command while it's still turning off
+            if self.light.is_effectively_off():
                 self.light.turn_on(
                     brightness=255, color_temp_kelvin=2202, transition=0.1
                 )
         else:
-            if self.light.is_on():
+            if self.light.is_effectively_on():
                 self.light.turn_off(transition=3)
-                self.gave_order_to_turn_off = True
 
     def set_timer(self):
         if self.timer is None:
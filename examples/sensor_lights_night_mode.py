@@ -19,13 +19,12 @@ class SensorLightNightMode(hass.Hass):
 
     def initialize(self):
         self.ha = HomeAssistant(self)
+        self.ha.hapt.track_pending_commands = True
 
         self.light = self.ha.light.hallway_lamp
         self.sensor = self.ha.binary_sensor.hallway_motion_sensor_occupancy
 
         self.timer = None
-        # Track that we asked turn off otherwise we may skip turn_on command while it's turning off (because is_on())
-        self.gave_order_to_turn_off = False
 
         self.sensor.listen_state(self.check_sensor)
         self.run_daily(self.check_light_trigger, night_start)  # day mode to night mode
@@ -53,7 +52,9 @@ class SensorLightNightMode(hass.Hass):
     def set_light(self):
         should_be_on = self.sensor.is_on() or self.timer is not None
         if should_be_on:
-            if not self.light.is_on() or self.gave_order_to_turn_off:
+            # Effective state takes into account the commands we have sent but that haven't been applied yet, so we
+            # don't skip the turn_on command while it's still turning off
+            if self.light.is_effectively_off():
                 if self.is_night():
                     # Let's not get super bright light when going to the bathroom at night
                     self.light.turn_on(
@@ -63,11 +64,9 @@ class SensorLightNightMode(hass.Hass):
                     self.light.turn_on(
                         brightness=255, color_temp_kelvin=2202, transition=0.1
                     )
-                self.gave_order_to_turn_off = False
         else:
-            if self.light.is_on():
+            if self.light.is_effectively_on():
                 self.light.turn_off(transition=3)
-                self.gave_order_to_turn_off = True
 
     def set_timer(self):
         if self.timer is None:
@@ -46,9 +46,16 @@ class ThermostatControl(hass.Hass):
         )
         self.heat_now_switch = self.ha.input_boolean.heat_now
 
-        for person in self.persons:
-            person.phone_device_tracker.listen_state(self.check)
-            person.phone_battery_state.listen_state(self.check)
+        # One callback for all the entities that affect heating
+        self.ha.hapt.listen_many(
+            [
+                entity
+                for person in self.persons
+                for entity in (person.phone_device_tracker, person.phone_battery_state)
+            ]
+            + [self.heat_now_switch],
+            lambda _changed_entity: self.check(),
+        )
 
         self.run_daily(
             self.appdaemon_native_trigger, NIGHT_START
@@ -56,7 +63,6 @@ class ThermostatControl(hass.Hass):
         self.run_daily(
             self.appdaemon_native_trigger, NIGHT_END
         )  # night mode to day mode
-        self.heat_now_switch.listen_state(self.check)
 
         # Listen to heat now switch being on for a while - this is not ideal because AppDaemon doesn't take into account
         # the `last_changed` attribute of the switch, but ideally that should be changed in AppDaemon itself, and
@@ -1,90 +1,2934 @@
-from datetime import datetime
+from array import array
+import asyncio
+import contextvars
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import partial
+import heapq
+import inspect
+import itertools
+import json
+import logging
+import math
+import threading
+import time
+from types import MappingProxyType
+import weakref
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncGenerator,
+    Awaitable,
     Callable,
+    Concatenate,
+    Generator,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
     Literal,
     Optional,
     ParamSpec,
     TypeAlias,
+    TypeVar,
     assert_never,
+    cast,
 )
+from appdaemon.adapi import ADAPI
 from appdaemon.adbase import ADBase
+from appdaemon.plugins.hass.hassapi import Hass
 from appdaemon.utils import sync_decorator
 
 OnOff: TypeAlias = Literal["on", "off"]
 
 FunctionArgsGeneric = ParamSpec("FunctionArgsGeneric")
+ConvertedGeneric = TypeVar("ConvertedGeneric")
+ComputedGeneric = TypeVar("ComputedGeneric")
+
+ReadSet: TypeAlias = dict[str, tuple[str, bool]]
+"entity id -> (namespace, whether attributes were read and not only the state)"
+
+PendingTimer: TypeAlias = tuple[
+    float, int, Callable[..., Any], tuple[Any, ...], dict[str, Any], Hashable | None
+]
+"(due at, sequence, callback, args, kwargs, scope it was set within) of a timer of `Timers`"
+
+_NOT_CACHED: Any = object()
+"Sentinel for values that are not in the repeatable read caches yet"
+
+ServiceCall: TypeAlias = tuple[str, str, dict[str, Any], str | None]
+"(domain, service, data, namespace)"
+
+
+class ServiceCallBuffer:
+    """
+    Service calls buffered during a callback, to be sent at the end of it.
+
+    Calls to the same service with the same data (other than `entity_id`) are merged into a single call targeting all
+    the entities. A call is only merged into an earlier one if no call in between targets any of the same entities (or
+    has no explicit target), so that the order of the calls is preserved for every entity.
+    """
+
+    def __init__(self):
+        self.calls: list[tuple[ServiceCall, list[str] | None]] = []
+        "(call without entity_id, targeted entity ids - None if the call has no explicit target)"
+
+    def add(
+        self, domain: str, service: str, data: dict[str, Any], namespace: str | None
+    ) -> None:
+        entity_ids = data.get("entity_id")
+        if entity_ids is None:
+            self.calls.append(((domain, service, data, namespace), None))
+            return
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        data = {k: v for k, v in data.items() if k != "entity_id"}
+        call = (domain, service, data, namespace)
+        for previous_call, previous_entity_ids in reversed(self.calls):
+            if previous_entity_ids is not None and previous_call == call:
+                previous_entity_ids.extend(
+                    entity_id
+                    for entity_id in entity_ids
+                    if entity_id not in previous_entity_ids
+                )
+                return
+            if previous_entity_ids is None or any(
+                entity_id in previous_entity_ids for entity_id in entity_ids
+            ):
+                # Merging further back would reorder calls for that entity
+                break
+        self.calls.append((call, list(entity_ids)))
+
+    def drain(self) -> list[ServiceCall]:
+        "Returns the buffered calls, with their `entity_id` restored, and empties the buffer"
+        calls: list[ServiceCall] = []
+        for (domain, service, data, namespace), entity_ids in self.calls:
+            if entity_ids is not None:
+                data = {
+                    **data,
+                    "entity_id": entity_ids[0] if len(entity_ids) == 1 else entity_ids,
+                }
+            calls.append((domain, service, data, namespace))
+        self.calls.clear()
+        return calls
+
+
+ON_OFF_DOMAINS = {"light", "switch", "input_boolean", "fan", "siren"}
+"Domains whose `turn_on`/`turn_off` services set the state to `on`/`off`"
+
+NO_STATE_EFFECT_FIELDS = {"entity_id", "transition"}
+"Service call fields that affect how a command is applied but not the resulting state"
+
+
+class PendingCommand:
+    """
+    A service call sent to an entity whose effect has not been observed in the entity's state yet.
+
+    The expected effect is the resulting state when it is known from the service (e.g. `on` for `light.turn_on`), and
+    the value of every field of the call that is also an attribute of the entity (e.g. `brightness`).
+    """
+
+    def __init__(self, domain: str, service: str, data: dict[str, Any], sent_at: float):
+        self.domain = domain
+        self.service = service
+        self.data = {
+            k: v for k, v in data.items() if k != "entity_id" and v is not None
+        }
+        self.sent_at = sent_at
+        self.expected_state = expected_state_after(domain, service, data)
+
+    def expected_effects(self, entity_state: dict[str, Any]) -> dict[str | None, Any]:
+        "attribute (None for the state itself) -> value it is expected to have once the command has been applied"
+        effects: dict[str | None, Any] = {
+            field: value
+            for field, value in self.data.items()
+            if field not in NO_STATE_EFFECT_FIELDS
+            and field in entity_state["attributes"]
+        }
+        if self.expected_state is not None:
+            effects[None] = self.expected_state
+        return effects
+
+    def has_unknown_effects(self, entity_state: dict[str, Any]) -> bool:
+        "Whether some field of the call is not an attribute of the entity, so its effect cannot be checked"
+        return any(
+            field not in NO_STATE_EFFECT_FIELDS
+            and field not in entity_state["attributes"]
+            for field in self.data
+        )
+
+    def is_observed_in(self, entity_state: dict[str, Any]) -> bool:
+        return all(
+            values_match(state_value(entity_state, attribute), value)
+            for attribute, value in self.expected_effects(entity_state).items()
+        )
+
+
+def expected_state_after(domain: str, service: str, data: dict[str, Any]) -> str | None:
+    "State an entity is expected to have after the given service call, if it can be known"
+    match (domain, service):
+        case (_, "turn_on") if domain in ON_OFF_DOMAINS:
+            return "on"
+        case (_, "turn_off") if domain in ON_OFF_DOMAINS:
+            return "off"
+        case ("climate", "set_hvac_mode"):
+            return data.get("hvac_mode")
+        case ("select" | "input_select", "select_option"):
+            return data.get("option")
+        case _:
+            return None
+
+
+def state_value(entity_state: dict[str, Any], attribute: str | None) -> Any:
+    if attribute is None:
+        return entity_state["state"]
+    return entity_state["attributes"].get(attribute)
+
+
+def values_match(actual: Any, expected: Any) -> bool:
+    # Home Assistant gives back lists for what we send as tuples (e.g. colors)
+    if isinstance(actual, (list, tuple)) and isinstance(expected, (list, tuple)):
+        return list(cast(Iterable[Any], actual)) == list(cast(Iterable[Any], expected))
+    return actual == expected
+
+
+class RateLimiter:
+    """
+    Rate limit of the calls to one service for one entity, with last-write-wins debouncing: calls made less than
+    `min_interval_s` after the previous one are delayed, and only the last of those is eventually sent.
+    """
+
+    def __init__(self, min_interval_s: float):
+        self.min_interval_s = min_interval_s
+        self.last_sent_at = float("-inf")
+        self.deferred: ServiceCall | None = None
+        "Latest call made during the current window, to be sent at the end of it"
+        self.generation = 0
+        "Incremented every time a deferred call is scheduled, so that outdated timers can be ignored"
+        self.sent = 0
+        "Number of calls sent right away"
+        self.delayed = 0
+        "Number of calls sent at the end of a window"
+        self.superseded = 0
+        "Number of calls that were dropped because a later call replaced them in the same window"
+
+
+class BurstLimiter:
+    """
+    Collapses bursts of events into a single invocation of a state callback, and limits how often it may run.
+
+    An event either lets the callback run right away, or schedules a single invocation (through AppDaemon's scheduler,
+    so that it gets a fresh repeatable read snapshot) that absorbs all the events until it runs:
+    - with `coalesce_s`, invocations happen that long after the first event of a burst,
+    - with `throttle_s`, invocations happen at least that long after the previous one.
+
+    The scheduled invocation is cancelled along with the subscription (see `cancel`), and not scheduled at all if it
+    would only happen after the subscription times out.
+    """
+
+    def __init__(
+        self,
+        hapt: "HaptSharedState",
+        invoke: Callable[..., Any],
+        coalesce_ms: int | None,
+        throttle_s: float | None,
+        timeout_s: float | None = None,
+    ):
+        self.hapt = hapt
+        self.invoke = invoke
+        "Runs the user callback, with the arguments given to `on_event`. Returns an awaitable for async callbacks."
+        self.coalesce_s = (coalesce_ms or 0) / 1000
+        self.throttle_s = throttle_s or 0
+        self.expires_at = (
+            float("inf") if timeout_s is None else hapt.monotonic() + timeout_s
+        )
+        "When the subscription times out"
+        self.last_run_at = float("-inf")
+        self.scheduled = False
+        self.timer: Any = None
+        "Handle of the AppDaemon timer of the scheduled invocation (from the event loop, the task that creates it)"
+        self.cancelled = False
+        self.latest_args: tuple[Any, ...] = ()
+        "Arguments of the latest event, that the scheduled invocation will be given"
+        self.absorbed = 0
+        "Number of events that didn't cause an invocation of their own"
+
+    def on_event(self, *invoke_args: Any) -> bool:
+        """
+        Returns:
+            bool: True if the callback should be invoked right away, False if the event was absorbed by a scheduled
+            invocation.
+        """
+        self.latest_args = invoke_args
+        if self.scheduled or self.cancelled:
+            self.absorbed += 1
+            return False
+        now = self.hapt.monotonic()
+        delay = max(self.coalesce_s, self.last_run_at + self.throttle_s - now)
+        if delay <= 0:
+            self.last_run_at = now
+            return True
+        if now + delay >= self.expires_at:
+            # The subscription will be gone by then
+            self.absorbed += 1
+            return False
+        self.scheduled = True
+        self.timer = self.hapt.adapi.run_in(
+            (
+                self._scheduled_invocation_async
+                if inspect.iscoroutinefunction(self.invoke)
+                else self._scheduled_invocation
+            ),
+            delay,
+        )
+        return False
+
+    def cancel(self) -> None:
+        "Cancels the scheduled invocation, if any, once the subscription is cancelled"
+        self.cancelled = True
+        timer, self.timer = self.timer, None
+        if timer is None or not self.scheduled:
+            return
+        resolved = resolved_handle(timer)
+        if resolved is not None:
+            self.hapt.adapi.cancel_timer(resolved, silent=True)
+        else:
+            # Still being created
+            def cancel_once_created(task: "asyncio.Future[str]") -> None:
+                self.hapt.adapi.cancel_timer(task.result(), silent=True)
+
+            timer.add_done_callback(cancel_once_created)
+
+    def _scheduled_invocation(self, cb_args: dict[str, Any]) -> None:
+        self.scheduled = False
+        if self.cancelled:
+            return
+        self.last_run_at = self.hapt.monotonic()
+        with self.hapt.callback_context():
+            self.invoke(*self.latest_args)
+
+    async def _scheduled_invocation_async(self, cb_args: dict[str, Any]) -> None:
+        self.scheduled = False
+        if self.cancelled:
+            return
+        self.last_run_at = self.hapt.monotonic()
+        with self.hapt.callback_context():
+            await self.invoke(*self.latest_args)
+
+
+class Threshold:
+    """
+    Whether the values of a numeric entity are past `above` and/or `below` (see `Entity.listen_numeric_threshold`).
+
+    Values match like in Home Assistant's numeric state triggers: above `above` if given, and below `below` if given
+    (so between them if both are). Once matching, values have to go `hysteresis` back past a threshold to stop
+    matching, so that a sensor hovering around a threshold doesn't cause a transition on every report. Values that
+    aren't numbers (`unavailable`...) are ignored.
+    """
+
+    def __init__(
+        self, above: float | None, below: float | None, hysteresis: float = 0.0
+    ):
+        if above is None and below is None:
+            raise ValueError("A threshold needs `above`, `below` or both")
+        self.above = above
+        self.below = below
+        self.hysteresis = hysteresis
+        self.matching: bool | None = None
+        "None until the first value was seen"
+        self.transitions = 0
+        self.ignored = 0
+        "Number of values that didn't cause a transition"
+
+    def matches(self, value: float) -> bool:
+        margin = self.hysteresis if self.matching else 0.0
+        return (self.above is None or value > self.above - margin) and (
+            self.below is None or value < self.below + margin
+        )
+
+    def update(self, old: Any, new: Any) -> bool | None:
+        """
+        Feeds the old and new states of a state change.
+
+        Returns:
+            bool | None: True if the values started matching, False if they stopped, None if nothing changed
+        """
+        if self.matching is None:
+            # The state the entity had when the subscription was made is not a transition
+            try:
+                self.matching = self.matches(float(old))
+            except (TypeError, ValueError):
+                self.matching = False
+        try:
+            matching = self.matches(float(new))
+        except (TypeError, ValueError):
+            matching = self.matching
+        if matching == self.matching:
+            self.ignored += 1
+            return None
+        self.matching = matching
+        self.transitions += 1
+        return matching
+
+
+class Timers:
+    """
+    Many logical timers, each identified by a key (e.g. the entity it is about), multiplexed onto a single AppDaemon
+    timer.
+
+    Setting, rescheduling and cancelling timers only touches a heap (O(log n)): AppDaemon's scheduler only ever holds
+    the timer for the earliest due time, so e.g. pushing back hundreds of occupancy timers on every sensor update
+    doesn't create and cancel AppDaemon timers each time. Timers due within `BATCH_WINDOW_S` of each other fire
+    together, in the same AppDaemon callback, and thus share the same fresh repeatable read snapshot.
+    """
+
+    BATCH_WINDOW_S = 0.05
+    MAX_LEARNED_READ_SETS = 1024
+    "Beyond this many keys, what the oldest of them read is forgotten, so that ever-new keys don't leak memory"
+
+    def __init__(self, hapt: "HaptSharedState"):
+        self.hapt = hapt
+        self.heap: list[tuple[float, int, Hashable]] = []
+        "(due at, sequence, key), including entries of timers since rescheduled or cancelled, skipped when popped"
+        self.pending: dict[Hashable, PendingTimer] = {}
+        "key -> (due at, sequence, callback, args, kwargs, scope it was set within)"
+        self.learned_read_sets: dict[Hashable, ReadSet] = {}
+        "See `HaptSharedState.run_callback`"
+        self.sequence = 0
+        self.armed_at: float | None = None
+        "When the AppDaemon timer is due, if one is armed"
+        self.generation = 0
+        "Identifies the current AppDaemon timer: older ones were superseded by an earlier due time and do nothing"
+        self.lock = threading.Lock()
+        "Timers may be set both from worker threads and from async callbacks on the event loop"
+        self.armed = 0
+        "How many AppDaemon timers were created"
+        self.fired = 0
+
+    def set(
+        self,
+        key: Hashable,
+        delay_s: float,
+        callback: Callable[FunctionArgsGeneric, Any],
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> None:
+        """
+        Schedules `callback(*args, **kwargs)` to run in `delay_s` seconds, replacing the timer `key` if it is set.
+
+        The callback runs like a wrapped state callback: with fresh repeatable read caches, prefetching what it read the
+        previous time the timer of that key fired. Async callbacks run on the event loop.
+        """
+        due_at = self.hapt.monotonic() + delay_s
+        subscriptions = self.hapt.subscriptions
+        scope = subscriptions.scope
+        if scope is not None:
+            with subscriptions.lock:
+                subscriptions.timer_scopes.setdefault(scope, set()).add(key)
+        with self.lock:
+            self.sequence += 1
+            replaced = self.pending.get(key)
+            self.pending[key] = (due_at, self.sequence, callback, args, kwargs, scope)
+            heapq.heappush(self.heap, (due_at, self.sequence, key))
+            if len(self.heap) > 2 * len(self.pending) + 64:
+                # Too many stale entries from rescheduled timers
+                self.heap = [
+                    (due_at, sequence, key)
+                    for key, (due_at, sequence, *_) in self.pending.items()
+                ]
+                heapq.heapify(self.heap)
+            to_arm = self._arm_if_earlier(due_at)
+        if replaced is not None and replaced[5] != scope:
+            self._unscope(key, replaced)
+        if to_arm is not None:
+            self._arm(*to_arm)
+
+    def cancel(self, key: Hashable) -> bool:
+        "Cancels the timer `key`, returning whether it was set"
+        with self.lock:
+            # Its heap entry is skipped when it comes up
+            entry = self.pending.pop(key, None)
+        self._unscope(key, entry)
+        return entry is not None
+
+    def forget(self, key: Hashable) -> bool:
+        "Cancels the timer `key` for good, also forgetting what it read. Returns whether it was set."
+        with self.lock:
+            self.learned_read_sets.pop(key, None)
+        return self.cancel(key)
+
+    def _unscope(self, key: Hashable, entry: PendingTimer | None) -> None:
+        "Removes a timer that fired, was cancelled or moved to another scope from the scope it was set within"
+        if entry is None or entry[5] is None:
+            return
+        subscriptions = self.hapt.subscriptions
+        with subscriptions.lock:
+            keys = subscriptions.timer_scopes.get(entry[5])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del subscriptions.timer_scopes[entry[5]]
+
+    def clear(self) -> None:
+        "Cancels all the timers"
+        with self.lock:
+            cancelled = list(self.pending.items())
+            self.pending.clear()
+            self.heap.clear()
+            # The AppDaemon timer already armed does nothing when it fires, and the next timer set arms a new one
+            self.armed_at = None
+            self.generation += 1
+        for key, entry in cancelled:
+            self._unscope(key, entry)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.pending
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def remaining_s(self, key: Hashable) -> float | None:
+        "Seconds until the timer `key` fires, or None if it is not set"
+        entry = self.pending.get(key)
+        return None if entry is None else max(0.0, entry[0] - self.hapt.monotonic())
+
+    def _arm_if_earlier(self, due_at: float) -> tuple[int, float] | None:
+        "Must hold the lock. Returns what to pass to `_arm` if the AppDaemon timer has to fire sooner."
+        if self.armed_at is not None and self.armed_at <= due_at:
+            return None
+        self.armed_at = due_at
+        self.generation += 1
+        return self.generation, due_at
+
+    def _arm(self, generation: int, due_at: float) -> None:
+        # The superseded AppDaemon timer is not cancelled: that would cost as much as letting it fire, and from the
+        # event loop `run_in` doesn't even return its handle
+        self.armed += 1
+        self.hapt.adapi.run_in(
+            self._fire,
+            max(0.0, due_at - self.hapt.monotonic()),
+            generation=generation,
+        )
+
+    def _fire(self, cb_args: dict[str, Any]) -> None:
+        due: list[tuple[Hashable, PendingTimer]] = []
+        with self.lock:
+            if cb_args["generation"] != self.generation:
+                return
+            self.armed_at = None
+            horizon = self.hapt.monotonic() + self.BATCH_WINDOW_S
+            while self.heap and self.heap[0][0] <= horizon:
+                _, sequence, key = heapq.heappop(self.heap)
+                entry = self.pending.get(key)
+                if entry is not None and entry[1] == sequence:
+                    del self.pending[key]
+                    due.append((key, entry))
+            while self.heap and self._is_stale(self.heap[0]):
+                heapq.heappop(self.heap)
+            to_arm = self._arm_if_earlier(self.heap[0][0]) if self.heap else None
+        if to_arm is not None:
+            self._arm(*to_arm)
+        for key, entry in due:
+            self._unscope(key, entry)
+        first_error: Exception | None = None
+        # The sync callbacks share the same caches, async ones get their own as they run concurrently
+        with self.hapt.callback_context():
+            for key, (_, _, callback, args, kwargs, _) in due:
+                self.fired += 1
+                learned_read_set = self._learned_read_set(key)
+                try:
+                    if inspect.iscoroutinefunction(callback):
+                        self.hapt.AD.futures.add_future(
+                            self.hapt.name,
+                            asyncio.run_coroutine_threadsafe(
+                                self.hapt.run_callback_async(
+                                    learned_read_set, callback, *args, **kwargs
+                                ),
+                                self.hapt.AD.loop,
+                            ),
+                        )
+                    else:
+                        self.hapt.run_callback(
+                            learned_read_set, callback, *args, **kwargs
+                        )
+                except Exception as error:
+                    # Don't let one timer prevent the others due at the same time from running
+                    first_error = first_error or error
+        if first_error is not None:
+            raise first_error
+
+    def _learned_read_set(self, key: Hashable) -> ReadSet:
+        learned_read_set = self.learned_read_sets.get(key)
+        if learned_read_set is None:
+            with self.lock:
+                while len(self.learned_read_sets) >= self.MAX_LEARNED_READ_SETS:
+                    # Dicts keep insertion order, so this is the key that was learned first
+                    del self.learned_read_sets[next(iter(self.learned_read_sets))]
+                learned_read_set = self.learned_read_sets.setdefault(key, {})
+        return learned_read_set
+
+    def _is_stale(self, heap_entry: tuple[float, int, Hashable]) -> bool:
+        entry = self.pending.get(heap_entry[2])
+        return entry is None or entry[1] != heap_entry[1]
+
+
+class Subscriptions:
+    """
+    Registry of the state subscriptions that HAPT made with AppDaemon for an app, and of the scopes of its timers, so
+    that they may be counted, cancelled together, and cleaned up when the app terminates.
+
+    A subscription made again and again for the same entity and callback (typically by an app that re-registers its
+    listeners every time something happens, without cancelling the previous ones) slows down the dispatch of every
+    event of that entity, so a warning is logged when their number reaches `leak_warning_threshold`, then every time
+    it doubles.
+
+    Subscriptions cancelled directly through AppDaemon, or that timed out, are only noticed when counting them, by
+    looking them up in AppDaemon's own registry of callbacks.
+    """
+
+    def __init__(self, hapt: "HaptSharedState"):
+        self.hapt = hapt
+        self.handles: dict[Any, tuple[tuple[str, ...], str, Hashable | None]] = {}
+        """
+        Handle of the AppDaemon subscription -> (entity ids, callback name, scope). From async code, handles are the
+        tasks that register the subscriptions.
+        """
+        self.on_cancel: dict[Any, Callable[[], Any]] = {}
+        "Handle -> what to clean up once the subscription is gone, e.g. the invocations it scheduled"
+        self.timer_scopes: dict[Hashable, set[Hashable]] = {}
+        "scope -> keys of the timers of `HaptSharedState.timers` set within it"
+        self.scopes: contextvars.ContextVar[Hashable | None] = contextvars.ContextVar(
+            f"hapt_scope_{hapt.name}", default=None
+        )
+        """
+        Scope of the subscriptions and timers being made (see `scoped`), per thread and async task, so that callbacks
+        running concurrently don't tag each other's subscriptions
+        """
+        self.counts: dict[tuple[str, str], int] = {}
+        "(entity id, callback name) -> number of subscriptions in `handles`"
+        self.leak_warning_threshold = 20
+        self.warned_at: dict[tuple[str, str], int] = {}
+        "(entity id, callback name) -> count for which a warning was logged last"
+        self.lock = threading.Lock()
+        "Subscriptions may be made both from worker threads and from async code on the event loop"
+
+    def add(
+        self,
+        handle: Any,
+        entity_ids: Iterable[str],
+        callback: Callable[..., Any],
+        on_cancel: Callable[[], Any] | None = None,
+    ) -> Any:
+        """
+        Registers the subscription that AppDaemon returned `handle` for, and returns that handle. `on_cancel` is called
+        once the subscription is cancelled, or noticed to have timed out.
+        """
+        name = callback_name(callback)
+        entity_ids = tuple(entity_ids)
+        with self.lock:
+            self.handles[handle] = (entity_ids, name, self.scope)
+            if on_cancel is not None:
+                self.on_cancel[handle] = on_cancel
+            for entity_id in entity_ids:
+                self.counts[entity_id, name] = self.counts.get((entity_id, name), 0) + 1
+        for entity_id in entity_ids:
+            if self._should_warn(entity_id, name):
+                # Only now look for the subscriptions that are gone, since that means going through all of them
+                self.prune()
+                if self._should_warn(entity_id, name):
+                    count = self.counts[entity_id, name]
+                    self.warned_at[entity_id, name] = count
+                    self.hapt.adapi.log(
+                        "HAPT: %s has %s live subscriptions to %s with callback %s, which are probably leaking: cancel"
+                        " the previous ones before subscribing again",
+                        self.hapt.name,
+                        count,
+                        entity_id,
+                        name,
+                        level="WARNING",
+                    )
+        return handle
+
+    def _should_warn(self, entity_id: str, name: str) -> bool:
+        return self.counts.get((entity_id, name), 0) >= max(
+            self.leak_warning_threshold, 2 * self.warned_at.get((entity_id, name), 0)
+        )
+
+    def _forget(self, handle: Any, cleanups: list[Callable[[], Any]]) -> bool:
+        "Must hold the lock. Adds what to clean up for the subscription to `cleanups`, to be called without the lock."
+        entry = self.handles.pop(handle, None)
+        if entry is None:
+            return False
+        cleanup = self.on_cancel.pop(handle, None)
+        if cleanup is not None:
+            cleanups.append(cleanup)
+        entity_ids, name, _ = entry
+        for entity_id in entity_ids:
+            self.counts[entity_id, name] -= 1
+            if not self.counts[entity_id, name]:
+                del self.counts[entity_id, name]
+        return True
+
+    def prune(self) -> None:
+        "Forgets the subscriptions that AppDaemon no longer has, if it can tell"
+        callbacks = getattr(getattr(self.hapt.AD, "callbacks", None), "callbacks", None)
+        if callbacks is None:
+            return
+        live = callbacks.get(self.hapt.name, {})
+        cleanups: list[Callable[[], Any]] = []
+        with self.lock:
+            for handle in list(self.handles):
+                resolved = resolved_handle(handle)
+                if resolved is not None and resolved not in live:
+                    self._forget(handle, cleanups)
+        for cleanup in cleanups:
+            cleanup()
+
+    def __len__(self) -> int:
+        self.prune()
+        return len(self.handles)
+
+    def per_entity(self) -> dict[str, int]:
+        "entity id -> number of live subscriptions that concern it"
+        self.prune()
+        counts: dict[str, int] = {}
+        with self.lock:
+            for entity_ids, _, _ in self.handles.values():
+                for entity_id in entity_ids:
+                    counts[entity_id] = counts.get(entity_id, 0) + 1
+        return counts
+
+    @contextmanager
+    def scoped(self, scope: Hashable) -> Generator[None, None, None]:
+        """
+        Tags the subscriptions and timers made within the block with `scope`, so that they may all be cancelled at once
+        with `cancel_scope`, e.g. those of one room.
+        """
+        token = self.scopes.set(scope)
+        try:
+            yield
+        finally:
+            self.scopes.reset(token)
+
+    @property
+    def scope(self) -> Hashable | None:
+        "Scope of the subscriptions and timers being made in the current thread or async task (see `scoped`)"
+        return self.scopes.get()
+
+    def cancel(self, handle: Any) -> bool:
+        "Cancels a subscription, returning whether it was registered"
+        cleanups: list[Callable[[], Any]] = []
+        with self.lock:
+            if not self._forget(handle, cleanups):
+                return False
+        for cleanup in cleanups:
+            cleanup()
+        resolved = resolved_handle(handle)
+        if resolved is not None:
+            self.hapt.adapi.cancel_listen_state(resolved, silent=True)
+        else:
+            # Still being registered
+            def cancel_once_registered(task: "asyncio.Future[str]") -> None:
+                self.hapt.adapi.cancel_listen_state(task.result(), silent=True)
+
+            handle.add_done_callback(cancel_once_registered)
+        return True
+
+    def cancel_scope(self, scope: Hashable) -> int:
+        "Cancels the subscriptions and timers made within `scoped(scope)`, returning how many there were"
+        with self.lock:
+            handles = [
+                handle
+                for handle, (_, _, handle_scope) in self.handles.items()
+                if handle_scope == scope
+            ]
+            timer_keys = self.timer_scopes.pop(scope, set())
+        return sum(self.cancel(handle) for handle in handles) + sum(
+            self.hapt.timers.cancel(key) for key in timer_keys
+        )
+
+    def clear(self) -> None:
+        """
+        Forgets all the subscriptions and cancels all the timers, when the app terminates. AppDaemon cancels the
+        subscriptions of terminated apps itself.
+        """
+        with self.lock:
+            self.handles.clear()
+            self.on_cancel.clear()
+            self.counts.clear()
+            self.timer_scopes.clear()
+            self.warned_at.clear()
+        self.hapt.timers.clear()
+
+
+SUBSCRIPTIONS: "weakref.WeakSet[Subscriptions]" = weakref.WeakSet()
+"Subscription registries of all the apps of the AppDaemon instance"
+
+
+def subscriptions_per_app() -> dict[str, int]:
+    "app name -> number of live subscriptions made through HAPT (see `Subscriptions`)"
+    counts: dict[str, int] = {}
+    for subscriptions in list(SUBSCRIPTIONS):
+        name = subscriptions.hapt.name
+        counts[name] = counts.get(name, 0) + len(subscriptions)
+    return counts
+
+
+def resolved_handle(handle: Any) -> Any:
+    """
+    The handle of an AppDaemon subscription, given what `listen_state` returned: from the event loop, that is the task
+    that registers the subscription. None if that task isn't done yet.
+    """
+    if isinstance(handle, asyncio.Future):
+        return handle.result() if handle.done() else None
+    return handle
+
+
+class ServiceCallQueue:
+    """
+    Service calls sent in the background, without waiting for Home Assistant to acknowledge them.
+
+    Calls targeting the same entity are sent in the order they were queued, while calls targeting different entities
+    are sent concurrently. Calls without a target are ordered among themselves. Calls that are awaited (see
+    `send_in_order`) are ordered with the queued ones as well.
+
+    At most `hapt.max_queued_calls` calls may be waiting: once that is reached, queueing blocks the calling thread until
+    a call completes (backpressure), so that a runaway app can't accumulate an unbounded backlog. The limit is read on
+    every call, so changing it applies right away.
+    """
+
+    def __init__(self, hapt: "HaptSharedState"):
+        self.hapt = hapt
+        self.slots = threading.Condition()
+        "Notified whenever a queued call completes"
+        self.waiting = 0
+        "Number of calls that hold a slot in the queue. Guarded by `slots`."
+        self.last_sent: dict[str | None, asyncio.Future[None]] = {}
+        "target -> last call queued for it. Only accessed from the event loop."
+        self.queued = 0
+        "Number of calls queued so far"
+        self.in_flight = 0
+        "Number of calls that were queued and haven't completed yet"
+        self.failed = 0
+        "Number of calls that Home Assistant (or AppDaemon) rejected"
+
+    def put(self, call: ServiceCall) -> None:
+        "Queues a call, blocking while the queue is full unless called from the event loop"
+        on_loop = threading.get_ident() == self.hapt.AD.main_thread_id
+        with self.slots:
+            # The event loop must never block, and couldn't make progress on the queue if it did, so it may overflow it
+            while not on_loop and self.waiting >= self.hapt.max_queued_calls:
+                self.slots.wait()
+            self.waiting += 1
+        if on_loop:
+            self._start(call)
+        else:
+            if self.hapt.metrics is not None:
+                self.hapt.metrics.count("loop_hops")
+            self.hapt.AD.loop.call_soon_threadsafe(self._start, call)
+
+    async def send_in_order(self, call: ServiceCall) -> None:
+        """
+        Sends a call once the calls queued before it for the same targets have been sent, and waits for it to be
+        acknowledged. Must be called from the event loop.
+        """
+
+        async def send(previous: list[asyncio.Future[None]]) -> None:
+            if previous:
+                await asyncio.wait(previous)
+            domain, service, data, namespace = call
+            await self.hapt.call_service_async(
+                domain, service, data, namespace=namespace
+            )
+
+        await self._chain(call, send)
+
+    def _start(self, call: ServiceCall) -> None:
+        self.queued += 1
+        self.in_flight += 1
+        self._chain(call, lambda previous: self._send(call, previous))
+
+    def _chain(
+        self,
+        call: ServiceCall,
+        send: Callable[[list[asyncio.Future[None]]], Awaitable[None]],
+    ) -> "asyncio.Future[None]":
+        "Starts sending a call after the previous ones for its targets, as the last one for these targets"
+        targets = call_targets(call)
+        previous = [self.last_sent[t] for t in targets if t in self.last_sent]
+        task = asyncio.ensure_future(send(previous))
+        for target in targets:
+            self.last_sent[target] = task
+
+        def forget(task: asyncio.Future[None]) -> None:
+            for target in targets:
+                if self.last_sent.get(target) is task:
+                    del self.last_sent[target]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def _send(
+        self, call: ServiceCall, previous: list[asyncio.Future[None]]
+    ) -> None:
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            domain, service, data, namespace = call
+            await self.hapt.call_service_async(
+                domain, service, data, namespace=namespace
+            )
+        except Exception as e:
+            self.failed += 1
+            self.hapt.report_call_error(call, e)
+        finally:
+            self.in_flight -= 1
+            with self.slots:
+                self.waiting -= 1
+                self.slots.notify()
+
+
+def call_targets(call: ServiceCall) -> list[str | None]:
+    entity_id = call[2].get("entity_id")
+    if entity_id is None:
+        return [None]
+    if isinstance(entity_id, str):
+        return [entity_id]
+    return list(entity_id)
+
+
+class Histogram:
+    """
+    Distribution of durations, in seconds.
+
+    Values are only counted in fixed exponential buckets, so that recording them is cheap and memory doesn't grow with
+    the number of values. Percentiles are therefore approximate (upper bound of their bucket).
+    """
+
+    BOUNDS_S = (0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS_S) + 1)
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, duration_s: float) -> None:
+        self.buckets[bisect_left(self.BOUNDS_S, duration_s)] += 1
+        self.count += 1
+        self.total_s += duration_s
+        if duration_s > self.max_s:
+            self.max_s = duration_s
+
+    def percentile(self, fraction: float) -> float:
+        "Upper bound of the bucket that contains the given fraction (e.g. 0.99) of the values"
+        threshold = fraction * self.count
+        seen = 0
+        for bound_s, bucket in zip(self.BOUNDS_S, self.buckets):
+            seen += bucket
+            if seen >= threshold:
+                return min(bound_s, self.max_s)
+        return self.max_s
+
+    def summary(self) -> dict[str, float]:
+        "count, total/mean/p50/p99/max in milliseconds"
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_s * 1000, 3),
+            "mean_ms": round(self.total_s * 1000 / self.count, 3) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max_s * 1000, 3),
+        }
+
+
+class HaptMetrics:
+    """
+    Counters and durations of what an app does through HAPT, to find out e.g. which app hammers the event loop.
+
+    Counters:
+    - `cache_hits`/`cache_misses`: repeatable reads served from the caches, or not
+    - `loop_hops`: round trips from a worker thread to the event loop (fetches, service calls)
+    - `service_calls`: service calls sent to Home Assistant
+    - `callbacks`: wrapped callbacks run
+
+    Counters that relate to an entity are also broken down per entity, and callback durations per callback.
+    """
+
+    def __init__(self):
+        self.counters: dict[str, int] = {}
+        self.per_entity: dict[str, dict[str, int]] = {}
+        self.service_call_duration = Histogram()
+        "How long Home Assistant (through AppDaemon) takes to acknowledge service calls"
+        self.callback_duration = Histogram()
+        "How long wrapped callbacks run"
+        self.per_callback_duration: dict[str, Histogram] = {}
+
+    def count(self, counter: str, entity_id: str | None = None, n: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + n
+        if entity_id is not None:
+            entity_counters = self.per_entity.get(entity_id)
+            if entity_counters is None:
+                entity_counters = self.per_entity[entity_id] = {}
+            entity_counters[counter] = entity_counters.get(counter, 0) + n
+
+    def record_callback(self, callback: Callable[..., Any], duration_s: float) -> None:
+        self.callback_duration.record(duration_s)
+        name = callback_name(callback)
+        histogram = self.per_callback_duration.get(name)
+        if histogram is None:
+            histogram = self.per_callback_duration[name] = Histogram()
+        histogram.record(duration_s)
+
+    def snapshot(self, top: int = 10) -> dict[str, Any]:
+        """
+        All the metrics as plain data, with only the `top` entities (by loop hops and reads) and callbacks (by total
+        duration).
+        """
+        busiest_entities = sorted(
+            self.per_entity.items(),
+            key=lambda item: (
+                item[1].get("loop_hops", 0),
+                item[1].get("cache_hits", 0) + item[1].get("cache_misses", 0),
+            ),
+            reverse=True,
+        )[:top]
+        slowest_callbacks = sorted(
+            self.per_callback_duration.items(),
+            key=lambda item: item[1].total_s,
+            reverse=True,
+        )[:top]
+        return {
+            "counters": dict(self.counters),
+            "service_call_duration": self.service_call_duration.summary(),
+            "callback_duration": self.callback_duration.summary(),
+            "entities": {entity_id: dict(c) for entity_id, c in busiest_entities},
+            "callbacks": {name: h.summary() for name, h in slowest_callbacks},
+        }
+
+    def summary(self) -> str:
+        "One-line summary, for logs"
+        hits = self.counters.get("cache_hits", 0)
+        reads = hits + self.counters.get("cache_misses", 0)
+        return (
+            f"{self.counters.get('callbacks', 0)} callbacks"
+            f" (p99 {self.callback_duration.summary()['p99_ms']}ms),"
+            f" {self.counters.get('loop_hops', 0)} loop hops,"
+            f" {reads} reads ({hits / reads if reads else 1:.0%} cached),"
+            f" {self.counters.get('service_calls', 0)} service calls"
+            f" (p99 {self.service_call_duration.summary()['p99_ms']}ms)"
+        )
+
+
+def callback_name(callback: Callable[..., Any]) -> str:
+    while isinstance(callback, partial):
+        callback = callback.func
+    return getattr(callback, "__qualname__", None) or type(callback).__name__
+
+
+METRICS_PER_APP: dict[str, HaptMetrics] = {}
+"app name -> metrics of that app, for apps that enabled them. Shared by all the apps of the AppDaemon instance."
+
+
+def metrics_per_app(top: int = 10) -> dict[str, dict[str, Any]]:
+    "Snapshot of the metrics of every app that enabled them (see `HaptSharedState.enable_metrics`)"
+    return {app: metrics.snapshot(top) for app, metrics in METRICS_PER_APP.items()}
+
+
+class Clocks:
+    "The clocks that HAPT reads: the system's by default, or the virtual time of a stand-in for AppDaemon"
+
+    def __init__(
+        self,
+        monotonic: Callable[[], float] = time.monotonic,
+        wall: Callable[[], float] = time.time,
+    ):
+        self.monotonic = monotonic
+        "For timeouts and rates, in seconds"
+        self.wall = wall
+        "Current time, in seconds since the epoch"
+
+
+CLOCKS: contextvars.ContextVar[Clocks] = contextvars.ContextVar(
+    "hapt_clocks", default=Clocks()
+)
+"Clocks of the `HaptSharedState`s created without explicit ones in the current context"
+KEEP_LISTENERS: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "hapt_keep_listeners", default=False
+)
+"""
+Whether the `HaptSharedState`s created in the current context keep their listeners even while they aren't recording, so
+that recorded traffic may be replayed through them
+"""
+
+
+class Recorder:
+    """
+    Appends everything that a `HaptSharedState` gets from and sends to AppDaemon to a log file, so that the app may
+    later be replayed offline against that traffic (see `homeassistant_python_typer_testing.replay`).
+
+    The log has one JSON array per line, starting with the wall clock time in seconds:
+    - `[t, "c", listener, entity_id, attribute, old, new]`: a state callback registered through HAPT was triggered.
+      `listener` is its index in `HaptSharedState.listeners`, i.e. its rank among the listeners the app registered.
+    - `[t, "r", entity_id, namespace, full, value]`: the state of an entity was fetched (the full state dict if `full`,
+      otherwise only the state).
+    - `[t, "s", domain, service, data, namespace]`: a service call was sent.
+
+    Lines are buffered and written at most every `FLUSH_EVERY_S`, so recording is cheap enough to leave on.
+    """
+
+    FLUSH_EVERY_S = 1.0
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        "Wall clock, in seconds since the epoch"
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        "Records come from both worker threads and the event loop"
+        self.last_flush_at = time.monotonic()
+
+    def write(self, *record: Any) -> None:
+        line = json.dumps(
+            [round(self.clock(), 3), *record],
+            separators=(",", ":"),
+            default=json_default,
+        )
+        with self.lock:
+            if self.file.closed:
+                # Callbacks still running while the app terminates
+                return
+            self.file.write(line + "\n")
+            if time.monotonic() - self.last_flush_at >= self.FLUSH_EVERY_S:
+                self.file.flush()
+                self.last_flush_at = time.monotonic()
+
+    def close(self) -> None:
+        "Writes out the buffered records and closes the log file"
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+                self.file.close()
+
+
+class SharedReads:
+    """
+    Copies of entity states shared by all the apps of the AppDaemon process that enabled `HaptSharedState.shared_reads`,
+    so that when many apps react to the same event, the full state of an entity is only copied once rather than once per
+    app.
+
+    AppDaemon replaces the state dict of an entity on every change instead of updating it in place, so a copy remains
+    valid as long as the dict it was made from is still the current one. Each app still keeps the copies it read in its
+    own repeatable read caches, so every callback keeps seeing the same states however other apps' reads refresh them.
+    Since every app gets the same copy, its dicts are read-only views (see `read_only`), so that no app can modify what
+    the others read.
+
+    Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self):
+        self.copies: dict[tuple[str, str], tuple[dict[str, Any], dict[str, Any]]] = {}
+        "(namespace, entity id) -> (AppDaemon's state dict, copy of it)"
+        self.hits = 0
+        self.copies_made = 0
+
+    def read(self, AD: Any, entity_id: str, namespace: str, full: bool) -> Any:
+        "Same as `ADAPI.get_state` of the full state dict if `full`, otherwise of the state, but with the copy shared"
+        entity_state = AD.state.state.get(namespace, {}).get(entity_id)
+        if entity_state is None:
+            self.copies.pop((namespace, entity_id), None)
+            return None
+        if not full:
+            # States are strings, so there is nothing worth copying
+            return entity_state["state"]
+        shared = self.copies.get((namespace, entity_id))
+        if shared is not None and shared[0] is entity_state:
+            self.hits += 1
+            return shared[1]
+        copied = read_only(entity_state)
+        self.copies[(namespace, entity_id)] = (entity_state, copied)
+        self.copies_made += 1
+        return copied
+
+
+SHARED_READS = SharedReads()
+"Shared by all the apps of the AppDaemon instance (see `HaptSharedState.shared_reads`)"
+
+
+def read_only(value: Any) -> Any:
+    """
+    A copy of `value` (e.g. a full state dict) where all dicts, however deeply nested, are read-only `MappingProxyType`
+    views. Lists are copied but stay lists, so that they still compare equal to lists.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(
+            {key: read_only(item) for key, item in cast(dict[Any, Any], value).items()}
+        )
+    if isinstance(value, list):
+        return [read_only(item) for item in cast(list[Any], value)]
+    return value
+
+
+def json_default(value: Any) -> Any:
+    "Serializes what `json.dumps` can't: read-only views as dicts (see `read_only`), anything else as a string"
+    if isinstance(value, MappingProxyType):
+        return dict(cast(MappingProxyType[Any, Any], value))
+    return str(value)
+
+
+class ResponseCache:
+    """
+    Responses of the services that return some (e.g. `weather.get_forecasts`), shared by all the apps of the AppDaemon
+    process, so that many callbacks asking for the same thing within the TTL they accept cost a single call.
+
+    Responses are keyed by namespace, service and data, and the least recently used ones are dropped beyond
+    `max_entries`. A call made while the same one is in flight waits for its response rather than being sent again.
+    This only runs on the event loop, so it needs no locking.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        "key -> (when the call was made, response), least recently used first"
+        self.in_flight: dict[Hashable, asyncio.Future[Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        "Number of calls that waited for the same call in flight instead of being sent"
+
+    async def get(
+        self,
+        key: Hashable,
+        ttl_s: float,
+        now: float,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        The cached response for `key` if it is less than `ttl_s` old, otherwise that of the call in flight or of a new
+        `fetch()`
+        """
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < ttl_s:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        in_flight = self.in_flight.get(key)
+        if in_flight is None:
+            self.misses += 1
+            in_flight = self.in_flight[key] = asyncio.ensure_future(fetch())
+            in_flight.add_done_callback(partial(self._store, key, now))
+        else:
+            self.joined += 1
+        # Shielded so that a caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(in_flight)
+
+    def _store(
+        self, key: Hashable, called_at: float, in_flight: asyncio.Future[Any]
+    ) -> None:
+        del self.in_flight[key]
+        if in_flight.cancelled() or in_flight.exception() is not None:
+            # Failures aren't cached: the next call tries again
+            return
+        self.entries[key] = (called_at, in_flight.result())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+RESPONSE_CACHE = ResponseCache()
+"Shared by all the apps of the AppDaemon instance (see `HaptSharedState.call_with_response`)"
+
+
+def service_response(domain: str, service: str, result: Any) -> Any:
+    "Extracts the response data from what AppDaemon returns for a call to a Home Assistant service"
+    if not isinstance(result, dict) or "success" not in result:
+        # Not Home Assistant's websocket API (e.g. another plugin)
+        return result
+    if not result["success"]:
+        raise RuntimeError(
+            f"Service call {domain}.{service} failed: {result.get('error', result)}"
+        )
+    # Services whose response is optional may not return any
+    return (result.get("result") or {}).get("response")
+
+
+class ReadContext:
+    """
+    Repeatable read caches of one flow of execution of an app.
+
+    Each wrapped callback invocation gets its own context for its whole duration (it is then `pinned`), so that apps
+    whose callbacks run concurrently on several worker threads (unpinned apps) or as concurrent tasks (async apps) don't
+    clear or pollute each other's caches. Code running outside of wrapped callbacks (`initialize`, callbacks registered
+    directly with AppDaemon...) gets a context per thread, cleared whenever AppDaemon starts a new callback of the app.
+    """
+
+    __slots__ = (
+        "state_cache",
+        "full_cache",
+        "converted_cache",
+        "callback_counter",
+        "read_set",
+        "call_buffer",
+        "pinned",
+        "thread_id",
+    )
+
+    def __init__(self, callback_counter: int, pinned: bool):
+        self.state_cache: dict[str, Any] = {}
+        self.full_cache: dict[str, Any] = {}
+        self.converted_cache: dict[
+            tuple[str, str | None, Callable[[Any], Any]], Any
+        ] = {}
+        "(entity id, attribute, converter) -> converted value, so that values are only parsed once per callback"
+        self.callback_counter = callback_counter
+        "Value of the app's callback counter the caches were filled at, when not pinned"
+        self.read_set: ReadSet | None = None
+        "Entities read by the wrapped callback that is currently running, if any"
+        self.call_buffer: ServiceCallBuffer | None = None
+        "Where service calls are buffered while they are being coalesced (see `HaptSharedState.coalescing_calls`)"
+        self.pinned = pinned
+        "Whether the context belongs to a wrapped callback invocation, so that its caches are kept until it returns"
+        self.thread_id = threading.get_ident()
+        """
+        Thread the context was created in. Contexts are copied into the tasks that threads schedule on the event loop,
+        where they must not be shared with the thread.
+        """
+
+    def clear(self, callback_counter: int) -> None:
+        self.state_cache.clear()
+        self.full_cache.clear()
+        self.converted_cache.clear()
+        self.callback_counter = callback_counter
 
 
 class HaptSharedState:
     """
-    Shared state for Home Assistant Python Typer entities.
+    Shared state for Home Assistant Python Typer entities.
+
+    Methods:
+        __init__(ad: ADBase): Initializes the shared state with the given AppDaemon base instance.
+    """
+
+    __slots__ = (
+        "ad",
+        "adapi",
+        "read_contexts",
+        "local_mirror",
+        "shared_reads",
+        "adaptive_prefetch",
+        "seed_full_state",
+        "coalesce_calls",
+        "pending_commands",
+        "pending_commands_lock",
+        "pending_command_timeout_s",
+        "track_pending_commands",
+        "suppress_redundant_calls",
+        "suppressed_calls",
+        "rate_limits",
+        "rate_limiters",
+        "rate_limit_lock",
+        "fire_and_forget_calls",
+        "max_queued_calls",
+        "call_queue",
+        "on_call_error",
+        "response_ttl_s",
+        "metrics",
+        "recorder",
+        "listeners",
+        "listener_indices",
+        "keep_listeners",
+        "clocks",
+        "timers",
+        "subscriptions",
+    )
+
+    read_contexts: contextvars.ContextVar[ReadContext]
+    "Repeatable read caches of the current callback invocation or thread (see `ReadContext`)"
+    local_mirror: bool
+    """
+    Whether repeatable read cache misses should be served by looking up AppDaemon's own state store directly from the
+    calling thread, instead of querying it through a hop to the event loop. Disabled by default.
+
+    AppDaemon keeps that store current from its `state_changed` subscription, and replaces the state dict of an entity
+    on every change rather than updating it in place, so the repeatable read snapshot of each callback only holds
+    references to these dicts (copy-on-write) and reads become plain dict lookups. The downside is that the dicts
+    returned by `get_state_repeatable_read("all")` are shared with AppDaemon, so they must not be modified.
+    """
+    shared_reads: bool
+    """
+    Whether the states fetched through the event loop should be copied once for all the apps that enable it, rather
+    than once per app (see `SharedReads`). Disabled by default. The dicts returned by
+    `get_state_repeatable_read("all")` are then shared with other apps, so they must not be modified.
+    """
+    adaptive_prefetch: bool
+    """
+    Whether wrapped callbacks should prefetch, in a single hop to the event loop, the entities that they read during
+    their previous invocation.
+    """
+    seed_full_state: bool
+    """
+    Whether state callbacks without a duration should subscribe to the full state of their entities, so that the
+    attributes of the entity that changed are in the caches as well, not only its state. AppDaemon then dispatches
+    every change of the attributes too, for HAPT to filter, so this only pays off for callbacks that read the
+    attributes of the entity that triggered them. Disabled by default.
+    """
+    coalesce_calls: bool
+    """
+    Whether service calls made during a wrapped callback should be buffered and sent at the end of the callback,
+    merging calls to the same service with the same data into a single call targeting several entities. Disabled by
+    default.
+    """
+    pending_commands: dict[str, PendingCommand]
+    "entity id -> last command sent to that entity, until its effect is observed or it times out"
+    pending_commands_lock: threading.Lock
+    "Commands are tracked both from worker threads and from async code on the event loop"
+    pending_command_timeout_s: float
+    "How long after being sent a command is considered lost if its effect hasn't been observed"
+    track_pending_commands: bool
+    """
+    Whether the commands sent to entities are tracked, for `Entity.pending_command` and `Entity.effective_state`.
+    Disabled by default as it takes a lock on every call, and implied by `suppress_redundant_calls`.
+    """
+    suppress_redundant_calls: bool
+    """
+    Whether service calls to an entity that would not change its effective state (that is, its state once the pending
+    commands have been applied) should be dropped. Disabled by default.
+    """
+    suppressed_calls: int
+    "Number of service calls dropped because of `suppress_redundant_calls`"
+    rate_limits: dict[tuple[str | None, str | None], float]
+    "(entity id or None for any, `domain.service` or None for any) -> minimum interval between calls, in seconds"
+    rate_limiters: dict[str, dict[tuple[str, str], RateLimiter]]
+    "entity id -> (domain, service) -> state of the rate limiting of these calls"
+    rate_limit_lock: threading.Lock
+    "Calls are rate limited both from worker threads and from async code on the event loop"
+    fire_and_forget_calls: bool
+    """
+    Whether synchronous service calls should be queued and sent in the background rather than waiting for Home
+    Assistant to acknowledge them (see `ServiceCallQueue`). Disabled by default.
+    """
+    max_queued_calls: int
+    """
+    How many fire-and-forget calls may be waiting before queueing more blocks the calling thread. Changes apply right
+    away, even to calls already waiting for a slot once the next call completes.
+    """
+    call_queue: ServiceCallQueue | None
+    "Where fire-and-forget calls are queued, created on first use"
+    on_call_error: Callable[[ServiceCall, Exception], Any] | None
+    """
+    Called from the event loop with the call and the error when a fire-and-forget call fails. If unset, the failure is
+    logged. If it raises, that is logged as well.
+    """
+    response_ttl_s: float
+    """
+    How long the responses of services (e.g. forecasts) are reused by `call_with_response` when no TTL is given for the
+    call, in seconds
+    """
+    metrics: HaptMetrics | None
+    "Metrics of this app, if enabled (see `enable_metrics`)"
+    recorder: Recorder | None
+    "Where the traffic of this app is recorded, if enabled (see `enable_recording`)"
+    listeners: dict[int, tuple[str, Callable[..., Any]]]
+    """
+    Index -> (callback name, wrapper registered with AppDaemon) of the live state listeners registered through HAPT
+    while recording (or always if `keep_listeners`), for replay. Indices count all the listeners, in registration order.
+    """
+    listener_indices: Iterator[int]
+    keep_listeners: bool
+    "Whether `listeners` are kept even while not recording (see `KEEP_LISTENERS`)"
+    clocks: Clocks
+    "See `monotonic` and `wall_time`"
+    timers: Timers
+    "Timers multiplexed onto a single AppDaemon timer, e.g. one per entity (see `Timers`)"
+    subscriptions: Subscriptions
+    "State subscriptions made through HAPT, to count them and cancel them (see `Subscriptions`)"
+
+    def __init__(self, ad: ADBase, clocks: Clocks | None = None):
+        """
+        Args:
+            ad: The app.
+            clocks: The clocks to read, by default those set in `CLOCKS` (the system's, unless running under a stand-in
+                for AppDaemon).
+        """
+        self.ad = ad
+        self.adapi = ad.get_ad_api()
+        self.read_contexts = contextvars.ContextVar(f"hapt_read_context_{ad.name}")
+        self.local_mirror = False
+        self.shared_reads = False
+        self.adaptive_prefetch = True
+        self.seed_full_state = False
+        self.coalesce_calls = False
+        self.pending_commands = {}
+        self.pending_commands_lock = threading.Lock()
+        self.pending_command_timeout_s = 10.0
+        self.track_pending_commands = False
+        self.suppress_redundant_calls = False
+        self.suppressed_calls = 0
+        self.rate_limits = {}
+        self.rate_limiters = {}
+        self.rate_limit_lock = threading.Lock()
+        self.fire_and_forget_calls = False
+        self.max_queued_calls = 100
+        self.call_queue = None
+        self.on_call_error = None
+        self.response_ttl_s = 60.0
+        self.metrics = None
+        self.recorder = None
+        self.listeners = {}
+        self.listener_indices = itertools.count()
+        self.keep_listeners = KEEP_LISTENERS.get()
+        self.clocks = CLOCKS.get() if clocks is None else clocks
+        self.timers = Timers(self)
+        self.subscriptions = Subscriptions(self)
+        SUBSCRIPTIONS.add(self.subscriptions)
+        self._clean_up_on_terminate()
+
+    # Unfortunately we need those for the sync_decorator to work
+    @property
+    def name(self) -> str:
+        "Name of the appdaemon app that this shared state is linked to"
+        return self.ad.name
+
+    @property
+    def AD(self) -> Any:
+        "AppDaemon instance"
+        return self.ad.AD
+
+    @property
+    def hass(self) -> Hass:
+        "The app, for the parts of AppDaemon's API that only Home Assistant apps (`hass.Hass`) have, e.g. history"
+        if not isinstance(self.ad, Hass):
+            raise TypeError(
+                f"{self.name} is not a hass.Hass app, which it needs to be to query Home Assistant's history"
+            )
+        return self.ad
+
+    def set_rate_limit(
+        self,
+        min_interval_s: float | None,
+        entity: "Entity | str | None" = None,
+        domain: str | None = None,
+        service: str | None = None,
+    ) -> None:
+        """
+        Limits how often a service may be called for each entity.
+
+        Calls made less than `min_interval_s` after the previous one for the same entity and service are delayed to the
+        end of that interval, and if several are made in the meantime only the last one is sent (last-write-wins), e.g.
+        only the last brightness a dimmer was set to. This protects slow Zigbee/Z-Wave meshes from apps that react to
+        fast sensor updates.
+
+        Limits are per entity and per service. The most specific limit applies: one set for an entity and a service,
+        then for an entity and any service, then for a service and any entity, then for any call.
+
+        Args:
+            min_interval_s (float | None): Minimum interval between two calls, in seconds. None removes the limit.
+            entity (Entity | str | None): Entity (or entity id) to limit calls for. None for all entities.
+            domain (str | None): Domain of the service to limit (e.g. 'light'). Must be given with `service`.
+            service (str | None): Name of the service to limit (e.g. 'turn_on'). None for all services.
+        """
+        if (domain is None) != (service is None):
+            raise ValueError("domain and service must be specified together")
+        key = (
+            entity.entity_id if isinstance(entity, Entity) else entity,
+            f"{domain}.{service}" if service is not None else None,
+        )
+        if min_interval_s is None:
+            self.rate_limits.pop(key, None)
+        else:
+            self.rate_limits[key] = min_interval_s
+
+    def rate_limit_for(self, entity_id: str, domain: str, service: str) -> float | None:
+        "Minimum interval between calls of this service for this entity, if any"
+        domain_service = f"{domain}.{service}"
+        for key in (
+            (entity_id, domain_service),
+            (entity_id, None),
+            (None, domain_service),
+            (None, None),
+        ):
+            if key in self.rate_limits:
+                return self.rate_limits[key]
+        return None
+
+    def debounce(
+        self,
+        entity_id: str,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None,
+    ) -> tuple[bool, list[ServiceCall]]:
+        """
+        Applies the rate limit of this service for this entity, if any.
+
+        Returns:
+            tuple[bool, list[ServiceCall]]: Whether the call was deferred (so it must not be sent now), and the deferred
+            calls to other services of the entity, which must be sent before it since it must not overtake them
+        """
+        if not self.rate_limits:
+            return False, []
+        to_send: list[ServiceCall] = []
+        deferred_for_s: float | None = None
+        with self.rate_limit_lock:
+            entity_limiters = self.rate_limiters.setdefault(entity_id, {})
+            for other_key, other_limiter in entity_limiters.items():
+                if other_limiter.deferred is not None and other_key != (
+                    domain,
+                    service,
+                ):
+                    # Calls to other services must not overtake the deferred ones (e.g. a deferred turn_on followed by
+                    # a turn_off should end up off), so these are sent right away
+                    overtaken = self._take_deferred_call(other_limiter)
+                    if overtaken is not None:
+                        to_send.append(overtaken)
+
+            min_interval_s = self.rate_limit_for(entity_id, domain, service)
+            limiter = None
+            deferred = False
+            if min_interval_s is not None:
+                limiter = entity_limiters.get((domain, service))
+                if limiter is None:
+                    limiter = entity_limiters[(domain, service)] = RateLimiter(
+                        min_interval_s
+                    )
+                limiter.min_interval_s = min_interval_s
+                call: ServiceCall = (domain, service, data, namespace)
+                elapsed = self.monotonic() - limiter.last_sent_at
+                if limiter.deferred is not None:
+                    limiter.superseded += 1
+                    limiter.deferred = call
+                    deferred = True
+                elif elapsed >= min_interval_s:
+                    limiter.last_sent_at = self.monotonic()
+                    limiter.sent += 1
+                else:
+                    limiter.deferred = call
+                    limiter.generation += 1
+                    deferred = True
+                    deferred_for_s = min_interval_s - elapsed
+        # Scheduling timers may not happen with the lock held, as it hops to the event loop
+        if limiter is not None and deferred_for_s is not None:
+            self.adapi.run_in(
+                self._deferred_call_timer,
+                deferred_for_s,
+                limiter_key=(entity_id, domain, service),
+                generation=limiter.generation,
+            )
+        return deferred, to_send
+
+    def _deferred_call_timer(self, cb_args: dict[str, Any]) -> None:
+        entity_id, domain, service = cb_args["limiter_key"]
+        with self.rate_limit_lock:
+            limiter = self.rate_limiters.get(entity_id, {}).get((domain, service))
+            if limiter is None or cb_args["generation"] != limiter.generation:
+                # Superseded, or forgotten since the app terminated
+                return
+            call = self._take_deferred_call(limiter)
+        if call is not None:
+            domain, service, data, namespace = call
+            self.call(domain, service, data, namespace=namespace)
+
+    def _take_deferred_call(self, limiter: RateLimiter) -> ServiceCall | None:
+        "Must hold `rate_limit_lock`. Returns the deferred call of the limiter, if any, which is then due to be sent."
+        call = limiter.deferred
+        if call is None:
+            return None
+        limiter.deferred = None
+        limiter.last_sent_at = self.monotonic()
+        limiter.delayed += 1
+        return call
+
+    def rate_limit_stats(self) -> dict[str, int]:
+        """
+        Counts of the calls that went through rate limiting, over all entities and services:
+        - `sent`: sent right away
+        - `delayed`: sent at the end of a rate limiting window
+        - `superseded`: dropped because a later call replaced them in the same window
+        - `pending`: currently waiting for the end of their window
+        """
+        with self.rate_limit_lock:
+            limiters = [
+                limiter
+                for entity_limiters in self.rate_limiters.values()
+                for limiter in entity_limiters.values()
+            ]
+        return {
+            "sent": sum(limiter.sent for limiter in limiters),
+            "delayed": sum(limiter.delayed for limiter in limiters),
+            "superseded": sum(limiter.superseded for limiter in limiters),
+            "pending": sum(limiter.deferred is not None for limiter in limiters),
+        }
+
+    def enable_metrics(
+        self,
+        log_every_s: float | None = None,
+        publish_every_s: float | None = None,
+    ) -> HaptMetrics:
+        """
+        Starts collecting metrics for this app. They may be read through `metrics.snapshot()`, or for all apps at once
+        through `metrics_per_app()`.
+
+        Args:
+            log_every_s (float | None): If given, a summary of the metrics is logged at this interval.
+            publish_every_s (float | None): If given, the metrics are published at this interval as a
+                `sensor.hapt_<app name>` entity in Home Assistant, whose state is the number of loop hops and whose
+                attributes are the snapshot of the metrics.
+        """
+        if self.metrics is None:
+            self.metrics = HaptMetrics()
+        METRICS_PER_APP[self.name] = self.metrics
+        if log_every_s is not None:
+            self.adapi.run_every(self._log_metrics, "now", log_every_s)
+        if publish_every_s is not None:
+            self.adapi.run_every(self._publish_metrics, "now", publish_every_s)
+        return self.metrics
+
+    def _log_metrics(self, cb_args: dict[str, Any]) -> None:
+        if self.metrics is not None:
+            self.adapi.log("HAPT metrics: %s", self.metrics.summary())
+
+    def _publish_metrics(self, cb_args: dict[str, Any]) -> None:
+        if self.metrics is not None:
+            self.adapi.set_state(
+                f"sensor.hapt_{''.join(c if c.isalnum() else '_' for c in self.name.lower())}",
+                state=self.metrics.counters.get("loop_hops", 0),
+                attributes={
+                    "friendly_name": f"HAPT {self.name}",
+                    **self.metrics.snapshot(),
+                    "live_subscriptions": len(self.subscriptions),
+                    "live_timers": len(self.timers),
+                },
+                check_existence=False,
+            )
+
+    def enable_recording(self, path: str) -> Recorder:
+        """
+        Starts appending the state changes, state fetches and service calls of this app to the log file at `path`, so
+        that they may be replayed offline (see `Recorder`).
+        """
+        if self.recorder is None:
+            self.recorder = Recorder(path, self.wall_time)
+        return self.recorder
+
+    def terminate(self) -> None:
+        """
+        Cleans up what HAPT holds for the app: its registry of subscriptions, its timers, its rate limiting (calls still
+        waiting for the end of their window are dropped), its metrics and its recording. This is called automatically
+        when AppDaemon terminates the app.
+        """
+        self.subscriptions.clear()
+        with self.rate_limit_lock:
+            self.rate_limiters.clear()
+        SUBSCRIPTIONS.discard(self.subscriptions)
+        if self.metrics is not None and METRICS_PER_APP.get(self.name) is self.metrics:
+            del METRICS_PER_APP[self.name]
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.listeners.clear()
+
+    def _clean_up_on_terminate(self) -> None:
+        "Makes AppDaemon call `terminate` when it terminates the app, after the app's own `terminate` method if any"
+        app_terminate = getattr(self.ad, "terminate", None)
+        if inspect.iscoroutinefunction(app_terminate):
+
+            async def terminate_async() -> None:
+                try:
+                    await app_terminate()
+                finally:
+                    self.terminate()
+
+            setattr(self.ad, "terminate", terminate_async)
+        else:
+
+            def terminate() -> None:
+                try:
+                    if app_terminate is not None:
+                        app_terminate()
+                finally:
+                    self.terminate()
+
+            setattr(self.ad, "terminate", terminate)
+
+    def register_listener(
+        self, callback: Callable[..., Any], wrapper: Callable[..., Any]
+    ) -> int:
+        """
+        Numbers a wrapper about to be registered with AppDaemon, and adds it to `listeners` if recording. Returns its
+        index, to be forgotten with `forget_listener` once its subscription is gone.
+        """
+        index = next(self.listener_indices)
+        if self.recorder is not None or self.keep_listeners:
+            self.listeners[index] = (callback_name(callback), wrapper)
+        return index
+
+    def forget_listener(self, index: int) -> None:
+        self.listeners.pop(index, None)
+
+    def monotonic(self) -> float:
+        "Clock used for timeouts and rates, in seconds"
+        return self.clocks.monotonic()
+
+    def wall_time(self) -> float:
+        "Current time, in seconds since the epoch"
+        return self.clocks.wall()
+
+    @property
+    def read_context(self) -> ReadContext:
+        "Repeatable read caches of the current callback invocation, or of the current thread outside of callbacks"
+        context = self.read_contexts.get(None)
+        if context is None or context.thread_id != threading.get_ident():
+            context = ReadContext(-1, pinned=False)
+            self.read_contexts.set(context)
+        return context
+
+    @property
+    def state_cache(self) -> dict[str, Any]:
+        return self.read_context.state_cache
+
+    @property
+    def full_cache(self) -> dict[str, Any]:
+        return self.read_context.full_cache
+
+    @property
+    def converted_cache(
+        self,
+    ) -> dict[tuple[str, str | None, Callable[[Any], Any]], Any]:
+        return self.read_context.converted_cache
+
+    @property
+    def read_set(self) -> ReadSet | None:
+        return self.read_context.read_set
+
+    @read_set.setter
+    def read_set(self, read_set: ReadSet | None) -> None:
+        self.read_context.read_set = read_set
+
+    @contextmanager
+    def callback_context(self) -> Generator[ReadContext, None, None]:
+        """
+        Gives the block its own empty repeatable read caches, kept until it ends whatever other callbacks of the app
+        start in the meantime. Wrapped callbacks run within one, so that they may run concurrently.
+        """
+        token = self.read_contexts.set(
+            ReadContext(self.adapi.callback_counter, pinned=True)
+        )
+        try:
+            yield self.read_contexts.get()
+        finally:
+            self.read_contexts.reset(token)
+
+    def check_caches(self) -> ReadContext:
+        """
+        Clear repeatable read caches if necessary. This is called when fetching state
+        since time has passed so the state of entities may have changed.
+
+        Returns:
+            The repeatable read caches to use (see `read_context`)
+        """
+        # Same as `read_context`, inlined as this runs on every read
+        context = self.read_contexts.get(None)
+        if context is None or context.thread_id != threading.get_ident():
+            context = self.read_context
+        elif context.pinned:
+            return context
+        new_callback_counter = self.adapi.callback_counter
+        if context.callback_counter != new_callback_counter:
+            # This runs on every callback, so don't even build the message unless it is going to be logged
+            if self.adapi.logger.isEnabledFor(logging.DEBUG):
+                self.adapi.log(
+                    "HAPT: Clearing repeatable read caches for %s because callback counter changed from %s to %s",
+                    self.name,
+                    context.callback_counter,
+                    new_callback_counter,
+                    level="DEBUG",
+                )
+            context.clear(new_callback_counter)
+        return context
+
+    def prefetch(self, read_set: ReadSet) -> None:
+        """
+        Loads into the repeatable read caches all the entities of the given read set that are not already there.
+
+        All the states are fetched in a single hop to the AppDaemon event loop, which is significantly faster than
+        fetching them one by one as they get read.
+
+        Args:
+            read_set (ReadSet): entity id -> (namespace, whether the full state with attributes is needed)
+        """
+        to_fetch = self._missing_from_caches(read_set)
+        if self.local_mirror:
+            for entity_id, namespace, _ in to_fetch:
+                self.snapshot_mirrored_state(entity_id, namespace)
+        elif to_fetch:
+            if self.metrics is not None:
+                self.metrics.count("loop_hops")
+            self._store_prefetched(to_fetch, self.fetch_many(to_fetch))
+
+    async def prefetch_async(self, read_set: ReadSet) -> None:
+        "Async counterpart of `prefetch`"
+        to_fetch = self._missing_from_caches(read_set)
+        if self.local_mirror:
+            for entity_id, namespace, _ in to_fetch:
+                self.snapshot_mirrored_state(entity_id, namespace)
+        elif to_fetch:
+            self._store_prefetched(to_fetch, await self.fetch_many_async(to_fetch))
+
+    def _missing_from_caches(self, read_set: ReadSet) -> list[tuple[str, str, bool]]:
+        self.check_caches()
+        return [
+            (entity_id, namespace, full)
+            for entity_id, (namespace, full) in read_set.items()
+            if entity_id not in (self.full_cache if full else self.state_cache)
+        ]
+
+    def _store_prefetched(
+        self, to_fetch: list[tuple[str, str, bool]], entity_states: list[Any]
+    ) -> None:
+        for (entity_id, namespace, full), entity_state in zip(to_fetch, entity_states):
+            if entity_state is None:
+                # Let the actual read raise the appropriate error if it happens
+                continue
+            if self.recorder is not None:
+                self.recorder.write("r", entity_id, namespace, full, entity_state)
+            if full:
+                self.full_cache[entity_id] = entity_state
+                self.state_cache[entity_id] = entity_state["state"]
+            else:
+                self.state_cache[entity_id] = entity_state
+
+    def snapshot_mirrored_state(
+        self, entity_id: str, namespace: str | None
+    ) -> dict[str, Any] | None:
+        """
+        Loads the current state of an entity from AppDaemon's state store into the repeatable read caches, without
+        copying it nor hopping to the event loop (see `local_mirror`).
+
+        Returns:
+            The full state dict of the entity, or None if it doesn't exist
+        """
+        # AppDaemon replaces the whole dict on each state change, and looking it up is atomic, so there is no need to
+        # go through the event loop to get a consistent state
+        entity_state = self.AD.state.state.get(namespace or self.ad.namespace, {}).get(
+            entity_id
+        )
+        if entity_state is not None:
+            if self.recorder is not None:
+                self.recorder.write("r", entity_id, namespace, True, entity_state)
+            self.full_cache[entity_id] = entity_state
+            self.state_cache[entity_id] = entity_state["state"]
+        return entity_state
+
+    @sync_decorator
+    async def fetch_many(self, to_fetch: list[tuple[str, str, bool]]) -> list[Any]:
+        """
+        Fetches the states of several entities in a single hop to the event loop.
+
+        Args:
+            to_fetch (list[tuple[str, str, bool]]): (entity id, namespace, whether to fetch all attributes)
+
+        Returns:
+            The state (or full state dict) of each entity, or None if it doesn't exist
+        """
+        return await self.fetch_many_async(to_fetch)
+
+    async def fetch_many_async(
+        self, to_fetch: list[tuple[str, str, bool]]
+    ) -> list[Any]:
+        "Async counterpart of `fetch_many`"
+        if self.shared_reads:
+            return [
+                SHARED_READS.read(
+                    self.AD, entity_id, namespace or self.ad.namespace, full
+                )
+                for entity_id, namespace, full in to_fetch
+            ]
+        return [
+            await get_state_async(
+                self.adapi, entity_id, "all" if full else None, namespace
+            )
+            for entity_id, namespace, full in to_fetch
+        ]
+
+    def run_callback(
+        self,
+        learned_read_set: ReadSet,
+        callback: Callable[FunctionArgsGeneric, Any],
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> Any:
+        """
+        Runs a user callback on behalf of a callback wrapper, after its repeatable read caches have been set up.
+
+        The entities read by the callback are recorded in `learned_read_set`, so that next time the same wrapper
+        invokes its callback, they may all be prefetched at once.
+        """
+        if not self.read_context.pinned:
+            with self.callback_context():
+                return self.run_callback(learned_read_set, callback, *args, **kwargs)
+        if self.adaptive_prefetch and learned_read_set:
+            self.prefetch(learned_read_set)
+        # Callbacks may be invoked from other callbacks (e.g. calling a wrapped callback directly), whose reads must
+        # keep being recorded once the inner one is done
+        outer_read_set = self.read_set
+        read_set: ReadSet = {}
+        self.read_set = read_set
+        started_at = time.perf_counter()
+        try:
+            with self.coalescing_calls() if self.coalesce_calls else nullcontext():
+                return callback(*args, **kwargs)
+        finally:
+            if self.metrics is not None:
+                self.metrics.count("callbacks")
+                self.metrics.record_callback(callback, time.perf_counter() - started_at)
+            self.read_set = outer_read_set
+            learned_read_set.clear()
+            learned_read_set.update(read_set)
+
+    async def run_callback_async(
+        self,
+        learned_read_set: ReadSet,
+        callback: Callable[FunctionArgsGeneric, Awaitable[Any]],
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> Any:
+        "Async counterpart of `run_callback`, for async user callbacks"
+        if not self.read_context.pinned:
+            with self.callback_context():
+                return await self.run_callback_async(
+                    learned_read_set, callback, *args, **kwargs
+                )
+        if self.adaptive_prefetch and learned_read_set:
+            await self.prefetch_async(learned_read_set)
+        outer_read_set = self.read_set
+        read_set: ReadSet = {}
+        self.read_set = read_set
+        started_at = time.perf_counter()
+        try:
+            async with (
+                self.coalescing_calls_async() if self.coalesce_calls else nullcontext()
+            ):
+                return await callback(*args, **kwargs)
+        finally:
+            if self.metrics is not None:
+                self.metrics.count("callbacks")
+                self.metrics.record_callback(callback, time.perf_counter() - started_at)
+            self.read_set = outer_read_set
+            learned_read_set.clear()
+            learned_read_set.update(read_set)
+
+    def listen_many(
+        self,
+        entities: "Iterable[Entity]",
+        callback: "Callable[Concatenate[Entity, FunctionArgsGeneric], Any]",
+        attribute: str | None = None,
+        new: Any = None,
+        old: Any = None,
+        duration_s: int | None = None,
+        timeout_s: int | None = None,
+        coalesce_ms: int | None = None,
+        throttle_s: float | None = None,
+        domain_wide: bool = False,
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> list[str]:
+        """
+        Listen to state changes of several entities with the same callback.
+
+        This is equivalent to calling `listen_state` on each entity, except that the callback is given the entity that
+        changed as first argument, and that it is lighter when watching many entities: all the subscriptions share a
+        single wrapper, which dispatches to the right entity through a dict keyed by entity id.
+
+        Args:
+            entities: The entities to listen to.
+            callback: Function called with the entity that changed, then `args` and `kwargs`.
+            attribute, new, old, duration_s, timeout_s: Same as for `Entity.listen_state`. AppDaemon only supports
+                `duration_s` on subscriptions to a single entity, so if it is given each entity gets its own.
+            domain_wide: If True, entities of the same domain share a single AppDaemon subscription to the whole
+                domain. AppDaemon then also dispatches the changes of the other entities of the domain, each at the
+                cost of a callback invocation that the wrapper drops, so this only pays off when the entities make up
+                nearly all of their domain (see `benchmarks/listen_many.py`).
+            coalesce_ms, throttle_s: Same as for `Entity.listen_state`, but applying to the changes of all the
+                entities together, e.g. a scene changing many of them at once results in a single invocation. The
+                callback is then given the entity that changed last.
+
+        Returns:
+            The handles of the underlying AppDaemon subscriptions, to cancel them if necessary.
+        """
+        entities = list(entities)
+        if duration_s is not None:
+            return [
+                entity.listen_state(
+                    partial(callback, entity),
+                    attribute,
+                    new,
+                    old,
+                    duration_s,
+                    timeout_s,
+                    coalesce_ms,
+                    throttle_s,
+                    *args,
+                    **kwargs,
+                )
+                for entity in entities
+            ]
+
+        dispatch: dict[str, tuple[Entity, ReadSet]] = {
+            entity.entity_id: (entity, {}) for entity in entities
+        }
+        is_async = inspect.iscoroutinefunction(callback)
+        full_state_events = self.seed_full_state
+        # The wrappers' arguments shadow these
+        attribute_filter, old_filter, new_filter = attribute, old, new
+
+        def invoke(entity: Entity) -> None:
+            self.run_callback(
+                dispatch[entity.entity_id][1], callback, entity, *args, **kwargs
+            )
+
+        async def invoke_async(entity: Entity) -> None:
+            await self.run_callback_async(
+                dispatch[entity.entity_id][1], callback, entity, *args, **kwargs
+            )
+
+        limiter = (
+            BurstLimiter(
+                self,
+                invoke_async if is_async else invoke,
+                coalesce_ms,
+                throttle_s,
+                timeout_s,
+            )
+            if coalesce_ms or throttle_s
+            else None
+        )
+
+        def callback_wrapper(
+            entity_id: str,
+            attribute: str | None,
+            old: Any,
+            new: Any,
+            **cb_args: dict[str, object],
+        ) -> None:
+            target = dispatch.get(entity_id)
+            if target is None:
+                # Another entity of a domain we're subscribed to
+                return
+            if self.recorder is not None:
+                self.recorder.write("c", listener, entity_id, attribute, old, new)
+            if full_state_events and not state_event_matches(
+                attribute_filter, old, new, old_filter, new_filter
+            ):
+                return
+            entity, learned_read_set = target
+            if limiter is not None and not limiter.on_event(entity):
+                return
+            with self.callback_context() as context:
+                assert not context.state_cache and not context.full_cache
+                entity.seed_caches(attribute, new)
+                self.run_callback(learned_read_set, callback, entity, *args, **kwargs)
+
+        async def async_callback_wrapper(
+            entity_id: str,
+            attribute: str | None,
+            old: Any,
+            new: Any,
+            **cb_args: dict[str, object],
+        ) -> None:
+            target = dispatch.get(entity_id)
+            if target is None:
+                return
+            if self.recorder is not None:
+                self.recorder.write("c", listener, entity_id, attribute, old, new)
+            if full_state_events and not state_event_matches(
+                attribute_filter, old, new, old_filter, new_filter
+            ):
+                return
+            entity, learned_read_set = target
+            if limiter is not None and not limiter.on_event(entity):
+                return
+            with self.callback_context() as context:
+                assert not context.state_cache and not context.full_cache
+                entity.seed_caches(attribute, new)
+                await self.run_callback_async(
+                    learned_read_set, callback, entity, *args, **kwargs
+                )
+
+        wrapper: Callable[..., Any] = (
+            async_callback_wrapper if is_async else callback_wrapper
+        )
+        listener = self.register_listener(callback, wrapper)
+        per_domain: dict[tuple[str, str], list[str]] = {}
+        for entity in entities:
+            domain = entity.entity_id.split(".", 1)[0]
+            per_domain.setdefault((entity.namespace, domain), []).append(
+                entity.entity_id
+            )
+        handles: list[Any] = []
+
+        def cancel() -> None:
+            # The listener serves all the subscriptions, so it only goes with the last one
+            if any(handle in self.subscriptions.handles for handle in handles):
+                return
+            self.forget_listener(listener)
+            if limiter is not None:
+                limiter.cancel()
+
+        for (namespace, domain), entity_ids in per_domain.items():
+            subscriptions = [domain] if domain_wide else entity_ids
+            for subscription in subscriptions:
+                if full_state_events:
+                    # Filtered by the wrapper, so that the full state may be seeded in the caches
+                    handle = self.adapi.listen_state(
+                        wrapper,
+                        subscription,
+                        namespace=namespace,
+                        timeout=timeout_s,
+                        attribute="all",
+                    )
+                else:
+                    handle = self.adapi.listen_state(
+                        wrapper,
+                        subscription,
+                        namespace=namespace,
+                        timeout=timeout_s,
+                        attribute=attribute,
+                        new=new,
+                        old=old,
+                    )
+                handles.append(
+                    self.subscriptions.add(
+                        handle,
+                        [subscription] if subscription != domain else entity_ids,
+                        callback,
+                        on_cancel=cancel,
+                    )
+                )
+        return handles
+
+    def computed(
+        self, fn: Callable[[], ComputedGeneric]
+    ) -> "Computed[ComputedGeneric]":
+        """
+        A value derived from the states of entities, that is only computed again when one of the entities `fn` read
+        changes (see `Computed`), e.g. in `initialize`:
+
+            self.anyone_home = self.ha.hapt.computed(lambda: any(p.state() == "home" for p in people))
+            self.anyone_home.listen(self.on_presence_change)
+
+        `fn` is evaluated right away.
+        """
+        computed = Computed(self, fn)
+        computed.refresh()
+        return computed
+
+    async def computed_async(
+        self, fn: Callable[[], ComputedGeneric]
+    ) -> "Computed[ComputedGeneric]":
+        """
+        Async counterpart of `computed`, to be awaited from async apps. `fn` still uses the sync getters: it is
+        evaluated on a worker thread.
+        """
+        computed = Computed(self, fn)
+        await asyncio.get_running_loop().run_in_executor(None, computed.refresh)
+        return computed
+
+    @contextmanager
+    def coalescing_calls(self) -> Generator[None, None, None]:
+        """
+        Buffers the service calls made within the block, and sends them at the end of it in a single hop to the event
+        loop, merging calls to the same service with the same data into a single call targeting several entities.
+
+        This is what wrapped callbacks do when `coalesce_calls` is enabled, and may be used explicitly e.g. from
+        callbacks registered directly through AppDaemon.
+
+        The buffer belongs to the repeatable read context (see `ReadContext`), so callbacks running concurrently each
+        coalesce and send their own calls.
+        """
+        context = self.read_context
+        if context.call_buffer is not None:
+            # Already coalescing: the outermost block will send the calls
+            yield
+            return
+        call_buffer = context.call_buffer = ServiceCallBuffer()
+        try:
+            yield
+        finally:
+            context.call_buffer = None
+            calls = call_buffer.drain()
+            if calls:
+                self.call_many(calls)
+
+    @asynccontextmanager
+    async def coalescing_calls_async(self) -> AsyncGenerator[None, None]:
+        "Async counterpart of `coalescing_calls`"
+        context = self.read_context
+        if context.call_buffer is not None:
+            yield
+            return
+        call_buffer = context.call_buffer = ServiceCallBuffer()
+        try:
+            yield
+        finally:
+            context.call_buffer = None
+            await self.call_many_async(call_buffer.drain())
+
+    def call(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+    ) -> None:
+        """
+        Asynchronously calls a Home Assistant service.
+        This is a largely internal method and should typically not be called directly by users: it bypasses typing.
+
+        If calls are being coalesced (see `coalesce_calls`), the call is only buffered, and will be sent at the end of
+        the callback.
+
+        Args:
+            domain (str): The domain of the service to call (e.g., 'light', 'switch').
+            service (str): The name of the service to call (e.g., 'turn_on', 'turn_off').
+            data (dict[str, Any]): A dictionary containing the service data.
+
+        Returns:
+            None
+        """
+        data = without_none_values(data)
+        call_buffer = self.read_context.call_buffer
+        if call_buffer is not None:
+            call_buffer.add(domain, service, data, namespace)
+            return
+        return self.call_service(domain, service, data, namespace=namespace)
+
+    async def call_async(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+    ) -> None:
+        """
+        Async counterpart of `call`, to be awaited from async apps: it runs directly on the event loop.
+        """
+        data = without_none_values(data)
+        call_buffer = self.read_context.call_buffer
+        if call_buffer is not None:
+            call_buffer.add(domain, service, data, namespace)
+            return
+        return await self.call_many_async([(domain, service, data, namespace)])
+
+    def call_service(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+    ) -> None:
+        """
+        Sends a service call to Home Assistant right away (bypassing coalescing), or queues it if
+        `fire_and_forget_calls` is enabled
+        """
+        self.call_many([(domain, service, data, namespace)])
+
+    async def call_service_async(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+    ) -> None:
+        "Async counterpart of `call_service`, that always waits for the call to be acknowledged"
+        if self.recorder is not None:
+            self.recorder.write(
+                "s", domain, service, data, namespace or self.ad.namespace
+            )
+        if self.metrics is None:
+            return await self.AD.services.call_service(
+                namespace or self.ad.namespace, domain, service, data
+            )
+        for target in call_targets((domain, service, data, namespace)):
+            self.metrics.count("service_calls", target)
+        started_at = time.perf_counter()
+        try:
+            return await self.AD.services.call_service(
+                namespace or self.ad.namespace, domain, service, data
+            )
+        finally:
+            self.metrics.service_call_duration.record(time.perf_counter() - started_at)
+
+    def call_many(self, calls: list[ServiceCall]) -> None:
+        """
+        Sends several service calls, in order, in a single hop to the event loop, or queues them if
+        `fire_and_forget_calls` is enabled
+        """
+        if self.fire_and_forget_calls:
+            if self.call_queue is None:
+                self.call_queue = ServiceCallQueue(self)
+            for call in calls:
+                self.call_queue.put(call)
+            return
+        if self.metrics is not None:
+            self.metrics.count("loop_hops")
+        self.send_calls(calls)
+
+    @sync_decorator
+    async def send_calls(self, calls: list[ServiceCall]) -> None:
+        "Sends several service calls, in order, and waits for all of them to be acknowledged"
+        await self.call_many_async(calls)
+
+    async def call_many_async(self, calls: list[ServiceCall]) -> None:
+        """
+        Async counterpart of `call_many`, that always waits for the calls to be acknowledged. Calls are still sent after
+        the fire-and-forget calls queued before them for the same entities, so that they can't overtake these.
+        """
+        for call in calls:
+            if self.call_queue is not None:
+                await self.call_queue.send_in_order(call)
+            else:
+                domain, service, data, namespace = call
+                await self.call_service_async(
+                    domain, service, data, namespace=namespace
+                )
+
+    @sync_decorator
+    async def call_with_response(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+        ttl_s: float | None = None,
+        cached: bool = True,
+    ) -> Any:
+        """
+        Calls a Home Assistant service that returns a response (e.g. `weather.get_forecasts`), and returns that
+        response.
+
+        Responses are cached for `ttl_s` seconds (`response_ttl_s` by default) in a cache shared by all apps, and
+        identical calls made while one is in flight wait for its response rather than being sent again (see
+        `ResponseCache`), so the returned data must not be modified. These calls are never coalesced, rate limited nor
+        sent in the background, since the response is needed right away.
+        Pass `cached=False` for services that have side effects (scripts, shell commands...): every call is then sent.
+        """
+        return await self.call_with_response_async(
+            domain, service, data, namespace, ttl_s, cached
+        )
+
+    async def call_with_response_async(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        namespace: str | None = None,
+        ttl_s: float | None = None,
+        cached: bool = True,
+    ) -> Any:
+        "Async counterpart of `call_with_response`"
+        data = without_none_values(data)
+        namespace = namespace or self.ad.namespace
+
+        async def fetch() -> Any:
+            return service_response(
+                domain,
+                service,
+                await self.call_service_async(
+                    domain, service, data, namespace=namespace
+                ),
+            )
+
+        if not cached:
+            return await fetch()
+        return await RESPONSE_CACHE.get(
+            (namespace, domain, service, json.dumps(data, sort_keys=True, default=str)),
+            self.response_ttl_s if ttl_s is None else ttl_s,
+            self.monotonic(),
+            fetch,
+        )
+
+    def report_call_error(self, call: ServiceCall, error: Exception) -> None:
+        "Surfaces the failure of a service call that nobody was waiting for"
+        domain, service, data, _ = call
+        if self.on_call_error is not None:
+            try:
+                self.on_call_error(call, error)
+                return
+            except Exception as handler_error:
+                self.adapi.log(
+                    f"HAPT: on_call_error raised {handler_error!r} while handling the failure of {domain}.{service}",
+                    level="ERROR",
+                )
+        self.adapi.log(
+            f"HAPT: Service call {domain}.{service} {data} failed: {error!r}",
+            level="WARNING",
+        )
+
+
+def state_event_matches(
+    attribute: str | None,
+    old_state: dict[str, Any] | None,
+    new_state: dict[str, Any] | None,
+    old: Any,
+    new: Any,
+) -> bool:
+    """
+    Whether a state callback listening to the full state (`attribute="all"`) should run, given the `attribute`, `old`
+    and `new` filters it would have been registered with otherwise.
+
+    This applies the same rules as AppDaemon does for callbacks that listen to a specific attribute.
+    """
+    if attribute == "all":
+        return True
+    old_value = event_value(old_state, attribute or "state")
+    new_value = event_value(new_state, attribute or "state")
+    return (
+        new_value != old_value
+        and (
+            old is None
+            or old == old_value
+            or (callable(old) and old(old_value) is True)
+        )
+        and (
+            new is None
+            or new == new_value
+            or (callable(new) and new(new_value) is True)
+        )
+    )
+
+
+def event_value(entity_state: dict[str, Any] | None, attribute: str) -> Any:
+    # Same precedence as AppDaemon: top-level fields (state, last_changed...) first, then attributes
+    if entity_state is None:
+        return None
+    if attribute in entity_state:
+        return entity_state[attribute]
+    return entity_state.get("attributes", {}).get(attribute)
+
+
+def coroutine_of(method: Any) -> Callable[..., Awaitable[Any]]:
+    """
+    The coroutine function behind an AppDaemon API method wrapped by `sync_decorator`, bound to the same app, for async
+    code to await directly: called from the event loop, the wrapper only schedules it as a task
+    """
+    return partial(getattr(method, "__wrapped__"), getattr(method, "__self__"))
+
+
+async def get_state_async(
+    adapi: ADAPI, entity_id: str, attribute: str | None, namespace: str | None
+) -> Any:
+    "`adapi.get_state` awaited from the event loop"
+    return await coroutine_of(adapi.get_state)(
+        entity_id, attribute=attribute, namespace=namespace
+    )
+
+
+async def get_history_async(
+    hass: Hass, entity_id: str, start: datetime, end: datetime, namespace: str | None
+) -> list[list[dict[str, Any]]] | None:
+    "`hass.get_history` of the states (without attributes) of one entity, awaited from the event loop"
+    return await coroutine_of(hass.get_history)(
+        entity_id,
+        start_time=start,
+        end_time=end,
+        minimal_response=True,
+        no_attributes=True,
+        namespace=namespace,
+    )
+
+
+def without_none_values(data: dict[str, Any]) -> dict[str, Any]:
+    # Remove any None values from the data: AFAIK HomeAssistant doesn't need actually specified but None values
+    # If that were the case we'd need a different placeholder types for None compared to unspecified.
+    return {k: v for k, v in data.items() if v is not None}
+
+
+class NumericHistory:
+    """
+    Numeric states of an entity over time (see `Entity.numeric_history`).
 
-    Methods:
-        __init__(ad: ADBase): Initializes the shared state with the given AppDaemon base instance.
+    Points are stored in two arrays of floats, seconds since the epoch and values, so e.g. a week of a sensor that
+    reports every second takes 10MB rather than hundreds of MB of state dicts. With `every_s`, points are averaged per
+    time bucket of that many seconds as they are added, and the timestamp of each point is the start of its bucket.
     """
 
-    state_cache: dict[str, Any]
-    full_cache: dict[str, Any]
-    callback_counter: int
+    __slots__ = (
+        "timestamps",
+        "values",
+        "every_s",
+        "_bucket",
+        "_bucket_sum",
+        "_bucket_count",
+        "_pages",
+    )
+
+    def __init__(self, every_s: float | None = None):
+        self.timestamps = array("d")
+        self.values = array("d")
+        self.every_s = every_s
+        self._bucket: float | None = None
+        self._bucket_sum = 0.0
+        self._bucket_count = 0
+        self._pages = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[tuple[float, float]]:
+        "(timestamp, value) of each point"
+        return zip(self.timestamps, self.values)
+
+    def add(self, timestamp: float, value: float) -> None:
+        if self.every_s is None:
+            self.timestamps.append(timestamp)
+            self.values.append(value)
+            return
+        bucket = timestamp // self.every_s
+        if bucket != self._bucket:
+            self.flush()
+            self._bucket = bucket
+        self._bucket_sum += value
+        self._bucket_count += 1
+
+    def flush(self) -> None:
+        "Appends the point of the current time bucket, if any: called once all the points are added"
+        if self._bucket_count and self._bucket is not None and self.every_s is not None:
+            self.timestamps.append(self._bucket * self.every_s)
+            self.values.append(self._bucket_sum / self._bucket_count)
+        self._bucket_sum = 0.0
+        self._bucket_count = 0
+
+    def add_page(self, page_start: datetime, entries: list[dict[str, Any]]) -> None:
+        "Decodes a page of Home Assistant's history, skipping states that aren't numbers (e.g. `unavailable`)"
+        page_start_ts = page_start.timestamp()
+        skip_initial_state = self._pages > 0
+        self._pages += 1
+        for entry in entries:
+            try:
+                value = float(entry["state"])
+            except (TypeError, ValueError):
+                continue
+            changed = entry["last_changed"]
+            timestamp = (
+                changed
+                if isinstance(changed, datetime)
+                else datetime.fromisoformat(changed)
+            ).timestamp()
+            # Home Assistant starts each page with the state as of its start, which the previous page already ended with
+            if skip_initial_state and timestamp <= page_start_ts:
+                continue
+            self.add(timestamp, value)
+
+
+class RollingWindow:
+    """
+    Aggregates of the values a numeric entity took during the last `window_s` seconds (see `Entity.rolling_window`).
 
-    def __init__(self, ad: ADBase):
-        self.ad = ad
-        self.adapi = ad.get_ad_api()
-        self.state_cache = {}
-        self.full_cache = {}
-        self.callback_counter = -1
+    Values are kept in a ring buffer of at most `max_samples` values, fed by a single state subscription, along with
+    their running sum and monotonic queues of candidate minima and maxima, so that adding a value and reading the
+    mean, min, max or sum are O(1) (amortized) rather than a history query.
 
-        # Unfortunately we need those for the sync_decorator to work
-        self.name = self.ad.name
-        "Name of the appdaemon app that this Entity is linked to - not a property of the entity itself"
-        self.AD = self.ad.AD
-        "AppDaemon instance"
+    The window includes the value the entity had at its start, so that e.g. "power above X for 5 minutes" is
+    `rolling.min() > X` even for sensors that only report changes. Values that aren't numbers (`unavailable`...) are
+    ignored.
+
+    The subscription is made before the window is filled with the starting values (see `add_history`), so that no
+    change is missed in between: the values it receives meanwhile are held back until then.
+    """
+
+    __slots__ = (
+        "window_s",
+        "max_samples",
+        "clock",
+        "samples",
+        "first_sequence",
+        "total",
+        "minima",
+        "maxima",
+        "lock",
+        "held_back",
+        "subscriptions",
+        "handle",
+    )
+
+    def __init__(
+        self,
+        window_s: float,
+        max_samples: int = 10_000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.window_s = window_s
+        self.max_samples = max_samples
+        self.clock = clock
+        "Seconds since the epoch, like the timestamps of the history used for warm starts"
+        self.samples: deque[tuple[float, float]] = deque()
+        "(timestamp, value), oldest first"
+        self.first_sequence = 0
+        "Sequence number of `samples[0]`: each value gets the next one"
+        self.total = 0.0
+        self.minima: deque[tuple[int, float]] = deque()
+        "(sequence, value) of the values that may still become the minimum, increasing"
+        self.maxima: deque[tuple[int, float]] = deque()
+        "(sequence, value) of the values that may still become the maximum, decreasing"
+        self.lock = threading.Lock()
+        "Values come from the worker thread of the subscription, and may be read from the event loop in async apps"
+        self.held_back: list[tuple[float, float]] | None = []
+        "(timestamp, value) received from the subscription before `add_history`, None once it was called"
+        self.subscriptions: Subscriptions | None = None
+        self.handle: Any = None
+        "Of the state subscription in `subscriptions`, if any"
+
+    def add(self, timestamp: float, value: float) -> None:
+        with self.lock:
+            self._add(timestamp, value)
+
+    def _add(self, timestamp: float, value: float) -> None:
+        "Must hold the lock"
+        if len(self.samples) >= self.max_samples:
+            self._evict_oldest()
+        sequence = self.first_sequence + len(self.samples)
+        self.samples.append((timestamp, value))
+        self.total += value
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((sequence, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((sequence, value))
+
+    def _evict_oldest(self) -> None:
+        _, value = self.samples.popleft()
+        self.total -= value
+        if self.minima[0][0] == self.first_sequence:
+            self.minima.popleft()
+        if self.maxima[0][0] == self.first_sequence:
+            self.maxima.popleft()
+        self.first_sequence += 1
+        if self.first_sequence % self.max_samples == 0:
+            # Don't let floating point errors of the running sum accumulate
+            self.total = math.fsum(value for _, value in self.samples)
+
+    def _expire(self) -> None:
+        "Must hold the lock. Drops the values that were replaced by another before the start of the window."
+        cutoff = self.clock() - self.window_s
+        while len(self.samples) > 1 and self.samples[1][0] <= cutoff:
+            self._evict_oldest()
+
+    def count(self) -> int:
+        with self.lock:
+            self._expire()
+            return len(self.samples)
+
+    def sum(self) -> float:
+        with self.lock:
+            self._expire()
+            return self.total
+
+    def mean(self) -> float | None:
+        "Mean of the values (not weighted by how long the entity had them), or None if there is none yet"
+        with self.lock:
+            self._expire()
+            return self.total / len(self.samples) if self.samples else None
+
+    def min(self) -> float | None:
+        with self.lock:
+            self._expire()
+            return self.minima[0][1] if self.minima else None
+
+    def max(self) -> float | None:
+        with self.lock:
+            self._expire()
+            return self.maxima[0][1] if self.maxima else None
+
+    def on_state(
+        self, entity: str, attribute: str, old: Any, new: Any, **cb_args: Any
+    ) -> None:
+        "State callback that feeds the window"
+        try:
+            value = float(new)
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            if self.held_back is not None:
+                self.held_back.append((self.clock(), value))
+            else:
+                self._add(self.clock(), value)
 
-    def check_caches(self):
+    def add_history(self, history: Iterable[tuple[float, float]]) -> None:
         """
-        Clear repeatable read caches if necessary. This is called when fetching state
-        since time has passed so the state of entities may have changed.
+        Starts the window with (timestamp, value) from before the subscription, e.g. a `NumericHistory`, followed by the
+        values the subscription received since it was made. Values of `history` that aren't older than these are
+        skipped, since they are already among them.
         """
-        new_callback_counter = self.adapi.callback_counter
-        if self.callback_counter != new_callback_counter:
-            self.adapi.log(
-                f"HAPT: Clearing repeatable read caches for {self.name} because callback counter"
-                f" changed from {self.callback_counter} to {new_callback_counter}",
-                level="DEBUG",
-            )
-            self.state_cache.clear()
-            self.full_cache.clear()
-            self.callback_counter = new_callback_counter
+        with self.lock:
+            held_back, self.held_back = self.held_back or [], None
+            held_back_since = held_back[0][0] if held_back else math.inf
+            for timestamp, value in history:
+                if timestamp < held_back_since:
+                    self._add(timestamp, value)
+            for timestamp, value in held_back:
+                self._add(timestamp, value)
+
+    def cancel(self) -> bool:
+        "Stops feeding the window, by cancelling its state subscription. Returns whether it was live."
+        subscriptions, handle = self.subscriptions, self.handle
+        if subscriptions is None or handle is None:
+            return False
+        self.handle = None
+        return subscriptions.cancel(handle)
+
+
+def numeric_sample(timestamp: float, state: Any) -> list[tuple[float, float]]:
+    "[(timestamp, state as a number)], or [] if the state isn't a number"
+    try:
+        return [(timestamp, float(state))]
+    except (TypeError, ValueError):
+        return []
+
+
+class Computed(Generic[ComputedGeneric]):
+    """
+    A value derived from the states of entities (e.g. "anyone home"), kept up to date incrementally (see
+    `HaptSharedState.computed`).
+
+    The function is run like a wrapped callback, which records the entities it reads through the repeatable read
+    getters, and only these are subscribed to. It is run again when one of them changes, in a fresh repeatable read
+    snapshot, and the callbacks registered with `listen` only run when its result actually changes. Only entity reads
+    are tracked: if the function also depends on something else (e.g. the time of day), call `refresh` when that
+    changes.
+    """
 
-    @sync_decorator
-    async def call(
+    def __init__(self, hapt: "HaptSharedState", fn: Callable[[], ComputedGeneric]):
+        self.hapt = hapt
+        self.fn = fn
+        self.value: ComputedGeneric
+        "Result of the latest evaluation of `fn`, set by the first `refresh`"
+        self.dependencies: ReadSet = {}
+        "Entities read by the latest evaluation of `fn`"
+        self.handles: dict[str, Any] = {}
+        "entity id -> handle of the subscription to it"
+        self.listeners: list[
+            tuple[Callable[..., Any], tuple[Any, ...], dict[str, Any], ReadSet]
+        ] = []
+        "(callback, args, kwargs, learned read set) of the callbacks to run when the value changes"
+        self.lock = threading.RLock()
+        "Dependencies may change on several worker threads at once if the app isn't pinned"
+        self.evaluations = 0
+        self.changes = 0
+
+    def __call__(self) -> ComputedGeneric:
+        "The current value, without evaluating `fn`"
+        return self.value
+
+    def listen(
         self,
-        domain: str,
-        service: str,
-        data: dict[str, Any],
-        namespace: str | None = None,
+        callback: Callable[Concatenate[ComputedGeneric, FunctionArgsGeneric], Any],
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
     ) -> None:
-        """
-        Asynchronously calls a Home Assistant service.
-        This is a largely internal method and should typically not be called directly by users: it bypasses typing.
+        "Runs `callback(value, *args, **kwargs)` whenever the value changes"
+        self.listeners.append((callback, args, kwargs, {}))
 
-        Args:
-            domain (str): The domain of the service to call (e.g., 'light', 'switch').
-            service (str): The name of the service to call (e.g., 'turn_on', 'turn_off').
-            data (dict[str, Any]): A dictionary containing the service data.
+    def refresh(self) -> bool:
+        """
+        Evaluates `fn` again, runs the callbacks if its result changed, and subscribes to the entities it read.
 
         Returns:
-            None
+            bool: Whether the value changed
         """
-        # Remove any None values from the data: AFAIK HomeAssistant doesn't need actually specified but None values
-        # If that were the case we'd need a different placeholder types for None compared to unspecified.
-        data = {k: v for k, v in data.items() if v is not None}
+        if not self._evaluate():
+            return False
+        first_error: Exception | None = None
+        for callback, args, kwargs, learned_read_set in list(self.listeners):
+            try:
+                if inspect.iscoroutinefunction(callback):
+                    self.hapt.AD.futures.add_future(
+                        self.hapt.name,
+                        asyncio.run_coroutine_threadsafe(
+                            self.hapt.run_callback_async(
+                                learned_read_set, callback, self.value, *args, **kwargs
+                            ),
+                            self.hapt.AD.loop,
+                        ),
+                    )
+                else:
+                    self.hapt.run_callback(
+                        learned_read_set, callback, self.value, *args, **kwargs
+                    )
+            except Exception as error:
+                # Don't let one callback prevent the others from learning about the change
+                first_error = first_error or error
+        if first_error is not None:
+            raise first_error
+        return True
+
+    def cancel(self) -> None:
+        "Stops keeping the value up to date"
+        with self.lock:
+            for handle in self.handles.values():
+                self.hapt.subscriptions.cancel(handle)
+            self.handles.clear()
+            self.dependencies.clear()
+
+    def _evaluate(self) -> bool:
+        with self.lock:
+            previous_dependencies = dict(self.dependencies)
+            try:
+                # Prefetches what the previous evaluation read, and records what this one reads into `dependencies`
+                value = self.hapt.run_callback(self.dependencies, self.fn)
+            finally:
+                self._subscribe(previous_dependencies)
+            changed = self.evaluations == 0 or value != self.value
+            self.evaluations += 1
+            if changed:
+                self.value = value
+                self.changes += 1
+            return changed
+
+    def _subscribe(self, previous_dependencies: ReadSet) -> None:
+        for entity_id, dependency in previous_dependencies.items():
+            handle = self.handles.get(entity_id)
+            if self.dependencies.get(entity_id) != dependency and handle is not None:
+                del self.handles[entity_id]
+                self.hapt.subscriptions.cancel(handle)
+        for entity_id, (namespace, full) in self.dependencies.items():
+            if entity_id not in self.handles:
+                self.handles[entity_id] = self.hapt.subscriptions.add(
+                    self.hapt.adapi.listen_state(
+                        self._on_dependency_change,
+                        entity_id,
+                        namespace=namespace,
+                        attribute="all" if full else None,
+                    ),
+                    [entity_id],
+                    self.fn,
+                )
 
-        return await self.AD.services.call_service(
-            namespace or self.ad.namespace, domain, service, data
-        )
+    def _on_dependency_change(
+        self, entity: str, attribute: str, old: Any, new: Any, **cb_args: Any
+    ) -> None:
+        # A sync callback like those of rolling windows: the evaluation and the callbacks then run on a worker thread
+        with self.hapt.callback_context():
+            if new is not None:
+                if attribute == "all":
+                    self.hapt.full_cache[entity] = new
+                    self.hapt.state_cache[entity] = new["state"]
+                else:
+                    self.hapt.state_cache[entity] = new
+            self.refresh()
+
+
+def history_pages(
+    start: datetime, end: datetime, page: timedelta
+) -> Iterator[tuple[datetime, datetime]]:
+    page_start = start
+    while page_start < end:
+        page_end = min(page_start + page, end)
+        yield page_start, page_end
+        page_start = page_end
 
 
 class Entity:
@@ -93,8 +2937,13 @@ class Entity:
 
     This is the base class for all introspected entities, however each entity will have its own class with all the
     methods that are available for it.
+
+    Entities are created for every entity an app uses, so they only hold what is specific to them. Subclasses should
+    declare `__slots__ = ()` to keep it that way.
     """
 
+    __slots__ = ("hapt", "entity_id", "namespace")
+
     def __init__(
         self, hapt: HaptSharedState, entity_id: str, namespace: str | None = None
     ):
@@ -102,11 +2951,16 @@ class Entity:
         self.entity_id = entity_id
         self.namespace = namespace or self.hapt.ad.namespace
 
-        # Unfortunately we need those for the sync_decorator to work
-        self.name = self.hapt.ad.name
+    # Unfortunately we need those for the sync_decorator to work
+    @property
+    def name(self) -> str:
         "Name of the appdaemon app that this Entity is linked to - not a property of the entity itself"
-        self.AD = self.hapt.ad.AD
+        return self.hapt.ad.name
+
+    @property
+    def AD(self) -> Any:
         "AppDaemon instance"
+        return self.hapt.ad.AD
 
     def call(self, domain: str, service: str, data: dict[str, Any]) -> None:
         """
@@ -126,8 +2980,197 @@ class Entity:
         # Add entity id to the call (this is always the convention in HomeAssistant's API)
         data["entity_id"] = self.entity_id
 
+        if self.hapt.track_pending_commands or self.hapt.suppress_redundant_calls:
+            command = PendingCommand(domain, service, data, self.hapt.monotonic())
+            if self.hapt.suppress_redundant_calls and self._is_redundant(
+                command, self.get_state_repeatable_read("all"), self.pending_command()
+            ):
+                self.hapt.suppressed_calls += 1
+                return
+            self._track(command)
+        deferred, overtaken = self.hapt.debounce(
+            self.entity_id, domain, service, data, self.namespace
+        )
+        for other_domain, other_service, other_data, other_namespace in overtaken:
+            self.hapt.call(
+                other_domain, other_service, other_data, namespace=other_namespace
+            )
+        if deferred:
+            return
+
         return self.hapt.call(domain, service, data, namespace=self.namespace)
 
+    async def call_async(self, domain: str, service: str, data: dict[str, Any]) -> None:
+        """
+        Async counterpart of `call`, to be awaited from async apps: it runs directly on the event loop.
+        """
+        data["entity_id"] = self.entity_id
+
+        if self.hapt.track_pending_commands or self.hapt.suppress_redundant_calls:
+            command = PendingCommand(domain, service, data, self.hapt.monotonic())
+            if self.hapt.suppress_redundant_calls and self._is_redundant(
+                command,
+                await self.get_state_repeatable_read_async("all"),
+                await self.pending_command_async(),
+            ):
+                self.hapt.suppressed_calls += 1
+                return
+            self._track(command)
+        deferred, overtaken = self.hapt.debounce(
+            self.entity_id, domain, service, data, self.namespace
+        )
+        if overtaken:
+            await self.hapt.call_many_async(overtaken)
+        if deferred:
+            return
+
+        return await self.hapt.call_async(
+            domain, service, data, namespace=self.namespace
+        )
+
+    def call_with_response(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        ttl_s: float | None = None,
+        cached: bool = True,
+    ) -> Any:
+        """
+        Calls a Home Assistant service that returns a response on this entity, and returns that response (see
+        `HaptSharedState.call_with_response`).
+        This is a largely internal method and should typically not be called directly by users: it bypasses typing.
+        """
+        data["entity_id"] = self.entity_id
+        return self.hapt.call_with_response(
+            domain, service, data, namespace=self.namespace, ttl_s=ttl_s, cached=cached
+        )
+
+    async def call_with_response_async(
+        self,
+        domain: str,
+        service: str,
+        data: dict[str, Any],
+        ttl_s: float | None = None,
+        cached: bool = True,
+    ) -> Any:
+        "Async counterpart of `call_with_response`, to be awaited from async apps"
+        data["entity_id"] = self.entity_id
+        return await self.hapt.call_with_response_async(
+            domain, service, data, namespace=self.namespace, ttl_s=ttl_s, cached=cached
+        )
+
+    def pending_command(self) -> PendingCommand | None:
+        """
+        Get the last command sent to this entity, if its effect has not been observed in the state of the entity yet
+        and it hasn't timed out (see `HaptSharedState.pending_command_timeout_s`). Commands are only tracked if
+        `HaptSharedState.track_pending_commands` (or `suppress_redundant_calls`) is enabled.
+        """
+        pending = self._unexpired_pending_command()
+        if pending is None or not pending.is_observed_in(
+            self.get_state_repeatable_read("all")
+        ):
+            return pending
+        self._forget(pending)
+        return None
+
+    async def pending_command_async(self) -> PendingCommand | None:
+        "Async counterpart of `pending_command`"
+        pending = self._unexpired_pending_command()
+        if pending is None or not pending.is_observed_in(
+            await self.get_state_repeatable_read_async("all")
+        ):
+            return pending
+        self._forget(pending)
+        return None
+
+    def effective_state(self, attribute: str | None = None, default: Any = None) -> Any:
+        """
+        Get the state of the entity, or any of its attributes, as it is expected to be once the pending command (if
+        any) has been applied.
+
+        This is typically useful right after sending a command, as the actual state of the entity only changes once
+        Home Assistant reports back that the command was applied.
+
+        Args:
+            attribute (str): The attribute to get. If None, the state of the entity is returned.
+            default (Any): The value to return if the attribute is not found.
+        """
+        pending = self.pending_command()
+        if pending is not None:
+            effects = pending.expected_effects(self.get_state_repeatable_read("all"))
+            if attribute in effects:
+                return effects[attribute]
+        return self.get_state_repeatable_read(attribute, default)
+
+    async def effective_state_async(
+        self, attribute: str | None = None, default: Any = None
+    ) -> Any:
+        "Async counterpart of `effective_state`"
+        pending = await self.pending_command_async()
+        if pending is not None:
+            effects = pending.expected_effects(
+                await self.get_state_repeatable_read_async("all")
+            )
+            if attribute in effects:
+                return effects[attribute]
+        return await self.get_state_repeatable_read_async(attribute, default)
+
+    def _unexpired_pending_command(self) -> PendingCommand | None:
+        pending = self.hapt.pending_commands.get(self.entity_id)
+        if pending is None:
+            return None
+        if (
+            self.hapt.monotonic() - pending.sent_at
+            > self.hapt.pending_command_timeout_s
+        ):
+            self._forget(pending)
+            return None
+        return pending
+
+    def _forget(self, pending: PendingCommand) -> None:
+        with self.hapt.pending_commands_lock:
+            # Unless a newer command replaced it meanwhile
+            if self.hapt.pending_commands.get(self.entity_id) is pending:
+                del self.hapt.pending_commands[self.entity_id]
+
+    def _track(self, command: PendingCommand) -> None:
+        with self.hapt.pending_commands_lock:
+            if command.expected_state is None and all(
+                field in NO_STATE_EFFECT_FIELDS for field in command.data
+            ):
+                # We can't tell what this command will do (e.g. toggle), so we can't tell what's pending anymore either
+                self.hapt.pending_commands.pop(self.entity_id, None)
+            else:
+                self.hapt.pending_commands[self.entity_id] = command
+
+    def _is_redundant(
+        self,
+        command: PendingCommand,
+        entity_state: dict[str, Any],
+        pending: PendingCommand | None,
+    ) -> bool:
+        "Whether sending `command` would not change the effective state of the entity"
+        if command.has_unknown_effects(entity_state):
+            return False
+        effects = command.expected_effects(entity_state)
+        if not effects:
+            return False
+        pending_effects = (
+            pending.expected_effects(entity_state) if pending is not None else {}
+        )
+        return all(
+            values_match(
+                (
+                    pending_effects[attribute]
+                    if attribute in pending_effects
+                    else state_value(entity_state, attribute)
+                ),
+                value,
+            )
+            for attribute, value in effects.items()
+        )
+
     # We will eventually try typing this as well but there's no API to know for sure what can be in there this time
     # so for now we'll skip it
     @sync_decorator
@@ -149,6 +3192,18 @@ class Entity:
             copy (bool): Whether to return a copy of the state or the original object.
             **kwargs: Additional keyword arguments to pass to the API call.
         """
+        return await self.query_state_async(
+            attribute=attribute, default=default, copy=copy, **kwargs
+        )
+
+    async def query_state_async(
+        self,
+        attribute: str | None = None,
+        default: Any = None,
+        copy: bool = True,
+        **kwargs: Optional[Any],
+    ) -> Any:
+        "Async counterpart of `query_state`, to be awaited from async apps"
         return await self.hapt.adapi.get_entity(
             self.entity_id, namespace=self.namespace
         ).get_state(attribute=attribute, default=default, copy=copy, **kwargs)
@@ -165,6 +3220,10 @@ class Entity:
         in the same event handling. This generally naturally avoids race conditions when writing if/else logic based
         on the states.
 
+        Wrapped callbacks each get their own caches for as long as they run (see `HaptSharedState.callback_context`).
+        Outside of them (`initialize`, callbacks registered directly with AppDaemon...), the caches are checked on every
+        read, and start over once AppDaemon has started another callback of the app.
+
         Returns default if the attribute is not found.
 
         Args:
@@ -173,37 +3232,278 @@ class Entity:
             default (Any): The value to return if the attribute is not found (or the entity is not found).
         """
 
-        if attribute is None:
-            if self.entity_id in self.hapt.state_cache:
-                return self.hapt.state_cache[self.entity_id]
-            else:
-                entity_state = self.query_state(attribute=None, copy=True)
-                if entity_state is None:
-                    raise ValueError(f"{self.entity_id} not found")
-                self.hapt.state_cache[self.entity_id] = entity_state
-                return entity_state
+        entity_state = self._cached_state(attribute)
+        if entity_state is _NOT_CACHED and self.hapt.local_mirror:
+            entity_state = self._mirrored_state(attribute)
+        elif entity_state is _NOT_CACHED:
+            if self.hapt.metrics is not None:
+                self.hapt.metrics.count("loop_hops", self.entity_id)
+            # The full state is fetched even if only the state is read, so that reading attributes next doesn't need
+            # another fetch
+            entity_state = self._cache_fetched_state(
+                attribute,
+                (
+                    self.hapt.fetch_many([(self.entity_id, self.namespace, True)])[0]
+                    if self.hapt.shared_reads
+                    else self.query_state(attribute="all", copy=True)
+                ),
+            )
+        return self._pick_attribute(entity_state, attribute, default)
+
+    async def get_state_repeatable_read_async(
+        self,
+        attribute: str | None = None,
+        default: Any = None,
+    ) -> Any:
+        """
+        Async counterpart of `get_state_repeatable_read`, to be awaited from async apps.
+
+        It runs directly on the event loop instead of going through the thread-pool round trip of the sync version.
+        Each async callback invocation has its own repeatable read caches, that stay the same across its awaits however
+        many other callbacks of the app run concurrently.
+        """
+        entity_state = self._cached_state(attribute)
+        if entity_state is _NOT_CACHED and self.hapt.local_mirror:
+            entity_state = self._mirrored_state(attribute)
+        elif entity_state is _NOT_CACHED:
+            entity_state = self._cache_fetched_state(
+                attribute,
+                (
+                    (
+                        await self.hapt.fetch_many_async(
+                            [(self.entity_id, self.namespace, True)]
+                        )
+                    )[0]
+                    if self.hapt.shared_reads
+                    else await self.query_state_async(attribute="all", copy=True)
+                ),
+            )
+        return self._pick_attribute(entity_state, attribute, default)
+
+    def get_state_repeatable_read_converted(
+        self,
+        converter: Callable[[Any], ConvertedGeneric],
+        attribute: str | None = None,
+    ) -> ConvertedGeneric:
+        """
+        Same as `get_state_repeatable_read`, but returns the state (or attribute) passed through `converter`.
+
+        The converted value is cached alongside the raw state, so parsing (e.g. numbers or timestamps) only happens
+        once per callback however many times the value is read. `converter` is part of the cache key, so it should be
+        a function defined once (e.g. `int_or_float`), not a lambda created on every call.
+        """
+        key = (self.entity_id, attribute, converter)
+        converted_cache = self.hapt.check_caches().converted_cache
+        converted = converted_cache.get(key, _NOT_CACHED)
+        if converted is _NOT_CACHED:
+            converted = converter(self.get_state_repeatable_read(attribute))
+            converted_cache[key] = converted
+        return converted
+
+    async def get_state_repeatable_read_converted_async(
+        self,
+        converter: Callable[[Any], ConvertedGeneric],
+        attribute: str | None = None,
+    ) -> ConvertedGeneric:
+        "Async counterpart of `get_state_repeatable_read_converted`, to be awaited from async apps"
+        key = (self.entity_id, attribute, converter)
+        converted_cache = self.hapt.check_caches().converted_cache
+        converted = converted_cache.get(key, _NOT_CACHED)
+        if converted is _NOT_CACHED:
+            converted = converter(await self.get_state_repeatable_read_async(attribute))
+            converted_cache[key] = converted
+        return converted
+
+    def numeric_history(
+        self,
+        start: datetime,
+        end: datetime,
+        every_s: float | None = None,
+        page: timedelta = timedelta(hours=6),
+    ) -> NumericHistory:
+        """
+        Numeric states of the entity between `start` and `end`, from Home Assistant's history.
+
+        The history is queried one `page` of time at a time, and each page is decoded into the compact time series
+        before the next one is fetched, so only one page of state dicts is ever held in memory.
+
+        Args:
+            start (datetime): Beginning of the period (timezone-aware)
+            end (datetime): End of the period (timezone-aware)
+            every_s (float, optional): If given, the values are averaged over time buckets of that many seconds
+            page (timedelta, optional): How much history to query at once
+
+        Raises:
+            TypeError: If the app is not a `hass.Hass` app, since only those can query the history
+        """
+        history = NumericHistory(every_s)
+        for page_start, page_end in history_pages(start, end, page):
+            result = self.hapt.hass.get_history(
+                self.entity_id,
+                start_time=page_start,
+                end_time=page_end,
+                minimal_response=True,
+                no_attributes=True,
+                namespace=self.namespace,
+            )
+            history.add_page(page_start, result[0] if result else [])
+        history.flush()
+        return history
+
+    async def numeric_history_async(
+        self,
+        start: datetime,
+        end: datetime,
+        every_s: float | None = None,
+        page: timedelta = timedelta(hours=6),
+    ) -> NumericHistory:
+        "Async counterpart of `numeric_history`, to be awaited from async apps"
+        history = NumericHistory(every_s)
+        for page_start, page_end in history_pages(start, end, page):
+            result = await get_history_async(
+                self.hapt.hass, self.entity_id, page_start, page_end, self.namespace
+            )
+            history.add_page(page_start, result[0] if result else [])
+        history.flush()
+        return history
+
+    def rolling_window(
+        self,
+        window_s: float,
+        max_samples: int = 10_000,
+        warm_start: bool = False,
+    ) -> RollingWindow:
+        """
+        Starts keeping aggregates (mean, min, max, sum) of the numeric values of the entity during the last `window_s`
+        seconds, up to date in memory (see `RollingWindow`).
+
+        Args:
+            window_s (float): Duration of the window
+            max_samples (int, optional): How many values the window may hold at most, the oldest being dropped first
+            warm_start (bool, optional): Whether to fill the window from Home Assistant's history first, so that the
+                aggregates are meaningful right away. Otherwise the window starts with the current state.
+        """
+        window = RollingWindow(window_s, max_samples, self.hapt.wall_time)
+        # Subscribed first, so that no change is missed while the starting values are fetched. A sync callback, so
+        # that it runs on the app's worker thread between its other callbacks instead of concurrently with them, which
+        # would reset their repeatable read caches.
+        window.subscriptions = self.hapt.subscriptions
+        window.handle = self.hapt.subscriptions.add(
+            self.hapt.adapi.listen_state(
+                window.on_state, self.entity_id, namespace=self.namespace
+            ),
+            [self.entity_id],
+            window.on_state,
+        )
+        if warm_start:
+            now = datetime.fromtimestamp(window.clock()).astimezone()
+            window.add_history(
+                self.numeric_history(now - timedelta(seconds=window_s), now)
+            )
         else:
-            if self.entity_id in self.hapt.full_cache:
-                entity_state = self.hapt.full_cache[self.entity_id]
-            else:
-                entity_state = self.query_state(attribute="all", copy=True)
-                if entity_state is None:
-                    raise ValueError(f"{self.entity_id} not found")
-                self.hapt.full_cache[self.entity_id] = entity_state
-                self.hapt.state_cache[self.entity_id] = entity_state["state"]
-
-            # From there, same logic as AppDaemon's own get_state
-            if attribute == "all":
-                return entity_state
-            if attribute in entity_state["attributes"]:
-                return entity_state["attributes"][attribute]
-            if attribute in entity_state:
-                return entity_state[attribute]
-            if default is not None:
-                return default
-            raise ValueError(
-                f"Attribute {attribute} not found for entity {self.entity_id}"
+            window.add_history(
+                numeric_sample(
+                    window.clock(),
+                    self.hapt.adapi.get_state(self.entity_id, namespace=self.namespace),
+                )
+            )
+        return window
+
+    async def rolling_window_async(
+        self,
+        window_s: float,
+        max_samples: int = 10_000,
+        warm_start: bool = False,
+    ) -> RollingWindow:
+        "Async counterpart of `rolling_window`, to be awaited from async apps"
+        window = RollingWindow(window_s, max_samples, self.hapt.wall_time)
+        window.subscriptions = self.hapt.subscriptions
+        window.handle = self.hapt.subscriptions.add(
+            await coroutine_of(self.hapt.adapi.listen_state)(
+                window.on_state, self.entity_id, namespace=self.namespace
+            ),
+            [self.entity_id],
+            window.on_state,
+        )
+        if warm_start:
+            now = datetime.fromtimestamp(window.clock()).astimezone()
+            window.add_history(
+                await self.numeric_history_async(now - timedelta(seconds=window_s), now)
+            )
+        else:
+            window.add_history(
+                numeric_sample(
+                    window.clock(),
+                    await get_state_async(
+                        self.hapt.adapi, self.entity_id, None, self.namespace
+                    ),
+                )
+            )
+        return window
+
+    def _cached_state(self, attribute: str | None) -> Any:
+        """
+        Returns the state (if `attribute` is None) or the full state dict (otherwise) from the repeatable read caches,
+        or `_NOT_CACHED` if it needs to be fetched.
+        """
+        context = self.hapt.check_caches()
+
+        read_set = context.read_set
+        if read_set is not None:
+            # Record what the current callback reads, so that it may be prefetched on its next invocation
+            if attribute is not None:
+                read_set[self.entity_id] = (self.namespace, True)
+            elif self.entity_id not in read_set:
+                read_set[self.entity_id] = (self.namespace, False)
+
+        entity_state = (
+            context.state_cache if attribute is None else context.full_cache
+        ).get(self.entity_id, _NOT_CACHED)
+        if self.hapt.metrics is not None:
+            self.hapt.metrics.count(
+                "cache_misses" if entity_state is _NOT_CACHED else "cache_hits",
+                self.entity_id,
+            )
+        return entity_state
+
+    def _cache_fetched_state(self, attribute: str | None, entity_state: Any) -> Any:
+        """
+        Stores a freshly fetched full state dict in the repeatable read caches, and returns the state if `attribute` is
+        None, otherwise the full state dict
+        """
+        if entity_state is None:
+            raise ValueError(f"{self.entity_id} not found")
+        if self.hapt.recorder is not None:
+            self.hapt.recorder.write(
+                "r", self.entity_id, self.namespace, True, entity_state
             )
+        self.hapt.full_cache[self.entity_id] = entity_state
+        self.hapt.state_cache[self.entity_id] = entity_state["state"]
+        return entity_state["state"] if attribute is None else entity_state
+
+    def _mirrored_state(self, attribute: str | None) -> Any:
+        "Same as `_cache_fetched_state`, but taking the state from AppDaemon's state store directly"
+        entity_state = self.hapt.snapshot_mirrored_state(self.entity_id, self.namespace)
+        if entity_state is None:
+            raise ValueError(f"{self.entity_id} not found")
+        return entity_state["state"] if attribute is None else entity_state
+
+    def _pick_attribute(
+        self, entity_state: Any, attribute: str | None, default: Any
+    ) -> Any:
+        if attribute is None:
+            return entity_state
+
+        # From there, same logic as AppDaemon's own get_state
+        if attribute == "all":
+            return entity_state
+        if attribute in entity_state["attributes"]:
+            return entity_state["attributes"][attribute]
+        if attribute in entity_state:
+            return entity_state[attribute]
+        if default is not None:
+            return default
+        raise ValueError(f"Attribute {attribute} not found for entity {self.entity_id}")
 
     def consistent_cache(self):
         """
@@ -215,6 +3515,10 @@ class Entity:
         """
         self.get_state_repeatable_read(attribute="all")
 
+    async def consistent_cache_async(self):
+        "Async counterpart of `consistent_cache`"
+        await self.get_state_repeatable_read_async(attribute="all")
+
     def listen_state(
         self,
         callback: Callable[FunctionArgsGeneric, Any],
@@ -223,6 +3527,8 @@ class Entity:
         old: Any = None,
         duration_s: int | None = None,
         timeout_s: int | None = None,
+        coalesce_ms: int | None = None,
+        throttle_s: float | None = None,
         *args: FunctionArgsGeneric.args,
         **kwargs: FunctionArgsGeneric.kwargs,
     ) -> str:
@@ -263,6 +3569,13 @@ class Entity:
             timeout_s (str | int | float | timedelta, optional): If given, the callback will be automatically removed
                 after that amount of time. If activity for the listened state has occurred that would trigger a
                 duration timer, the duration timer will still be fired even though the callback has been removed.
+            coalesce_ms (int, optional): If given, the callback is invoked that long after the first
+                change of a burst rather than right away, and only once for all the changes that happen in the meantime
+                (e.g. a scene activation changing the entity many times). It then reads the state as of its invocation.
+            throttle_s (float, optional): If given, the callback is invoked at most once in that amount
+                of time: a change that happens sooner after the previous invocation is handled by a single invocation
+                at the end of that time (e.g. for power sensors that report every second). An invocation still pending
+                when the subscription is cancelled or times out doesn't happen.
             **kwargs: Arbitrary keyword parameters to be provided to the callback function when it is triggered.
 
         Note:
@@ -271,7 +3584,96 @@ class Entity:
         Returns:
             A string that uniquely identifies the callback and can be used to cancel it later if necessary. Since
             variables created within object methods are local to the function they are created in, it's recommended to
-            store the handles in the app's instance variables, e.g. ``self.handle``.
+            store the handles in the app's instance variables, e.g. ``self.handle``. Cancel it with
+            ``self.ha.hapt.subscriptions.cancel(handle)`` rather than through AppDaemon, so that HAPT's count of live
+            subscriptions stays accurate (see `Subscriptions`).
+        """
+
+        learned_read_set: ReadSet = {}
+        is_async = inspect.iscoroutinefunction(callback)
+        # Unless AppDaemon needs to handle a duration, we may listen to the full state and filter ourselves, so that
+        # the callback finds the full state of its entity (with all attributes) in the caches rather than fetching it
+        full_state_events = self.hapt.seed_full_state and duration_s is None
+        limiter = (
+            BurstLimiter(
+                self.hapt,
+                partial(
+                    (
+                        self.hapt.run_callback_async
+                        if is_async
+                        else self.hapt.run_callback
+                    ),
+                    learned_read_set,
+                    callback,
+                    *args,
+                    **kwargs,
+                ),
+                coalesce_ms,
+                throttle_s,
+                timeout_s,
+            )
+            if coalesce_ms or throttle_s
+            else None
+        )
+
+        def accepts(
+            event_attribute: str | None, event_old: Any, event_new: Any
+        ) -> bool:
+            if full_state_events and not state_event_matches(
+                attribute, event_old, event_new, old, new
+            ):
+                return False
+            return limiter is None or limiter.on_event()
+
+        wrapper, listener = self._wrap_state_callback(
+            learned_read_set, accepts, callback, *args, **kwargs
+        )
+        if full_state_events:
+            handle = self.hapt.adapi.listen_state(
+                wrapper,
+                self.entity_id,
+                timeout=timeout_s,
+                attribute="all",
+            )
+        else:
+            handle = self.hapt.adapi.listen_state(
+                wrapper,
+                self.entity_id,
+                new=new,
+                old=old,
+                duration=duration_s,
+                timeout=timeout_s,
+                attribute=attribute,
+                immediate=(
+                    # I don't think there's a use-case for anything else...
+                    (duration_s is not None)
+                ),
+            )
+
+        def cancel() -> None:
+            self.hapt.forget_listener(listener)
+            if limiter is not None:
+                limiter.cancel()
+
+        return self.hapt.subscriptions.add(
+            handle, [self.entity_id], callback, on_cancel=cancel
+        )
+
+    def _wrap_state_callback(
+        self,
+        learned_read_set: ReadSet,
+        accepts: Callable[[str | None, Any, Any], bool],
+        callback: Callable[FunctionArgsGeneric, Any],
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> tuple[Callable[..., Any], int]:
+        """
+        Wraps a state callback of the entity to be registered with AppDaemon: the wrapper records the event if
+        recording, and if `accepts(attribute, old, new)`, runs the callback with fresh repeatable read caches seeded with
+        the new state. Async callbacks get an async wrapper, since AppDaemon runs these directly on the event loop.
+
+        Returns:
+            The wrapper, and its index in `HaptSharedState.listeners`
         """
 
         def callback_wrapper(
@@ -282,31 +3684,119 @@ class Entity:
             **cb_args: dict[str, object],
         ) -> None:
             assert self.entity_id == entity
+            if self.hapt.recorder is not None:
+                self.hapt.recorder.write("c", listener, entity, attribute, old, new)
+            if not accepts(attribute, old, new):
+                return
+            with self.hapt.callback_context() as context:
+                # Each invocation starts with its own empty caches, whatever else runs concurrently
+                assert not context.state_cache and not context.full_cache
+                self.seed_caches(attribute, new)
+                self.hapt.run_callback(learned_read_set, callback, *args, **kwargs)
+
+        async def async_callback_wrapper(
+            entity: str,
+            attribute: str | None,
+            old: Any,
+            new: Any,
+            **cb_args: dict[str, object],
+        ) -> None:
+            assert self.entity_id == entity
+            if self.hapt.recorder is not None:
+                self.hapt.recorder.write("c", listener, entity, attribute, old, new)
+            if not accepts(attribute, old, new):
+                return
+            with self.hapt.callback_context() as context:
+                # Each invocation starts with its own empty caches, whatever else runs concurrently
+                assert not context.state_cache and not context.full_cache
+                self.seed_caches(attribute, new)
+                await self.hapt.run_callback_async(
+                    learned_read_set, callback, *args, **kwargs
+                )
+
+        wrapper = (
+            async_callback_wrapper
+            if inspect.iscoroutinefunction(callback)
+            else callback_wrapper
+        )
+        listener = self.hapt.register_listener(callback, wrapper)
+        return wrapper, listener
+
+    def listen_numeric_threshold(
+        self,
+        callback: Callable[FunctionArgsGeneric, Any],
+        above: float | None = None,
+        below: float | None = None,
+        hysteresis: float = 0.0,
+        min_duration_s: float | None = None,
+        *args: FunctionArgsGeneric.args,
+        **kwargs: FunctionArgsGeneric.kwargs,
+    ) -> str:
+        """
+        Listen to the state of a numeric entity crossing thresholds.
+
+        Reported values are parsed and compared in the state subscription itself, so the callback only runs when the
+        state starts being above `above` and/or below `below` (see `Threshold`), rather than on every report.
+
+        Args:
+            callback: Function that will be called with `args` and `kwargs` when the threshold is crossed.
+            above (float, optional): The callback runs when the state goes above that value.
+            below (float, optional): The callback runs when the state goes below that value. If both are given, the
+                callback runs when the state goes between them.
+            hysteresis (float, optional): How far back past the thresholds the state has to go before the callback may
+                run again.
+            min_duration_s (float, optional): If given, the callback only runs if the state is still past the
+                thresholds that long after crossing them. A crossing still pending when the subscription is cancelled
+                doesn't run it.
 
-            self.hapt.check_caches()  # This should always clear caches because we are handling a callback, so assert it
-            assert len(self.hapt.state_cache) == 0 and len(self.hapt.full_cache) == 0
-
-            if attribute is None:
-                self.hapt.state_cache[self.entity_id] = new
-            elif attribute == "all":
-                self.hapt.full_cache[self.entity_id] = new
-                self.hapt.state_cache[self.entity_id] = new["state"]
-            callback(*args, **kwargs)
-
-        return self.hapt.adapi.listen_state(
-            callback_wrapper,
-            self.entity_id,
-            new=new,
-            old=old,
-            duration=duration_s,
-            timeout=timeout_s,
-            attribute=attribute,
-            immediate=(
-                # I don't think there's a use-case for anything else...
-                (duration_s is not None)
+        Returns:
+            The handle of the underlying AppDaemon subscription, to cancel it if necessary.
+        """
+        threshold = Threshold(above, below, hysteresis)
+
+        def crossed(attribute: str | None, old: Any, new: Any) -> bool:
+            "Whether to run the callback now. Crossings that must last are handed over to a timer instead."
+            crossing = threshold.update(old, new)
+            if crossing is None or min_duration_s is None:
+                return crossing is True
+            if crossing:
+                # Keyed by the threshold itself, so that each subscription has its own timer
+                self.hapt.timers.set(
+                    threshold, min_duration_s, callback, *args, **kwargs
+                )
+            else:
+                self.hapt.timers.cancel(threshold)
+            return False
+
+        wrapper, listener = self._wrap_state_callback(
+            {}, crossed, callback, *args, **kwargs
+        )
+
+        def cancel() -> None:
+            self.hapt.forget_listener(listener)
+            self.hapt.timers.forget(threshold)
+
+        # Only the state is needed, so AppDaemon doesn't even dispatch changes of the attributes
+        return self.hapt.subscriptions.add(
+            self.hapt.adapi.listen_state(
+                wrapper, self.entity_id, namespace=self.namespace
             ),
+            [self.entity_id],
+            callback,
+            on_cancel=cancel,
         )
 
+    def seed_caches(self, attribute: str | None, new: Any) -> None:
+        "Stores the new state given to a state callback in the repeatable read caches, so that it isn't fetched again"
+        if attribute is None or attribute == "state":
+            self.hapt.state_cache[self.entity_id] = new
+        elif attribute == "all":
+            if new is None:
+                # The entity was removed: nothing to seed, reads find out for themselves
+                return
+            self.hapt.full_cache[self.entity_id] = new
+            self.hapt.state_cache[self.entity_id] = new["state"]
+
     def last_changed(self) -> datetime:
         """
         Get the last time the entity changed state.
@@ -314,8 +3804,8 @@ class Entity:
         Returns:
             datetime: The last time the entity changed state.
         """
-        return datetime.fromisoformat(
-            self.get_state_repeatable_read(attribute="last_changed")
+        return self.get_state_repeatable_read_converted(
+            datetime.fromisoformat, attribute="last_changed"
         )
 
     def last_reported(self) -> datetime:
@@ -325,12 +3815,32 @@ class Entity:
         Returns:
             datetime: The last time the entity changed state.
         """
-        return datetime.fromisoformat(
-            self.get_state_repeatable_read(attribute="last_reported")
+        return self.get_state_repeatable_read_converted(
+            datetime.fromisoformat, attribute="last_reported"
+        )
+
+    async def last_changed_async(self) -> datetime:
+        "Async counterpart of `last_changed`"
+        return await self.get_state_repeatable_read_converted_async(
+            datetime.fromisoformat, attribute="last_changed"
+        )
+
+    async def last_reported_async(self) -> datetime:
+        "Async counterpart of `last_reported`"
+        return await self.get_state_repeatable_read_converted_async(
+            datetime.fromisoformat, attribute="last_reported"
         )
 
 
 class Domain:
+    """
+    Entities of a domain, as attributes.
+
+    Generated domains declare a slot for each of their entities, where the entity is stored the first time it is used.
+    """
+
+    __slots__ = ("_hapt", "_domain_name")
+
     def __init__(self, hapt: HaptSharedState, domain_name: str):
         self._hapt = hapt
         self._domain_name = domain_name
@@ -398,6 +3908,8 @@ class OnOffState(Entity):
     This provides better typing and an `is_on` function for entities that can only be on or off.
     """
 
+    __slots__ = ()
+
     def state(
         self,
     ) -> OnOff:
@@ -416,14 +3928,7 @@ class OnOffState(Entity):
         Returns:
             bool: True if the entity is on, False otherwise.
         """
-        entity_state = self.state()
-        match entity_state:
-            case "off":
-                return False
-            case "on":
-                return True
-            case _:
-                assert_never(entity_state)
+        return on_off_to_bool(self.state())
 
     def is_off(self) -> bool:
         """
@@ -434,6 +3939,54 @@ class OnOffState(Entity):
         """
         return not self.is_on()
 
+    def is_effectively_on(self) -> bool:
+        """
+        Check if the entity is on, or is going to be once the command that was sent to it has been applied.
+
+        Returns:
+            bool: True if the entity is (going to be) on, False otherwise.
+        """
+        return on_off_to_bool(self.effective_state())
+
+    def is_effectively_off(self) -> bool:
+        """
+        Check if the entity is off, or is going to be once the command that was sent to it has been applied.
+
+        Returns:
+            bool: True if the entity is (going to be) off, False otherwise.
+        """
+        return not self.is_effectively_on()
+
+    async def state_async(self) -> OnOff:
+        "Async counterpart of `state`"
+        return await super().get_state_repeatable_read_async()
+
+    async def is_on_async(self) -> bool:
+        "Async counterpart of `is_on`"
+        return on_off_to_bool(await self.state_async())
+
+    async def is_off_async(self) -> bool:
+        "Async counterpart of `is_off`"
+        return not await self.is_on_async()
+
+    async def is_effectively_on_async(self) -> bool:
+        "Async counterpart of `is_effectively_on`"
+        return on_off_to_bool(await self.effective_state_async())
+
+    async def is_effectively_off_async(self) -> bool:
+        "Async counterpart of `is_effectively_off`"
+        return not await self.is_effectively_on_async()
+
+
+def on_off_to_bool(entity_state: OnOff) -> bool:
+    match entity_state:
+        case "off":
+            return False
+        case "on":
+            return True
+        case _:
+            assert_never(entity_state)
+
 
 class InputButton(Entity):
     """
@@ -442,6 +3995,8 @@ class InputButton(Entity):
     Any entity in the `input_button` domain when introspected will inherit this class
     """
 
+    __slots__ = ()
+
     def last_pressed_at(self) -> datetime | None:
         """
         Retrieve when the button was last pressed.
@@ -449,10 +4004,17 @@ class InputButton(Entity):
         Returns:
             datetime | None: When the button was last pressed, or None if we don't know of a press.
         """
-        state = self.get_state_repeatable_read()
-        if state == "unknown":
-            return None
-        return datetime.fromisoformat(state)
+        return self.get_state_repeatable_read_converted(parse_pressed_at)
+
+    async def last_pressed_at_async(self) -> datetime | None:
+        "Async counterpart of `last_pressed_at`"
+        return await self.get_state_repeatable_read_converted_async(parse_pressed_at)
+
+
+def parse_pressed_at(state: str) -> datetime | None:
+    if state == "unknown":
+        return None
+    return datetime.fromisoformat(state)
 
 
 class Climate(Entity):
@@ -463,6 +4025,8 @@ class Climate(Entity):
     the `temperature` and `current_temperature` attributes.
     """
 
+    __slots__ = ()
+
     def temperature(self) -> float:
         """
         Retrieve the target temperature of the thermostat.
@@ -470,7 +4034,7 @@ class Climate(Entity):
         Returns:
             float: The target temperature of the thermostat.
         """
-        return float(self.get_state_repeatable_read(attribute="temperature"))
+        return self.get_state_repeatable_read_converted(float, attribute="temperature")
 
     def current_temperature(self) -> float:
         """
@@ -479,4 +4043,18 @@ class Climate(Entity):
         Returns:
             float: The current temperature of the thermostat.
         """
-        return float(self.get_state_repeatable_read(attribute="current_temperature"))
+        return self.get_state_repeatable_read_converted(
+            float, attribute="current_temperature"
+        )
+
+    async def temperature_async(self) -> float:
+        "Async counterpart of `temperature`"
+        return await self.get_state_repeatable_read_converted_async(
+            float, attribute="temperature"
+        )
+
+    async def current_temperature_async(self) -> float:
+        "Async counterpart of `current_temperature`"
+        return await self.get_state_repeatable_read_converted_async(
+            float, attribute="current_temperature"
+        )
@@ -0,0 +1,1145 @@
+"""
+Runs apps offline against a stand-in for AppDaemon, in virtual time, and replays the traffic recorded by
+`HaptSharedState.enable_recording` through them.
+
+Like `homeassistant_python_typer_helpers`, this file is meant to be copied next to the apps (AppDaemon must be
+installed). Replaying a recording checks that a change to an automation doesn't change the service calls it makes on
+real traffic, and measures how fast its callbacks run, without Home Assistant:
+
+    report = replay(ThermostatControl, "thermostat.log")
+    print(report.summary())
+
+or from the command line:
+
+    python homeassistant_python_typer_testing.py thermostat:ThermostatControl thermostat.log
+
+Apps can also be simulated over days or months of virtual time in seconds, with scripted state changes (see
+`Scenario`, `simulate` and `simulate_many`).
+"""
+
+import argparse
+import asyncio
+import bisect
+from collections import deque
+import concurrent.futures
+from dataclasses import dataclass, field
+import datetime as dt
+import difflib
+import heapq
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from types import SimpleNamespace
+from typing import Any, Callable, Self, TypeVar, cast
+
+from appdaemon.utils import has_expanded_kwargs, sync_decorator
+
+import homeassistant_python_typer_helpers as hapth
+
+AppGeneric = TypeVar("AppGeneric")
+
+
+def attribute_value(entity_state: dict[str, Any] | None, attribute: str) -> Any:
+    "Like AppDaemon: a top-level field of the state (state, last_changed...) if there is one, otherwise an attribute"
+    if entity_state is None:
+        return None
+    if attribute in entity_state:
+        return entity_state[attribute]
+    return entity_state.get("attributes", {}).get(attribute)
+
+
+def value_matches(constraint: Any, value: Any) -> bool:
+    "Whether the value of a state change satisfies the `new` or `old` of a listener, as AppDaemon checks them"
+    return (
+        constraint is None
+        or constraint == value
+        or (callable(constraint) and constraint(value) is True)
+    )
+
+
+@dataclass
+class StateListener:
+    app: "StandInApp"
+    callback: Callable[..., Any]
+    entity_id: str | None
+    "Entity id, domain, or None for all the entities of the namespace"
+    namespace: str
+    attribute: str | None
+    new: Any
+    old: Any
+    duration_s: float | None
+    kwargs: dict[str, Any]
+    duration_timer: str | None = None
+    "Timer running the listener at the end of its duration, like AppDaemon's `__duration`"
+
+
+@dataclass
+class Timer:
+    app: "StandInApp"
+    callback: Callable[..., Any]
+    at: float
+    interval_s: float | None
+    kwargs: dict[str, Any]
+
+
+class StandInServices:
+    "Records the service calls instead of sending them to Home Assistant"
+
+    def __init__(self):
+        self.calls: list[tuple[str, str, dict[str, Any], str]] = []
+        "(domain, service, data, namespace) of every call, in order"
+        self.on_call: Callable[[str, str, dict[str, Any], str], Any] | None = None
+        """
+        Called with the same arguments on every call, e.g. to update the state of the target entities like Home
+        Assistant would. May be a coroutine function.
+        """
+
+    async def call_service(
+        self, namespace: str, domain: str, service: str, data: dict[str, Any]
+    ) -> Any:
+        self.calls.append((domain, service, data, namespace))
+        if self.on_call is not None:
+            result = self.on_call(domain, service, data, namespace)
+            if inspect.isawaitable(result):
+                return await result
+            return result
+
+
+class StandInAppDaemon:
+    """
+    Just what apps and HAPT need from the AppDaemon instance: an event loop running in its own thread, the state store,
+    the services, state listeners, and a scheduler that runs in virtual time.
+
+    Callbacks are queued like AppDaemon queues them for its worker threads, and run one at a time by whichever thread
+    calls `set_state`, `advance` or `drain`, which plays the role of the worker threads. This makes runs deterministic.
+    Async callbacks run on the event loop, as with AppDaemon.
+    """
+
+    def __init__(self, start_time: float | None = None):
+        self.loop = asyncio.new_event_loop()
+        self.main_thread_id = 0
+        "Identifier of the thread running the event loop, as AppDaemon calls it"
+        started = threading.Event()
+
+        def run_loop() -> None:
+            asyncio.set_event_loop(self.loop)
+            self.main_thread_id = threading.get_ident()
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(
+            target=run_loop, name="stand-in AppDaemon event loop", daemon=True
+        )
+        self.thread.start()
+        started.wait()
+
+        def add_future(name: str, future: "asyncio.Future[Any]") -> None:
+            pass
+
+        self.futures = SimpleNamespace(add_future=add_future)
+        self.config = SimpleNamespace(internal_function_timeout=60)
+        self.state = SimpleNamespace(state={})
+        "namespace -> entity id -> full state dict, replaced on each change like AppDaemon does"
+        self.history: dict[tuple[str, str], list[tuple[float, Any]]] = {}
+        "(namespace, entity id) -> (timestamp, state) of each state change, like Home Assistant's recorder"
+        self.services = StandInServices()
+        self.now = time.time() if start_time is None else start_time
+        "Virtual time, in seconds since the epoch"
+        self.listeners: dict[str, StateListener] = {}
+        self.timers: dict[str, Timer] = {}
+        self.timer_heap: list[tuple[float, int, str]] = []
+        self.lock = threading.Lock()
+        "Listeners and timers are registered from both the event loop and the thread driving the stand-in"
+        self.queued: deque[
+            tuple["StandInApp", Callable[..., Any], tuple[Any, ...], dict[str, Any]]
+        ] = deque()
+        "Callbacks waiting to run, like AppDaemon's worker queue"
+        self.handles = itertools.count()
+        self.errors: list[str] = []
+        "Tracebacks of the exceptions raised by callbacks"
+        self.clocks = hapth.Clocks(monotonic=self.monotonic, wall=self.monotonic)
+        """
+        Clocks of the `HaptSharedState`s created by callbacks (including `initialize`), so that timeouts and rates
+        follow virtual time. Pass them to those created otherwise.
+        """
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def new_handle(self) -> str:
+        return f"stand_in_{next(self.handles)}"
+
+    def monotonic(self) -> float:
+        "Virtual time, which is both the monotonic and the wall clock of HAPT under the stand-in (see `clocks`)"
+        return self.now
+
+    @property
+    def callbacks(self) -> SimpleNamespace:
+        "The state listeners of each app, shaped like AppDaemon's registry of callbacks (app name -> handle -> ...)"
+        per_app: dict[str, dict[str, StateListener]] = {}
+        with self.lock:
+            for handle, listener in self.listeners.items():
+                per_app.setdefault(listener.app.name, {})[handle] = listener
+        return SimpleNamespace(callbacks=per_app)
+
+    def set_state(
+        self,
+        entity_id: str,
+        state: Any = None,
+        attributes: dict[str, Any] | None = None,
+        namespace: str = "default",
+        replace: bool = False,
+        run_callbacks: bool = True,
+    ) -> dict[str, Any]:
+        """
+        Changes the state of an entity as a state change event from Home Assistant would, queueing the listeners it
+        triggers. They are run right away when called from outside of callbacks, unless `run_callbacks` is False.
+
+        Attributes are merged into the current ones, unless `replace` is True.
+        """
+        entities = self.state.state.setdefault(namespace, {})
+        old_state = entities.get(entity_id)
+        timestamp = dt.datetime.fromtimestamp(self.now, dt.timezone.utc).isoformat()
+        new_state = {
+            "entity_id": entity_id,
+            "state": state,
+            "attributes": (
+                dict(attributes or {})
+                if replace or old_state is None
+                else {**old_state["attributes"], **(attributes or {})}
+            ),
+            "last_changed": (
+                old_state["last_changed"]
+                if old_state is not None and old_state["state"] == state
+                else timestamp
+            ),
+            "last_updated": timestamp,
+            "last_reported": timestamp,
+        }
+        entities[entity_id] = new_state
+        self.history.setdefault((namespace, entity_id), []).append((self.now, state))
+        self.queue_state_callbacks(entity_id, namespace, old_state, new_state)
+        if run_callbacks and threading.get_ident() != self.main_thread_id:
+            self.drain()
+        return new_state
+
+    def queue_state_callbacks(
+        self,
+        entity_id: str,
+        namespace: str,
+        old_state: dict[str, Any] | None,
+        new_state: dict[str, Any],
+    ) -> None:
+        domain = entity_id.split(".", 1)[0]
+        with self.lock:
+            listeners = list(self.listeners.items())
+        for handle, listener in listeners:
+            if listener.namespace != namespace or listener.entity_id not in (
+                None,
+                entity_id,
+                domain,
+            ):
+                continue
+            if listener.attribute == "all":
+                # Like AppDaemon, no filtering on new/old for the full state
+                self.queued.append(
+                    (
+                        listener.app,
+                        listener.callback,
+                        (entity_id, "all", old_state, new_state),
+                        listener.kwargs,
+                    )
+                )
+                continue
+            attribute = listener.attribute or "state"
+            old = attribute_value(old_state, attribute)
+            new = attribute_value(new_state, attribute)
+            if new == old:
+                continue
+            if listener.duration_timer is not None:
+                # The value changed again: AppDaemon cancels the pending duration whether or not it restarts it
+                with self.lock:
+                    self.timers.pop(listener.duration_timer, None)
+                listener.duration_timer = None
+            if not (
+                value_matches(listener.old, old) and value_matches(listener.new, new)
+            ):
+                continue
+            args = (entity_id, attribute, old, new)
+            if listener.duration_s is None:
+                self.queued.append(
+                    (listener.app, listener.callback, args, listener.kwargs)
+                )
+            else:
+                listener.duration_timer = self.add_timer(
+                    Timer(
+                        listener.app,
+                        self.make_duration_callback(handle, listener, args),
+                        self.now + listener.duration_s,
+                        None,
+                        {},
+                    )
+                )
+
+    def make_duration_callback(
+        self, handle: str, listener: StateListener, args: tuple[Any, ...]
+    ) -> Callable[[dict[str, Any]], None]:
+        "Runs the listener at the end of its duration, unless it was cancelled in the meantime"
+
+        def run_listener(kwargs: dict[str, Any]) -> None:
+            listener.duration_timer = None
+            if handle in self.listeners:
+                self.invoke(listener.app, listener.callback, args, listener.kwargs)
+
+        return run_listener
+
+    def add_timer(self, timer: Timer) -> str:
+        handle = self.new_handle()
+        with self.lock:
+            self.timers[handle] = timer
+            heapq.heappush(self.timer_heap, (timer.at, next(self.handles), handle))
+        return handle
+
+    def advance(self, seconds: float) -> None:
+        "Moves virtual time forward, running the timers that fall due on the way"
+        self.advance_to(self.now + seconds)
+
+    def advance_to(self, timestamp: float) -> None:
+        "Moves virtual time forward to `timestamp` (seconds since the epoch), running the timers due until then"
+        while True:
+            self.drain()
+            with self.lock:
+                if not self.timer_heap or self.timer_heap[0][0] > timestamp:
+                    break
+                at, _, handle = heapq.heappop(self.timer_heap)
+                timer = self.timers.get(handle)
+                if timer is None or timer.at != at:
+                    # Cancelled
+                    continue
+                if timer.interval_s is None:
+                    del self.timers[handle]
+                else:
+                    timer.at += timer.interval_s
+                    heapq.heappush(
+                        self.timer_heap, (timer.at, next(self.handles), handle)
+                    )
+            self.now = max(self.now, at)
+            self.invoke(timer.app, timer.callback, (), timer.kwargs)
+        self.now = max(self.now, timestamp)
+
+    def drain(self) -> None:
+        "Runs the queued callbacks, including the ones they trigger"
+        while True:
+            self.settle()
+            if not self.queued:
+                return
+            app, callback, args, kwargs = self.queued.popleft()
+            self.invoke(app, callback, args, kwargs)
+
+    def invoke(
+        self,
+        app: "StandInApp",
+        callback: Callable[..., Any],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+    ) -> None:
+        "Runs a callback with AppDaemon's conventions: expanded kwargs if it takes `**kwargs`, a dict otherwise"
+        if has_expanded_kwargs(callback):
+            self.run(app, callback, *args, **kwargs)
+        else:
+            self.run(app, callback, *args, kwargs)
+
+    def run(
+        self, app: "StandInApp", function: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Any:
+        """
+        Runs a function as a callback of `app`: on the event loop if it's a coroutine function, otherwise in the
+        calling thread. Exceptions are logged and collected in `errors` instead of being raised, like AppDaemon does.
+        """
+        app.stand_in_callback_counter += 1
+        clocks = hapth.CLOCKS.set(self.clocks)
+        try:
+            if inspect.iscoroutinefunction(function):
+                result = asyncio.run_coroutine_threadsafe(
+                    function(*args, **kwargs), self.loop
+                ).result()
+            else:
+                result = function(*args, **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            app.logger.error("Callback %s failed:\n%s", function, error)
+            self.errors.append(error)
+            return None
+        finally:
+            hapth.CLOCKS.reset(clocks)
+        self.settle()
+        return result
+
+    def settle(self) -> None:
+        "Waits for the tasks the callbacks left running on the event loop (e.g. fire-and-forget service calls)"
+
+        async def wait_for_tasks() -> None:
+            current = asyncio.current_task()
+            while pending := [
+                task for task in asyncio.all_tasks() if task is not current
+            ]:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.config.internal_function_timeout
+                )
+                if not done:
+                    return
+
+        asyncio.run_coroutine_threadsafe(wait_for_tasks(), self.loop).result()
+
+
+class StandInApp:
+    """
+    Mixin that backs the AppDaemon API of an app with a `StandInAppDaemon` (see `stand_in`).
+
+    Provides what apps commonly use: states (`listen_state`, `get_state`, `set_state`, `get_history`), services, the
+    scheduler (`run_in`, `run_at`, `run_once`, `run_daily`, `run_every`), virtual time (`datetime`, `time`, `date`,
+    `get_now`, `get_now_ts`) and logging.
+    """
+
+    def __init__(
+        self,
+        AD: StandInAppDaemon,
+        name: str = "app",
+        namespace: str = "default",
+        args: dict[str, Any] | None = None,
+    ):
+        self.stand_in_AD = AD
+        self.stand_in_name = name
+        self.stand_in_namespace = namespace
+        self.stand_in_logger = logging.getLogger(f"hapt.stand_in.{name}")
+        self.stand_in_callback_counter = 0
+        self.args = args or {}
+
+    # What AppDaemon defines as properties has to be properties here too
+    @property
+    def name(self) -> str:
+        return self.stand_in_name
+
+    @property
+    def AD(self) -> StandInAppDaemon:
+        return self.stand_in_AD
+
+    @property
+    def namespace(self) -> str:
+        return self.stand_in_namespace
+
+    @property
+    def logger(self) -> logging.Logger:
+        return self.stand_in_logger
+
+    @property
+    def callback_counter(self) -> int:
+        return self.stand_in_callback_counter
+
+    def get_ad_api(self) -> "StandInApp":
+        return self
+
+    # Logging
+
+    def log(self, msg: str, *args: Any, level: str = "INFO", **kwargs: Any) -> None:
+        self.logger.log(logging.getLevelNamesMapping()[level], msg, *args)
+
+    def error(
+        self, msg: str, *args: Any, level: str = "WARNING", **kwargs: Any
+    ) -> None:
+        self.logger.log(logging.getLevelNamesMapping()[level], msg, *args)
+
+    # States
+
+    @sync_decorator
+    async def listen_state(
+        self,
+        callback: Callable[..., Any],
+        entity_id: str | None = None,
+        namespace: str | None = None,
+        new: Any = None,
+        old: Any = None,
+        duration: float | None = None,
+        attribute: str | None = None,
+        timeout: float | None = None,
+        **kwargs: Any,
+    ) -> str:
+        kwargs.pop("immediate", None)
+        kwargs.pop("oneshot", None)
+        handle = self.AD.new_handle()
+        with self.AD.lock:
+            self.AD.listeners[handle] = StateListener(
+                self,
+                callback,
+                entity_id,
+                namespace or self.namespace,
+                attribute,
+                new,
+                old,
+                duration,
+                kwargs,
+            )
+        if timeout is not None:
+
+            def expire(kwargs: dict[str, Any]) -> None:
+                with self.AD.lock:
+                    self.AD.listeners.pop(handle, None)
+
+            self.AD.add_timer(Timer(self, expire, self.AD.now + timeout, None, {}))
+        return handle
+
+    @sync_decorator
+    async def cancel_listen_state(self, handle: str, silent: bool = False) -> bool:
+        with self.AD.lock:
+            return self.AD.listeners.pop(handle, None) is not None
+
+    @sync_decorator
+    async def get_state(
+        self,
+        entity_id: str | None = None,
+        attribute: str | None = None,
+        default: Any = None,
+        namespace: str | None = None,
+        copy: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        return self.read_state(
+            namespace or self.namespace, entity_id, attribute, default
+        )
+
+    def read_state(
+        self,
+        namespace: str,
+        entity_id: str | None,
+        attribute: str | None,
+        default: Any,
+    ) -> Any:
+        entities = self.AD.state.state.get(namespace, {})
+        if entity_id is None:
+            return dict(entities)
+        entity_state = entities.get(entity_id)
+        if entity_state is None:
+            return default
+        if attribute is None:
+            return entity_state["state"]
+        if attribute == "all":
+            return entity_state
+        value = attribute_value(entity_state, attribute)
+        return default if value is None else value
+
+    @sync_decorator
+    async def get_history(
+        self,
+        entity_id: str,
+        start_time: dt.datetime,
+        end_time: dt.datetime,
+        namespace: str | None = None,
+        **kwargs: Any,
+    ) -> list[list[dict[str, Any]]]:
+        "Like Home Assistant's minimal response: the state as of `start_time`, then each change until `end_time`"
+        changes = self.AD.history.get((namespace or self.namespace, entity_id), [])
+        start_ts, end_ts = start_time.timestamp(), end_time.timestamp()
+        first = bisect.bisect_right(changes, start_ts, key=lambda change: change[0])
+        last = bisect.bisect_right(changes, end_ts, key=lambda change: change[0])
+        entries = [
+            {
+                "entity_id": entity_id,
+                "state": state,
+                "last_changed": dt.datetime.fromtimestamp(
+                    max(timestamp, start_ts), dt.timezone.utc
+                ),
+            }
+            # Starting with the state as of `start_time`
+            for timestamp, state in changes[max(0, first - 1) : last]
+        ]
+        return [entries]
+
+    def get_entity(self, entity_id: str, namespace: str | None = None) -> Any:
+        return StandInEntity(self, entity_id, namespace or self.namespace)
+
+    @sync_decorator
+    async def set_state(
+        self,
+        entity_id: str,
+        state: Any = None,
+        attributes: dict[str, Any] | None = None,
+        namespace: str | None = None,
+        replace: bool = False,
+        check_existence: bool = True,
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        # Called on the event loop: the listeners are queued for the thread driving the stand-in to run
+        return self.AD.set_state(
+            entity_id,
+            state,
+            {**(attributes or {}), **kwargs},
+            namespace or self.namespace,
+            replace,
+        )
+
+    # Services
+
+    @sync_decorator
+    async def call_service(
+        self, service: str, namespace: str | None = None, **data: Any
+    ) -> Any:
+        domain, service_name = service.split("/", 1)
+        return await self.AD.services.call_service(
+            namespace or self.namespace, domain, service_name, data
+        )
+
+    # Scheduler
+
+    @sync_decorator
+    async def run_in(
+        self, callback: Callable[..., Any], delay: float, **kwargs: Any
+    ) -> str:
+        return self.AD.add_timer(
+            Timer(self, callback, self.AD.now + delay, None, kwargs)
+        )
+
+    @sync_decorator
+    async def run_at(
+        self, callback: Callable[..., Any], start: Any, **kwargs: Any
+    ) -> str:
+        return self.AD.add_timer(
+            Timer(self, callback, self.next_occurrence(start), None, kwargs)
+        )
+
+    @sync_decorator
+    async def run_once(
+        self, callback: Callable[..., Any], start: Any, **kwargs: Any
+    ) -> str:
+        return self.AD.add_timer(
+            Timer(self, callback, self.next_occurrence(start), None, kwargs)
+        )
+
+    @sync_decorator
+    async def run_daily(
+        self, callback: Callable[..., Any], start: Any, **kwargs: Any
+    ) -> str:
+        return self.AD.add_timer(
+            Timer(self, callback, self.next_occurrence(start), 24 * 60 * 60, kwargs)
+        )
+
+    @sync_decorator
+    async def run_every(
+        self,
+        callback: Callable[..., Any],
+        start: Any = None,
+        interval: float | dt.timedelta = 0,
+        **kwargs: Any,
+    ) -> str:
+        interval_s = (
+            interval.total_seconds()
+            if isinstance(interval, dt.timedelta)
+            else float(interval)
+        )
+        if start == "immediate":
+            at = self.AD.now
+        elif start is None or start == "now":
+            at = self.AD.now + interval_s
+        else:
+            at = self.next_occurrence(start)
+        return self.AD.add_timer(Timer(self, callback, at, interval_s, kwargs))
+
+    @sync_decorator
+    async def cancel_timer(self, handle: str, silent: bool = False) -> bool:
+        with self.AD.lock:
+            return self.AD.timers.pop(handle, None) is not None
+
+    def next_occurrence(self, start: Any) -> float:
+        "Timestamp of `start` (datetime, time of day, or their ISO format), the next day if that time already passed"
+        if isinstance(start, str):
+            start = (
+                dt.datetime.fromisoformat(start)
+                if "T" in start or "-" in start
+                else dt.time.fromisoformat(start)
+            )
+        if isinstance(start, dt.datetime):
+            return start.timestamp()
+        if isinstance(start, dt.time):
+            now = self.get_now()
+            at = dt.datetime.combine(now.date(), start, now.tzinfo)
+            if at <= now:
+                at += dt.timedelta(days=1)
+            return at.timestamp()
+        raise ValueError(f"Unsupported start for the stand-in scheduler: {start!r}")
+
+    # Virtual time
+
+    def get_now(self) -> dt.datetime:
+        return dt.datetime.fromtimestamp(self.AD.now).astimezone()
+
+    def get_now_ts(self) -> float:
+        return self.AD.now
+
+    def datetime(self, aware: bool = False) -> dt.datetime:
+        now = self.get_now()
+        return now if aware else now.replace(tzinfo=None)
+
+    def time(self) -> dt.time:
+        return self.datetime().time()
+
+    def date(self) -> dt.date:
+        return self.datetime().date()
+
+
+class StandInEntity:
+    "What `StandInApp.get_entity` returns"
+
+    def __init__(self, app: StandInApp, entity_id: str, namespace: str):
+        self.app = app
+        self.entity_id = entity_id
+        self.namespace = namespace
+
+    # Unfortunately we need those for the sync_decorator to work
+    @property
+    def name(self) -> str:
+        return self.app.name
+
+    @property
+    def AD(self) -> StandInAppDaemon:
+        return self.app.AD
+
+    @property
+    def logger(self) -> logging.Logger:
+        return self.app.logger
+
+    @sync_decorator
+    async def get_state(
+        self,
+        attribute: str | None = None,
+        default: Any = None,
+        copy: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        return self.app.read_state(self.namespace, self.entity_id, attribute, default)
+
+
+def stand_in(
+    app_class: type[AppGeneric],
+    AD: StandInAppDaemon,
+    name: str = "app",
+    namespace: str = "default",
+    args: dict[str, Any] | None = None,
+) -> AppGeneric:
+    """
+    Instantiates an app (a `hass.Hass` subclass) backed by the stand-in for AppDaemon. `initialize` is not called, so
+    that the state store may be filled first.
+    """
+    stand_in_class = (
+        app_class
+        if issubclass(app_class, StandInApp)
+        else type(app_class.__name__, (StandInApp, app_class), {})
+    )
+    return stand_in_class(AD, name=name, namespace=namespace, args=args)  # type: ignore
+
+
+def load_recording(path: str) -> list[list[Any]]:
+    "Reads a log written by `hapth.Recorder`, skipping a last line truncated by a crash"
+    records: list[list[Any]] = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+@dataclass
+class ReplayReport:
+    events: int = 0
+    "State callbacks replayed"
+    duration_s: float = 0.0
+    "Wall clock time spent replaying, including `initialize`"
+    per_callback: dict[str, hapth.Histogram] = field(default_factory=dict)
+    "Time spent in each listener (including prefetching and the calls it makes), by callback name"
+    expected_calls: list[str] = field(default_factory=list)
+    "Service calls in the recording, as JSON"
+    actual_calls: list[str] = field(default_factory=list)
+    "Service calls made during the replay, as JSON"
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def events_per_s(self) -> float:
+        return self.events / self.duration_s if self.duration_s else 0.0
+
+    @property
+    def calls_match(self) -> bool:
+        return self.expected_calls == self.actual_calls
+
+    def calls_diff(self) -> list[str]:
+        "Unified diff from the recorded service calls to the replayed ones"
+        return list(
+            difflib.unified_diff(
+                self.expected_calls,
+                self.actual_calls,
+                "recorded",
+                "replayed",
+                lineterm="",
+            )
+        )
+
+    def summary(self) -> str:
+        lines = [
+            f"{self.events} events replayed in {self.duration_s:.3f}s ({self.events_per_s:.0f} events/s)",
+            f"{len(self.actual_calls)} service calls, {len(self.expected_calls)} recorded: "
+            + ("identical" if self.calls_match else "DIFFERENT"),
+        ]
+        for name, histogram in sorted(
+            self.per_callback.items(), key=lambda item: -item[1].total_s
+        ):
+            lines.append(f"  {name}: {histogram.summary()}")
+        lines.extend(self.calls_diff())
+        if self.errors:
+            lines.append(f"{len(self.errors)} callbacks failed, first one:")
+            lines.append(self.errors[0])
+        return "\n".join(lines)
+
+
+def call_as_json(
+    domain: str, service: str, data: dict[str, Any], namespace: str | None
+) -> str:
+    # Normalized like in the recording, so that e.g. tuples and lists compare equal
+    return json.dumps([domain, service, data, namespace], sort_keys=True, default=str)
+
+
+def shared_states(app: object) -> list[hapth.HaptSharedState]:
+    "The `HaptSharedState` of every `HomeAssistant` object an app holds as an attribute"
+    found: list[hapth.HaptSharedState] = []
+    for value in vars(app).values():
+        hapt = getattr(value, "hapt", value)
+        if isinstance(hapt, hapth.HaptSharedState) and hapt not in found:
+            found.append(hapt)
+    return found
+
+
+def replay(
+    app_class: type[Any],
+    log_path: str,
+    name: str = "app",
+    namespace: str = "default",
+    args: dict[str, Any] | None = None,
+    settle_s: float = 60.0,
+) -> ReplayReport:
+    """
+    Replays the traffic recorded by `HaptSharedState.enable_recording` through an app, in virtual time.
+
+    The app is initialized at the time of the first record. Then before each recorded state callback, virtual time is
+    moved to the time it happened at (running the timers due, including those of AppDaemon's scheduler), and the
+    states the app fetched from then until the next callback are loaded into the state store. The recorded HAPT
+    listener is then run with the recorded event. Timers due up to `settle_s` after the last record are also run.
+
+    Listeners are matched by registration order, so the app has to register the same HAPT listeners in the same order
+    as when it was recorded. Only service calls made through HAPT are recorded, so only those should be made for the
+    calls to compare equal. When timers and state changes interleave closely, the states that timers read may differ
+    from the recorded ones.
+    """
+    records = load_recording(log_path)
+    report = ReplayReport(
+        expected_calls=[
+            call_as_json(*record[2:6]) for record in records if record[1] == "s"
+        ]
+    )
+    start_time = records[0][0] if records else None
+    with StandInAppDaemon(start_time) as AD:
+        loaded_reads: set[int] = set()
+
+        def load_reads(start: int) -> None:
+            "Loads the states read from record `start` until the next callback"
+            for index in range(start, len(records)):
+                record = records[index]
+                if record[1] == "c":
+                    return
+                if record[1] != "r" or index in loaded_reads:
+                    continue
+                loaded_reads.add(index)
+                _, _, entity_id, entity_namespace, full, value = record
+                entities = AD.state.state.setdefault(entity_namespace or namespace, {})
+                if full:
+                    entities[entity_id] = value
+                else:
+                    entities[entity_id] = {
+                        "entity_id": entity_id,
+                        "attributes": {},
+                        **entities.get(entity_id, {}),
+                        "state": value,
+                    }
+
+        app: Any = stand_in(app_class, AD, name=name, namespace=namespace, args=args)
+        wall_started_at = time.perf_counter()
+        load_reads(0)
+        keep_listeners = hapth.KEEP_LISTENERS.set(True)
+        try:
+            AD.run(app, app.initialize)
+        finally:
+            hapth.KEEP_LISTENERS.reset(keep_listeners)
+        hapts = [hapt for hapt in shared_states(app) if hapt.listeners]
+        if len(hapts) > 1:
+            raise ValueError(
+                f"{name} registers listeners through several HomeAssistant objects, which can't be told apart in "
+                "the recording"
+            )
+        listeners = hapts[0].listeners if hapts else {}
+        for hapt in shared_states(app):
+            hapt.recorder = None
+
+        for index, record in enumerate(records):
+            if record[1] != "c":
+                continue
+            AD.advance_to(record[0])
+            load_reads(index + 1)
+            _, _, listener, entity_id, attribute, old, new = record
+            if attribute == "all" and new is not None:
+                AD.state.state.setdefault(namespace, {})[entity_id] = new
+            if listener not in listeners:
+                report.errors.append(
+                    f"Recorded listener #{listener} was not registered by the app"
+                )
+                continue
+            callback_name, wrapper = listeners[listener]
+            started_at = time.perf_counter()
+            AD.run(app, wrapper, entity_id, attribute, old, new)
+            AD.drain()
+            report.per_callback.setdefault(callback_name, hapth.Histogram()).record(
+                time.perf_counter() - started_at
+            )
+            report.events += 1
+        if records:
+            AD.advance_to(records[-1][0] + settle_s)
+        report.duration_s = time.perf_counter() - wall_started_at
+        report.actual_calls = [call_as_json(*call) for call in AD.services.calls]
+        report.errors.extend(AD.errors)
+    return report
+
+
+@dataclass(frozen=True)
+class StateChange:
+    "A state change of a simulation's timeline"
+
+    at_s: float
+    "Seconds since the start of the simulation"
+    entity_id: str
+    state: Any
+    attributes: dict[str, Any] | None = None
+
+
+def daily_changes(
+    start: dt.datetime,
+    days: int,
+    at: dt.time,
+    entity_id: str,
+    state: Any,
+    attributes: dict[str, Any] | None = None,
+) -> list[StateChange]:
+    "The same state change at the same time of day, on each day of a simulation that starts at `start`"
+    changes = []
+    for day in range(days + 1):
+        moment = dt.datetime.combine(
+            start.date() + dt.timedelta(days=day), at, start.tzinfo
+        )
+        at_s = moment.timestamp() - start.timestamp()
+        if 0 <= at_s < days * 24 * 60 * 60:
+            changes.append(StateChange(at_s, entity_id, state, attributes))
+    return changes
+
+
+@dataclass
+class Scenario:
+    """
+    A simulated run of an app: from when and for how long, the states the entities start with, and how they change
+    over time. The service calls of the app also change the states of the entities they target, like Home Assistant
+    would for common services (see `apply_service_effect`), unless `service_effects` is False.
+
+    Times of day (`run_daily`...) are in the local time zone of the process running the simulation.
+
+    Scenarios are sent to other processes by `simulate_many`, so the app class must be importable and the rest of the
+    scenario made of plain data.
+    """
+
+    app_class: type[Any]
+    start: dt.datetime
+    duration: dt.timedelta
+    initial_states: dict[str, Any] = field(default_factory=dict)
+    "entity id -> state, or (state, attributes)"
+    timeline: list[StateChange] = field(default_factory=list)
+    args: dict[str, Any] = field(default_factory=dict)
+    "App arguments"
+    name: str = "app"
+    service_effects: bool = True
+
+
+@dataclass
+class SimulationResult:
+    calls: list[tuple[dt.datetime, str, str, dict[str, Any]]]
+    "(virtual time, domain, service, data) of every service call the app made"
+    final_states: dict[str, Any]
+    "entity id -> state at the end of the simulation"
+    errors: list[str]
+    "Tracebacks of the exceptions raised by callbacks"
+    wall_s: float
+    "Wall clock time the simulation took"
+
+
+def apply_service_effect(
+    AD: StandInAppDaemon,
+    domain: str,
+    service: str,
+    data: dict[str, Any],
+    namespace: str,
+) -> None:
+    """
+    Changes the states of the entities targeted by a service call like Home Assistant would, for the most common
+    services: `turn_on` (with its data as attributes), `turn_off`, `toggle`, `set_value`, `select_option`,
+    `set_temperature`, `set_hvac_mode` and `press`. Other services have no effect.
+    """
+    entity_ids = data.get("entity_id")
+    if entity_ids is None:
+        return
+    attributes = {key: value for key, value in data.items() if key != "entity_id"}
+    for entity_id in [entity_ids] if isinstance(entity_ids, str) else entity_ids:
+        current = AD.state.state.get(namespace, {}).get(entity_id)
+        current_state = None if current is None else current["state"]
+        match service:
+            case "turn_on":
+                AD.set_state(entity_id, "on", attributes, namespace)
+            case "turn_off":
+                AD.set_state(entity_id, "off", None, namespace)
+            case "toggle":
+                AD.set_state(
+                    entity_id, "off" if current_state == "on" else "on", None, namespace
+                )
+            case "set_value":
+                AD.set_state(entity_id, data["value"], None, namespace)
+            case "select_option":
+                AD.set_state(entity_id, data["option"], None, namespace)
+            case "set_temperature":
+                AD.set_state(
+                    entity_id,
+                    attributes.pop("hvac_mode", current_state),
+                    attributes,
+                    namespace,
+                )
+            case "set_hvac_mode":
+                AD.set_state(entity_id, data["hvac_mode"], None, namespace)
+            case "press":
+                AD.set_state(
+                    entity_id,
+                    dt.datetime.fromtimestamp(AD.now, dt.timezone.utc).isoformat(),
+                    None,
+                    namespace,
+                )
+            case _:
+                pass
+
+
+def simulate(scenario: Scenario) -> SimulationResult:
+    "Runs an app through a scenario, in virtual time"
+    wall_started_at = time.perf_counter()
+    start_ts = scenario.start.timestamp()
+    with StandInAppDaemon(start_ts) as AD:
+        for entity_id, initial in scenario.initial_states.items():
+            state, attributes = (
+                cast(tuple[Any, dict[str, Any] | None], initial)
+                if isinstance(initial, tuple)
+                else (initial, None)
+            )
+            AD.set_state(entity_id, state, attributes)
+        calls: list[tuple[dt.datetime, str, str, dict[str, Any]]] = []
+
+        def on_call(
+            domain: str, service: str, data: dict[str, Any], namespace: str
+        ) -> None:
+            calls.append(
+                (
+                    dt.datetime.fromtimestamp(AD.now, scenario.start.tzinfo),
+                    domain,
+                    service,
+                    data,
+                )
+            )
+            if scenario.service_effects:
+                apply_service_effect(AD, domain, service, data, namespace)
+
+        AD.services.on_call = on_call
+        app: Any = stand_in(scenario.app_class, AD, scenario.name, args=scenario.args)
+        AD.run(app, app.initialize)
+        for change in sorted(scenario.timeline, key=lambda change: change.at_s):
+            AD.advance_to(start_ts + change.at_s)
+            AD.set_state(change.entity_id, change.state, change.attributes)
+        AD.advance_to(start_ts + scenario.duration.total_seconds())
+        return SimulationResult(
+            calls=calls,
+            final_states={
+                entity_id: entity_state["state"]
+                for entity_id, entity_state in AD.state.state.get(
+                    app.namespace, {}
+                ).items()
+            },
+            errors=AD.errors,
+            wall_s=time.perf_counter() - wall_started_at,
+        )
+
+
+def simulate_many(
+    scenarios: list[Scenario], processes: int | None = None
+) -> list[SimulationResult]:
+    """
+    Runs several scenarios (e.g. one per simulated week) in parallel, one process per CPU unless `processes` says
+    otherwise. Results are in the same order as the scenarios.
+    """
+    if processes == 1 or len(scenarios) <= 1:
+        return [simulate(scenario) for scenario in scenarios]
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(simulate, scenarios))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replays the traffic recorded by HaptSharedState.enable_recording through an app"
+    )
+    parser.add_argument(
+        "app", help="module:Class of the app, e.g. thermostat:ThermostatControl"
+    )
+    parser.add_argument("log", help="path of the recording")
+    parser.add_argument("--name", default="app", help="name of the app")
+    parser.add_argument("--args", default="{}", help="app arguments, as JSON")
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=60.0,
+        help="seconds of timers to run after the last record",
+    )
+    parsed = parser.parse_args()
+    module_name, class_name = parsed.app.split(":", 1)
+    sys.path.insert(0, ".")
+    app_class = getattr(importlib.import_module(module_name), class_name)
+    report = replay(
+        app_class,
+        parsed.log,
+        name=parsed.name,
+        args=json.loads(parsed.args),
+        settle_s=parsed.settle,
+    )
+    print(report.summary())
+    sys.exit(0 if report.calls_match and not report.errors else 1)
+
+
+if __name__ == "__main__":
+    main()
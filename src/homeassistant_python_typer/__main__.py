@@ -92,8 +92,14 @@ def main():
         domain_name_in_title_case = domain_name.title()
         if domains_classes_body != "":
             domains_classes_body += "\n"
+        # Entities are stored in slots as they get used (see `hapth.Domain`)
+        entities_slots = "".join(
+            f'"{sanitize_ident(entity.name)}", ' for entity in domain.entities
+        )
         domains_classes_body += f"""
         class {domain_name_in_title_case}Domain(hapth.Domain):
+            __slots__ = ({entities_slots})
+
             def __init__(self, hapt: hapth.HaptSharedState):
                 super().__init__(hapt, "{domain_name}")\n\n""".lstrip(
             "\n"
@@ -145,6 +151,14 @@ def main():
 
     # Finally register all domains in a final HomeAssistant object
     class HomeAssistant:
+        \"""
+        Typed access to the entities and services of Home Assistant, for the app `ad`.
+
+        Creating it wraps the `terminate` method of the app (which still runs first), so that HAPT cleans up what it
+        holds for the app (subscriptions, timers, recording...) when AppDaemon terminates it. An app that replaces its
+        `terminate` method afterwards should call `self.hapt.terminate()` from it.
+        \"""
+
         def __init__(self, ad: ADBase):
             hapt = hapth.HaptSharedState(ad)
             self.hapt = hapt
@@ -31,6 +31,8 @@ def infer_attributes_superclasses(
                 \"""
                 Superclass that adds getter for attribute, with return type information and documentation specific to this entity.
                 \"""
+                __slots__ = ()
+
                 def {sanitize_ident(attribute_key)}(
                     self,
                 ) -> {return_type}:
@@ -40,7 +42,15 @@ def infer_attributes_superclasses(
                     Returns:
                         The `{attribute_key}` attribute of the entity.{doc}
                     \"""
-                    return super().get_state_repeatable_read({repr(attribute_key)})"""
+                    return super().get_state_repeatable_read({repr(attribute_key)})
+
+                async def {sanitize_ident(attribute_key)}_async(
+                    self,
+                ) -> {return_type}:
+                    \"""
+                    Async counterpart of `{sanitize_ident(attribute_key)}`, to be awaited from async apps.
+                    \"""
+                    return await super().get_state_repeatable_read_async({repr(attribute_key)})"""
             if superclass_body in builder.classes_per_body:
                 extra_superclasses.append(
                     builder.classes_per_body[superclass_body].name
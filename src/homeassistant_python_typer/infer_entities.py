@@ -64,7 +64,7 @@ def infer_entities(
                 \"""
                 `{entity_id}`{f": {entity_friendly_name}" if entity_friendly_name else ""}
                 \"""
-                pass""".lstrip(
+                __slots__ = ()""".lstrip(
                 "\n"
             ),
             1,
@@ -26,12 +26,11 @@ def service_function_body(
     function_name = (
         service.name
         if not service.name in field_names_on_same_class
+        and not f"{service.name}_async" in field_names_on_same_class
         else f"call_{service.name}"
     )
 
-    service_function_body = f"""
-                def {function_name}(
-                    self,"""
+    service_parameters = ""
     service_data_dict = ""
     parameters_doc = ""
     for field_name, field_data in fields.items():
@@ -81,9 +80,9 @@ def service_function_body(
 
         if service_data_dict == "":
             # First field, prevent non-keyword arguments
-            service_function_body += f"""
+            service_parameters += f"""
                     *,"""
-        service_function_body += f"""
+        service_parameters += f"""
                     {sanitized_field_name}: {field_type_and_default},"""
         service_data_dict += f"""
                             "{field_name}": {field_value_construction},"""
@@ -94,25 +93,114 @@ def service_function_body(
             parameters_doc += f"""
                         {field_data.get("description", field_data.get("name", ""))}"""
         parameters_doc += "\n"
-    if parameters_doc.endswith("\n"):
-        parameters_doc = parameters_doc[:-1]
+    # Services that always return a response (e.g. forecasts) return it, cached for a while so that polling them is
+    # cheap. Those whose response is optional (scripts, shell commands...) are called as usual, and get an uncached
+    # `_with_response` variant since calling them typically has side effects.
+    response = service.data.get("response")
+    response_is_optional = isinstance(response, dict) and response.get("optional", True)
+    returns_response = "response" in service.data and not response_is_optional
+    response_parameters = service_parameters
+    response_parameters_doc = parameters_doc
+    if returns_response:
+        if service_data_dict == "":
+            response_parameters += f"""
+                    *,"""
+        response_parameters += f"""
+                    ttl_s: float | None = None,"""
+        response_parameters_doc += f"""
+                    `ttl_s` (`float | None = None`, optional)
+                        How long the response may be reused by identical calls, in seconds (see
+                        `hapth.HaptSharedState.call_with_response`)
+"""
     if service_data_dict != "":
         service_data_dict += """
                         """
-    service_function_body += f"""
-                ) -> None:
+    receiver = "._hapt" if entity_attributes_if_entity is None else ""
+    description = service.data.get("description", service.data.get("name", ""))
+
+    def function_pair(
+        name: str,
+        parameters: str,
+        parameters_doc: str,
+        return_type: str,
+        returns_doc: str,
+        call_method: str,
+        call_extra_arguments: str,
+    ) -> str:
+        if parameters_doc.endswith("\n"):
+            parameters_doc = parameters_doc[:-1]
+        call, call_async = (
+            ("self", "await self")
+            if return_type == "None"
+            else ("return self", "return await self")
+        )
+        return f"""
+                def {name}(
+                    self,{parameters}
+                ) -> {return_type}:
                     \"""
-                    {service.data.get("description", service.data.get("name", ""))}
+                    {description}
 
                     Parameters
-                    ----------{parameters_doc}
+                    ----------{parameters_doc}{returns_doc}
                     \"""
-                    self{"._hapt" if entity_attributes_if_entity is None else ""}.call(
+                    {call}{receiver}.{call_method}(
                         "{service.domain}",
                         "{service.name}",
-                        {{{service_data_dict}}},
+                        {{{service_data_dict}}},{call_extra_arguments}
+                    )
+
+                async def {name}_async(
+                    self,{parameters}
+                ) -> {return_type}:
+                    \"""
+                    Async counterpart of `{name}`, to be awaited from async apps.
+
+                    {description}
+
+                    Parameters
+                    ----------{parameters_doc}{returns_doc}
+                    \"""
+                    {call_async}{receiver}.{call_method}_async(
+                        "{service.domain}",
+                        "{service.name}",
+                        {{{service_data_dict}}},{call_extra_arguments}
                     )"""
 
+    if returns_response:
+        service_function_body = function_pair(
+            function_name,
+            response_parameters,
+            response_parameters_doc,
+            "dict[str, Any]",
+            """
+
+                    Returns
+                    -------
+                    The response of the service. It may be shared with other callers, so it must not be modified.""",
+            "call_with_response",
+            "\n                        ttl_s=ttl_s,",
+        )
+    else:
+        service_function_body = function_pair(
+            function_name, service_parameters, parameters_doc, "None", "", "call", ""
+        )
+    if response_is_optional:
+        service_function_body += "\n" + function_pair(
+            f"{function_name}_with_response",
+            service_parameters,
+            parameters_doc,
+            "dict[str, Any] | None",
+            """
+
+                    Returns
+                    -------
+                    The response of the service, if it returned one. Every call is sent to Home Assistant: responses
+                    are not cached, since calling the service may have side effects.""",
+            "call_with_response",
+            "\n                        cached=False,",
+        )
+
     return service_function_body
 
 
@@ -136,11 +224,10 @@ def infer_services_superclasses(
             extra_superclasses.append(builder.classes_per_body[superclass_body].name)
         else:
             superclass_name = f"service__{service.domain}__{service.name}__{len(builder.classes_per_body)}"
-            superclass_full_body = (
-                f"""
-            class {superclass_name}(hapth.Entity):"""
-                + superclass_body
-            )
+            superclass_full_body = f"""
+            class {superclass_name}(hapth.Entity):
+                __slots__ = ()
+""" + superclass_body
             builder.classes_per_body[superclass_body] = EntitySuperclass(
                 name=superclass_name, body=superclass_full_body
             )
@@ -16,6 +16,8 @@ def infer_state_superclass(
                 \"""
                 Superclass for entity state that holds return type information and documentation specific to this entity.
                 \"""
+                __slots__ = ()
+
                 def state(
                     self,
                 ) -> {return_type}:
@@ -25,7 +27,96 @@ def infer_state_superclass(
                     Returns:
                         The state of the entity.{doc}
                     \"""
-                    return {'' if cast is None else f'{cast}('}super().get_state_repeatable_read(){'' if cast is None else ')'}"""
+                    return {'super().get_state_repeatable_read()' if cast is None else f'super().get_state_repeatable_read_converted({cast})'}
+
+                async def state_async(
+                    self,
+                ) -> {return_type}:
+                    \"""
+                    Async counterpart of `state`, to be awaited from async apps.
+                    \"""
+                    return await {'super().get_state_repeatable_read_async()' if cast is None else f'super().get_state_repeatable_read_converted_async({cast})'}"""
+        if cast == "hapth.int_or_float":
+            builder.imports.add("import datetime")
+            builder.imports.add("from typing import Callable")
+            superclass_body += f"""
+
+                def history(
+                    self,
+                    start: datetime.datetime,
+                    end: datetime.datetime,
+                    every_s: float | None = None,
+                ) -> hapth.NumericHistory:
+                    \"""
+                    Numeric states of the entity between `start` and `end` (timezone-aware), from Home Assistant's
+                    history, as a compact time series (see `hapth.NumericHistory`).
+
+                    Args:
+                        every_s (float, optional): If given, the values are averaged over time buckets of that many
+                            seconds
+                    \"""
+                    return super().numeric_history(start, end, every_s)
+
+                async def history_async(
+                    self,
+                    start: datetime.datetime,
+                    end: datetime.datetime,
+                    every_s: float | None = None,
+                ) -> hapth.NumericHistory:
+                    \"""
+                    Async counterpart of `history`, to be awaited from async apps.
+                    \"""
+                    return await super().numeric_history_async(start, end, every_s)
+
+                def rolling(
+                    self,
+                    window_s: float,
+                    warm_start: bool = False,
+                ) -> hapth.RollingWindow:
+                    \"""
+                    Starts keeping the mean, min, max and sum of the states of the entity over the last `window_s`
+                    seconds up to date in memory (see `hapth.RollingWindow`), e.g. in `initialize`. Its `cancel` method
+                    stops it.
+
+                    Args:
+                        warm_start (bool, optional): Whether to fill the window from Home Assistant's history first
+                    \"""
+                    return super().rolling_window(window_s, warm_start=warm_start)
+
+                async def rolling_async(
+                    self,
+                    window_s: float,
+                    warm_start: bool = False,
+                ) -> hapth.RollingWindow:
+                    \"""
+                    Async counterpart of `rolling`, to be awaited from async apps.
+                    \"""
+                    return await super().rolling_window_async(window_s, warm_start=warm_start)
+
+                def listen_threshold(
+                    self,
+                    callback: Callable[..., Any],
+                    above: float | None = None,
+                    below: float | None = None,
+                    hysteresis: float = 0.0,
+                    min_duration_s: float | None = None,
+                    *args: Any,
+                    **kwargs: Any,
+                ) -> str:
+                    \"""
+                    Listen to the state of the entity going above `above` and/or below `below`: unlike
+                    `listen_state`, the callback doesn't run on every reported value, only when the thresholds are
+                    crossed (see `hapth.Entity.listen_numeric_threshold`).
+
+                    Args:
+                        hysteresis (float, optional): How far back past the thresholds the state has to go before the
+                            callback may run again
+                        min_duration_s (float, optional): How long the state has to stay past the thresholds before the
+                            callback runs
+                    \"""
+                    return super().listen_numeric_threshold(
+                        callback, above, below, hysteresis, min_duration_s, *args, **kwargs
+                    )"""
         if superclass_body in builder.classes_per_body:
             extra_superclasses.append(builder.classes_per_body[superclass_body].name)
         else:
@@ -0,0 +1,104 @@
+"""
+Tests run apps against the stand-in AppDaemon of `homeassistant_python_typer_testing`, with a `HomeAssistant` class
+generated from the states and services in `entities.json` and `services.json` (as dumped by
+`homeassistant_python_typer -d`).
+"""
+
+import importlib
+import json
+import os
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Iterator
+
+import appdaemon.plugins.hass.hassapi as hass
+import pytest
+
+import homeassistant_python_typer.__main__ as generator
+import homeassistant_python_typer_helpers as hapth
+import homeassistant_python_typer_testing as hapt_testing
+
+FIXTURES = Path(__file__).parent
+START = 1_700_000_000.0
+"Virtual time at which the stand-in AppDaemon starts"
+
+
+def load_fixture(name: str) -> Any:
+    with open(FIXTURES / name) as fixture:
+        return json.load(fixture)
+
+
+class FixtureClient:
+    "Serves the fixtures instead of querying Home Assistant"
+
+    def __init__(self, url: str, token: str):
+        pass
+
+    def get(self, path: str) -> Any:
+        return load_fixture("entities.json" if path == "states" else "services.json")
+
+
+@pytest.fixture(scope="session")
+def hapt(tmp_path_factory: pytest.TempPathFactory) -> ModuleType:
+    "The generated module"
+    output_dir = tmp_path_factory.mktemp("generated")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(generator, "HomeAssistantClient", FixtureClient)
+        patch.setitem(os.environ, "HOMEASSISTANT_URL", "http://homeassistant.local")
+        patch.setitem(os.environ, "HOMEASSISTANT_TOKEN", "token")
+        patch.setattr(
+            sys, "argv", ["homeassistant_python_typer", str(output_dir / "hapt.py")]
+        )
+        patch.syspath_prepend(str(output_dir))
+        generator.main()
+        return importlib.import_module("hapt")
+
+
+@pytest.fixture
+def AD() -> Iterator[hapt_testing.StandInAppDaemon]:
+    "A stand-in AppDaemon whose state store holds the states of `entities.json`"
+    with hapt_testing.StandInAppDaemon(START) as AD:
+        for entity in load_fixture("entities.json"):
+            AD.set_state(
+                entity["entity_id"],
+                entity["state"],
+                entity["attributes"],
+                run_callbacks=False,
+            )
+        yield AD
+
+
+@pytest.fixture
+def App(hapt: ModuleType) -> type[hass.Hass]:
+    class App(hass.Hass):
+        def initialize(self):
+            self.ha = hapt.HomeAssistant(self)
+
+    return App
+
+
+@pytest.fixture
+def new_app(
+    AD: hapt_testing.StandInAppDaemon, App: type[hass.Hass]
+) -> Callable[[str], Any]:
+    "Creates and initializes an app that only creates its `HomeAssistant`"
+
+    def new_app(name: str) -> Any:
+        app: Any = hapt_testing.stand_in(App, AD, name=name)
+        AD.run(app, app.initialize)
+        return app
+
+    return new_app
+
+
+@pytest.fixture
+def app(new_app: Callable[[str], Any]) -> Any:
+    return new_app("app")
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache() -> Iterator[None]:
+    "The response cache is shared by all the apps of the process, so tests must not see each other's responses"
+    yield
+    hapth.RESPONSE_CACHE.entries.clear()
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_async_reads_are_repeatable_within_a_callback(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    seen: list[Any] = []
+
+    async def read_twice() -> None:
+        seen.append(await ha.sensor.power.state_async())
+        AD.set_state("sensor.power", "99", run_callbacks=False)
+        seen.append(await ha.sensor.power.state_async())
+        seen.append(await ha.light.hallway_lamp.is_on_async())
+        seen.append(
+            await ha.sensor.temp.get_state_repeatable_read_async("unit_of_measurement")
+        )
+
+    async def run() -> None:
+        await ha.hapt.run_callback_async({}, read_twice)
+
+    AD.run(app, run)
+
+    assert seen == [12.5, 12.5, False, "°C"]
+    assert AD.run(app, ha.sensor.power.state_async) == 99
+    assert not AD.errors
+
+
+def test_async_prefetch_fills_the_caches(app: Any, AD: StandInAppDaemon):
+    hapt = app.ha.hapt
+
+    async def read_all() -> list[Any]:
+        await hapt.prefetch_async(
+            {"sensor.power": ("default", False), "sensor.temp": ("default", True)}
+        )
+        AD.set_state("sensor.power", "99", run_callbacks=False)
+        return [
+            await app.ha.sensor.power.state_async(),
+            await app.ha.sensor.temp.state_async(),
+        ]
+
+    async def run() -> list[Any]:
+        return await hapt.run_callback_async({}, read_all)
+
+    assert AD.run(app, run) == [12.5, 20]
+    assert not AD.errors
+
+
+def test_async_calls_can_be_gathered(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+
+    async def both() -> None:
+        await asyncio.gather(
+            ha.light.hallway_lamp.turn_on_async(brightness=10),
+            ha.light.kitchen_lamp.turn_off_async(),
+        )
+
+    AD.run(app, both)
+
+    assert sorted((domain, service) for domain, service, _, _ in AD.services.calls) == [
+        ("light", "turn_off"),
+        ("light", "turn_on"),
+    ]
+    assert not AD.errors
@@ -0,0 +1,59 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_calls_of_a_callback_are_coalesced(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.coalesce_calls = True
+
+    def on_motion() -> None:
+        ha.light.hallway_lamp.turn_on(brightness=200)
+        ha.light.kitchen_lamp.turn_on(brightness=200)
+        ha.climate.livingroom.set_temperature(temperature=21)
+        ha.light.hallway_lamp.turn_off()
+
+    AD.run(app, lambda: ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    AD.set_state("binary_sensor.hallway_motion", "on")
+
+    assert AD.services.calls == [
+        (
+            "light",
+            "turn_on",
+            {
+                "brightness": 200,
+                "entity_id": ["light.hallway_lamp", "light.kitchen_lamp"],
+            },
+            "default",
+        ),
+        (
+            "climate",
+            "set_temperature",
+            {"temperature": 21, "entity_id": "climate.livingroom"},
+            "default",
+        ),
+        # Still after the call it would otherwise overtake
+        ("light", "turn_off", {"entity_id": "light.hallway_lamp"}, "default"),
+    ]
+
+
+def test_async_calls_are_coalesced_within_the_block(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+
+    async def both() -> None:
+        async with ha.hapt.coalescing_calls_async():
+            await ha.light.hallway_lamp.turn_off_async()
+            await ha.light.kitchen_lamp.turn_off_async()
+            assert AD.services.calls == []
+
+    AD.run(app, both)
+
+    assert AD.services.calls == [
+        (
+            "light",
+            "turn_off",
+            {"entity_id": ["light.hallway_lamp", "light.kitchen_lamp"]},
+            "default",
+        )
+    ]
+    assert not AD.errors
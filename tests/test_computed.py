@@ -0,0 +1,81 @@
+from typing import Any
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_computed_values_follow_their_dependencies(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    changes: list[tuple[bool, str]] = []
+
+    def busy() -> bool:
+        # Power only matters while there is motion
+        if ha.binary_sensor.hallway_motion.state() == "on":
+            return ha.sensor.power.state() > 100
+        return False
+
+    def on_change(value: bool, tag: str) -> None:
+        changes.append((value, tag))
+
+    computed = AD.run(app, lambda: ha.hapt.computed(busy))
+    computed.listen(on_change, "tag")
+    assert computed() is False
+    assert set(computed.dependencies) == {"binary_sensor.hallway_motion"}
+
+    AD.set_state("sensor.power", "200")
+    assert computed.evaluations == 1
+
+    AD.set_state("binary_sensor.hallway_motion", "on")
+    assert set(computed.dependencies) == {
+        "binary_sensor.hallway_motion",
+        "sensor.power",
+    }
+    assert changes == [(True, "tag")]
+
+    AD.set_state("sensor.power", "150")
+    AD.set_state("sensor.temp", "25")
+    assert changes == [(True, "tag")]
+    assert computed.evaluations == 3
+
+    AD.set_state("binary_sensor.hallway_motion", "off")
+    assert changes == [(True, "tag"), (False, "tag")]
+    assert ha.hapt.subscriptions.per_entity() == {"binary_sensor.hallway_motion": 1}
+
+    computed.cancel()
+    assert len(ha.hapt.subscriptions) == 0
+    assert not AD.errors
+
+
+def test_computed_values_notify_async_callbacks(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    changes: list[Any] = []
+
+    async def on_change(value: Any) -> None:
+        changes.append(value)
+
+    computed = AD.run(app, lambda: ha.hapt.computed(ha.sensor.power.state))
+    computed.listen(on_change)
+    AD.set_state("sensor.power", "40")
+    AD.set_state("sensor.power", "40", {"friendly_name": "Power"})
+
+    assert changes == [40]
+    assert not AD.errors
+
+
+def test_nested_callbacks_restore_the_read_set_of_the_outer_one(
+    app: Any, AD: StandInAppDaemon
+):
+    hapt = app.ha.hapt
+    outer: hapth.ReadSet = {}
+    inner: hapth.ReadSet = {}
+
+    def on_change() -> None:
+        app.ha.sensor.power.state()
+        hapt.run_callback(inner, app.ha.binary_sensor.hallway_motion.state)
+        app.ha.sensor.temp.state()
+
+    AD.run(app, lambda: hapt.run_callback(outer, on_change))
+
+    assert set(outer) == {"sensor.power", "sensor.temp"}
+    assert set(inner) == {"binary_sensor.hallway_motion"}
+    assert hapt.read_set is None
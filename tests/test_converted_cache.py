@@ -0,0 +1,24 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_values_are_converted_once_per_callback(app: Any, AD: StandInAppDaemon):
+    power = app.ha.sensor.power
+    conversions: list[Any] = []
+    seen: list[float] = []
+
+    def to_float(value: Any) -> float:
+        conversions.append(value)
+        return float(value)
+
+    def read_thrice() -> None:
+        for _ in range(3):
+            seen.append(power.get_state_repeatable_read_converted(to_float))
+
+    AD.run(app, lambda: app.ha.hapt.run_callback({}, read_thrice))
+    AD.set_state("sensor.power", "40", run_callbacks=False)
+    AD.run(app, lambda: app.ha.hapt.run_callback({}, read_thrice))
+
+    assert conversions == ["12.5", "40"]
+    assert seen == [12.5] * 3 + [40.0] * 3
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any
+
+from homeassistant_python_typer_helpers import ServiceCall
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_queued_calls_keep_their_order_per_entity(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.fire_and_forget_calls = True
+    acknowledged: list[tuple[str, str]] = []
+
+    async def on_call(
+        domain: str, service: str, data: dict[str, Any], namespace: str
+    ) -> None:
+        # The hallway lamp is much slower to acknowledge than the kitchen one
+        await asyncio.sleep(0.05 if data["entity_id"] == "light.hallway_lamp" else 0)
+        acknowledged.append((data["entity_id"], service))
+
+    AD.services.on_call = on_call
+
+    def commands() -> None:
+        ha.light.hallway_lamp.turn_on()
+        ha.light.hallway_lamp.turn_off()
+        ha.light.kitchen_lamp.turn_on()
+
+    async def awaited() -> None:
+        await ha.light.hallway_lamp.toggle_async()
+
+    AD.run(app, commands)
+    AD.run(app, awaited)
+
+    assert acknowledged == [
+        ("light.kitchen_lamp", "turn_on"),
+        ("light.hallway_lamp", "turn_on"),
+        ("light.hallway_lamp", "turn_off"),
+        # Awaited calls don't overtake the queued ones
+        ("light.hallway_lamp", "toggle"),
+    ]
+    assert ha.hapt.call_queue.in_flight == 0
+    assert not AD.errors
+
+
+def test_failed_queued_calls_are_reported(app: Any, AD: StandInAppDaemon):
+    hapt = app.ha.hapt
+    hapt.fire_and_forget_calls = True
+    failures: list[tuple[str, str]] = []
+
+    def on_call_error(call: ServiceCall, error: Exception) -> None:
+        failures.append((call[1], str(error)))
+
+    hapt.on_call_error = on_call_error
+
+    def on_call(domain: str, service: str, data: dict[str, Any], namespace: str):
+        raise RuntimeError("unavailable")
+
+    AD.services.on_call = on_call
+    AD.run(app, app.ha.light.kitchen_lamp.turn_on)
+
+    assert failures == [("turn_on", "unavailable")]
+    assert hapt.call_queue.failed == 1
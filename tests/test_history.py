@@ -0,0 +1,59 @@
+import datetime as dt
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def record_power(AD: StandInAppDaemon, seconds: int) -> float:
+    "One change of `sensor.power` per second, after it was unavailable. Returns when it was unavailable."
+    start = AD.now
+    AD.set_state("sensor.power", "unavailable", run_callbacks=False)
+    for second in range(seconds):
+        AD.now = start + 1 + second
+        AD.set_state("sensor.power", str(second % 100), run_callbacks=False)
+    return start
+
+
+def test_history_is_fetched_page_by_page(app: Any, AD: StandInAppDaemon):
+    started_at = record_power(AD, 3 * 3600)
+    start = dt.datetime.fromtimestamp(started_at, dt.timezone.utc)
+    end = start + dt.timedelta(hours=3, seconds=10)
+
+    history = app.ha.sensor.power.numeric_history(
+        start, end, page=dt.timedelta(minutes=20)
+    )
+
+    timestamps = list(history.timestamps)
+    # The state each page starts with isn't counted twice, and `unavailable` is skipped
+    assert len(history) == 3 * 3600
+    assert timestamps == sorted(set(timestamps))
+    assert (history.values[0], history.values[-1]) == (0, (3 * 3600 - 1) % 100)
+    assert not AD.errors
+
+
+def test_history_can_be_averaged_over_buckets(app: Any, AD: StandInAppDaemon):
+    started_at = record_power(AD, 3 * 3600)
+    start = dt.datetime.fromtimestamp(started_at, dt.timezone.utc)
+    end = start + dt.timedelta(hours=3, seconds=10)
+
+    hourly = app.ha.sensor.power.numeric_history(start, end, every_s=3600)
+
+    assert len(hourly) == 4
+    assert list(hourly.timestamps)[1] == started_at // 3600 * 3600 + 3600
+    assert abs(hourly.values[1] - 49.5) < 1
+
+
+def test_history_can_be_awaited(app: Any, AD: StandInAppDaemon):
+    started_at = record_power(AD, 3600)
+    start = dt.datetime.fromtimestamp(started_at, dt.timezone.utc)
+
+    async def read() -> Any:
+        return await app.ha.sensor.power.numeric_history_async(
+            start, start + dt.timedelta(hours=1), page=dt.timedelta(minutes=10)
+        )
+
+    history = AD.run(app, read)
+
+    assert len(history) == 3600
+    assert list(history)[:2] == [(started_at + 1, 0), (started_at + 2, 1)]
+    assert not AD.errors
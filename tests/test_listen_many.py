@@ -0,0 +1,100 @@
+from typing import Any
+
+import pytest
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+@pytest.mark.parametrize("domain_wide", [False, True])
+def test_changes_are_dispatched_to_their_entity(
+    app: Any, AD: StandInAppDaemon, domain_wide: bool
+):
+    ha = app.ha
+    seen: list[tuple[str, Any, str]] = []
+
+    def on_change(entity: Any, label: str) -> None:
+        seen.append((entity.entity_id, entity.state(), label))
+
+    handles = AD.run(
+        app,
+        lambda: ha.hapt.listen_many(
+            [ha.light.hallway_lamp, ha.sensor.power, ha.sensor.temp],
+            on_change,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            domain_wide,
+            "changed",
+        ),
+    )
+    AD.set_state("sensor.power", "40")
+    # Not watched, although of a watched domain
+    AD.set_state("light.kitchen_lamp", "on")
+    AD.set_state("light.hallway_lamp", "on")
+    AD.set_state("sensor.temp", "21")
+
+    assert seen == [
+        ("sensor.power", 40, "changed"),
+        ("light.hallway_lamp", "on", "changed"),
+        ("sensor.temp", 21, "changed"),
+    ]
+    # One subscription per domain or per entity
+    assert len(handles) == (2 if domain_wide else 3)
+    assert not AD.errors
+
+
+def test_new_and_old_filter_each_entity(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    turned_on: list[str] = []
+
+    def on_turned_on(entity: Any) -> None:
+        turned_on.append(entity.entity_id)
+
+    AD.run(
+        app,
+        lambda: ha.hapt.listen_many(
+            [ha.light.hallway_lamp, ha.light.kitchen_lamp],
+            on_turned_on,
+            new="on",
+        ),
+    )
+    AD.set_state("light.kitchen_lamp", "on")
+    AD.set_state("light.kitchen_lamp", "off")
+    AD.set_state("light.hallway_lamp", "on")
+
+    assert turned_on == ["light.kitchen_lamp", "light.hallway_lamp"]
+
+
+def test_cancelling_all_the_subscriptions_forgets_the_listener(
+    app: Any, AD: StandInAppDaemon
+):
+    ha = app.ha
+    ha.hapt.keep_listeners = True
+    seen: list[str] = []
+
+    def on_change(entity: Any) -> None:
+        seen.append(entity.entity_id)
+
+    handles = AD.run(
+        app,
+        lambda: ha.hapt.listen_many(
+            [ha.light.hallway_lamp, ha.sensor.power],
+            on_change,
+        ),
+    )
+    listeners = len(ha.hapt.listeners)
+
+    AD.run(app, lambda: ha.hapt.subscriptions.cancel(handles[0]))
+    AD.set_state("light.hallway_lamp", "on")
+    AD.set_state("sensor.power", "40")
+    assert seen == ["sensor.power"]
+    assert len(ha.hapt.listeners) == listeners
+
+    AD.run(app, lambda: ha.hapt.subscriptions.cancel(handles[1]))
+    AD.set_state("sensor.power", "41")
+    assert seen == ["sensor.power"]
+    assert len(ha.hapt.listeners) == listeners - 1
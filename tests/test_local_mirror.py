@@ -0,0 +1,25 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_reads_come_from_the_state_store_without_hops(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.local_mirror = True
+    metrics = ha.hapt.enable_metrics()
+    seen: list[Any] = []
+
+    def on_motion() -> None:
+        seen.append(ha.sensor.power.state())
+        AD.set_state("sensor.power", "99", run_callbacks=False)
+        # Still repeatable within the callback
+        seen.append(ha.sensor.power.state())
+        seen.append(ha.sensor.temp.get_state_repeatable_read("unit_of_measurement"))
+
+    AD.run(app, lambda: ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    AD.set_state("binary_sensor.hallway_motion", "on")
+    AD.set_state("binary_sensor.hallway_motion", "off")
+
+    assert seen == [12.5, 12.5, "°C", 99, 99, "°C"]
+    assert metrics.counters.get("loop_hops", 0) == 0
+    assert not AD.errors
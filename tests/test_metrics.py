@@ -0,0 +1,31 @@
+from typing import Any
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_reads_calls_and_callbacks_are_counted(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    metrics = ha.hapt.enable_metrics()
+
+    def on_motion() -> None:
+        ha.sensor.power.get_state_repeatable_read()
+        ha.sensor.power.get_state_repeatable_read()
+        ha.light.hallway_lamp.turn_on()
+
+    AD.run(app, lambda: ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    AD.set_state("binary_sensor.hallway_motion", "on")
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["callbacks"] == 1
+    assert snapshot["counters"]["service_calls"] == 1
+    assert snapshot["entities"]["sensor.power"] == {
+        "cache_hits": 1,
+        "cache_misses": 1,
+        "loop_hops": 1,
+    }
+    assert snapshot["callback_duration"]["count"] == 1
+    assert list(snapshot["callbacks"]) == [
+        "test_reads_calls_and_callbacks_are_counted.<locals>.on_motion"
+    ]
+    assert hapth.metrics_per_app()["app"]["counters"] == snapshot["counters"]
@@ -0,0 +1,58 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_redundant_calls_are_suppressed_while_pending(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.suppress_redundant_calls = True
+    lamp = ha.light.kitchen_lamp
+    seen: list[tuple[Any, bool, bool]] = []
+
+    def on_motion() -> None:
+        pending = lamp.pending_command()
+        seen.append(
+            (
+                pending and (pending.service, pending.data),
+                lamp.is_on(),
+                lamp.is_effectively_on(),
+            )
+        )
+        lamp.turn_on(brightness=100)
+
+    AD.run(app, lambda: ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    AD.set_state("binary_sensor.hallway_motion", "on")
+    AD.set_state("binary_sensor.hallway_motion", "off")
+    AD.set_state("light.kitchen_lamp", "on", {"brightness": 100})
+    AD.set_state("binary_sensor.hallway_motion", "on")
+    AD.set_state("light.kitchen_lamp", "on", {"brightness": 50})
+    AD.set_state("binary_sensor.hallway_motion", "off")
+
+    assert seen == [
+        (None, False, False),
+        (("turn_on", {"brightness": 100}), False, True),
+        (None, True, True),
+        (None, True, True),
+    ]
+    assert len(AD.services.calls) == 2
+    assert ha.hapt.suppressed_calls == 2
+
+
+def test_pending_commands_time_out(app: Any, AD: StandInAppDaemon):
+    app.ha.hapt.track_pending_commands = True
+    lamp = app.ha.light.kitchen_lamp
+    AD.run(app, lambda: lamp.turn_on(brightness=100))
+    assert AD.run(app, lamp.pending_command) is not None
+
+    AD.advance(app.ha.hapt.pending_command_timeout_s + 1)
+
+    assert AD.run(app, lamp.pending_command) is None
+
+
+def test_pending_commands_are_not_tracked_by_default(app: Any, AD: StandInAppDaemon):
+    lamp = app.ha.light.kitchen_lamp
+    AD.run(app, lambda: lamp.turn_on(brightness=100))
+
+    assert AD.run(app, lamp.pending_command) is None
+    assert AD.run(app, lamp.is_effectively_on) is False
+    assert app.ha.hapt.pending_commands == {}
@@ -0,0 +1,49 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_callbacks_prefetch_what_they_read_last_time(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    metrics = ha.hapt.enable_metrics()
+    seen: list[tuple[Any, ...]] = []
+
+    def on_motion() -> None:
+        seen.append(
+            (
+                ha.sensor.power.state(),
+                ha.sensor.temp.state(),
+                ha.light.hallway_lamp.is_on(),
+            )
+        )
+
+    AD.run(app, lambda: ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    hops: list[int] = []
+    for motion in ["on", "off", "on"]:
+        before = metrics.counters.get("loop_hops", 0)
+        AD.set_state("binary_sensor.hallway_motion", motion)
+        hops.append(metrics.counters["loop_hops"] - before)
+
+    # One hop per entity the first time, then a single one for all of them
+    assert hops == [3, 1, 1]
+    assert seen == [(12.5, 20, False)] * 3
+
+
+def test_prefetch_skips_what_is_already_cached(app: Any, AD: StandInAppDaemon):
+    hapt = app.ha.hapt
+    metrics = hapt.enable_metrics()
+
+    def read_twice() -> None:
+        hapt.prefetch(
+            {"sensor.power": ("default", False), "sensor.temp": ("default", True)}
+        )
+        hapt.prefetch({"sensor.power": ("default", False)})
+        assert app.ha.sensor.power.state() == 12.5
+        assert (
+            app.ha.sensor.temp.get_state_repeatable_read("unit_of_measurement") == "°C"
+        )
+
+    AD.run(app, lambda: hapt.run_callback({}, read_twice))
+
+    assert metrics.counters["loop_hops"] == 1
+    assert not AD.errors
@@ -0,0 +1,70 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def sent(AD: StandInAppDaemon) -> list[tuple[str, Any]]:
+    return [
+        (service, data.get("brightness")) for _, service, data, _ in AD.services.calls
+    ]
+
+
+def test_only_the_last_call_of_a_window_is_sent(app: Any, AD: StandInAppDaemon):
+    hapt, lamp = app.ha.hapt, app.ha.light.hallway_lamp
+    hapt.set_rate_limit(1, domain="light", service="turn_on")
+
+    def dim() -> None:
+        for brightness in range(5):
+            lamp.turn_on(brightness=brightness)
+
+    AD.run(app, dim)
+    assert sent(AD) == [("turn_on", 0)]
+
+    AD.advance(1)
+    assert sent(AD) == [("turn_on", 0), ("turn_on", 4)]
+    assert hapt.rate_limit_stats() == {
+        "sent": 1,
+        "delayed": 1,
+        "superseded": 3,
+        "pending": 0,
+    }
+
+    # Other entities and services are not limited
+    AD.run(app, lambda: app.ha.light.kitchen_lamp.turn_on(brightness=1))
+    AD.run(app, lamp.toggle)
+    assert sent(AD)[2:] == [("turn_on", 1), ("toggle", None)]
+
+
+def test_calls_to_other_services_do_not_overtake_deferred_ones(
+    app: Any, AD: StandInAppDaemon
+):
+    lamp = app.ha.light.hallway_lamp
+    app.ha.hapt.set_rate_limit(1, entity=lamp, domain="light", service="turn_on")
+
+    def dim_then_turn_off() -> None:
+        lamp.turn_on(brightness=10)
+        lamp.turn_on(brightness=20)
+        lamp.turn_off()
+
+    AD.run(app, dim_then_turn_off)
+    AD.advance(1)
+
+    assert sent(AD) == [("turn_on", 10), ("turn_on", 20), ("turn_off", None)]
+
+
+def test_async_calls_to_other_services_do_not_overtake_deferred_ones(
+    app: Any, AD: StandInAppDaemon
+):
+    lamp = app.ha.light.hallway_lamp
+    app.ha.hapt.set_rate_limit(1, entity=lamp, domain="light", service="turn_on")
+
+    async def dim_then_turn_off() -> None:
+        await lamp.turn_on_async(brightness=10)
+        await lamp.turn_on_async(brightness=20)
+        await lamp.turn_off_async()
+
+    AD.run(app, dim_then_turn_off)
+    AD.advance(1)
+
+    assert sent(AD) == [("turn_on", 10), ("turn_on", 20), ("turn_off", None)]
+    assert not AD.errors
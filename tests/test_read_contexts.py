@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_reads_are_repeatable_within_a_callback(app: Any, AD: StandInAppDaemon):
+    power = app.ha.sensor.power
+    seen: list[Any] = []
+
+    def on_motion() -> None:
+        seen.append(power.state())
+        AD.set_state("sensor.power", "99", run_callbacks=False)
+        seen.append(power.state())
+
+    AD.run(app, lambda: app.ha.binary_sensor.hallway_motion.listen_state(on_motion))
+    AD.set_state("binary_sensor.hallway_motion", "on")
+    AD.set_state("binary_sensor.hallway_motion", "off")
+
+    assert seen == [12.5, 12.5, 99, 99]
+
+
+def test_concurrent_callbacks_have_their_own_caches(app: Any, AD: StandInAppDaemon):
+    hapt, power = app.ha.hapt, app.ha.sensor.power
+    inconsistent: list[int] = []
+
+    def set_power(value: str) -> None:
+        entities = AD.state.state["default"]
+        entities["sensor.power"] = {**entities["sensor.power"], "state": value}
+        # AppDaemon starting another callback of the app
+        app.stand_in_callback_counter += 1
+
+    def read_twice(i: int) -> None:
+        first = power.state()
+        for _ in range(20):
+            time.sleep(0.001)
+            if power.state() != first:
+                inconsistent.append(i)
+
+    def worker(i: int) -> None:
+        app.stand_in_callback_counter += 1
+        hapt.run_callback({}, read_twice, i)
+
+    def writer() -> None:
+        for value in range(20, 60):
+            set_power(str(value))
+            time.sleep(0.0005)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    async def read_twice_async(i: int) -> None:
+        first = await power.state_async()
+        await asyncio.sleep(0.01)
+        if await power.state_async() != first:
+            inconsistent.append(i)
+
+    async def interleaved() -> None:
+        async def one(i: int) -> None:
+            app.stand_in_callback_counter += 1
+            await hapt.run_callback_async({}, read_twice_async, i)
+
+        async def change() -> None:
+            for value in range(3):
+                await asyncio.sleep(0.003)
+                set_power(str(100 + value))
+
+        await asyncio.gather(one(100), change(), one(101))
+
+    AD.run(app, interleaved)
+
+    assert inconsistent == []
+    assert not AD.errors
+
+
+def test_callback_contexts_are_restored_when_they_end(app: Any, AD: StandInAppDaemon):
+    hapt = app.ha.hapt
+
+    def nested() -> list[Any]:
+        outside = hapt.read_context
+        with hapt.callback_context() as outer:
+            with hapt.callback_context() as inner:
+                assert hapt.read_context is inner
+            assert inner is not outer
+            assert hapt.read_context is outer
+        return [outside, hapt.read_context]
+
+    outside, after = AD.run(app, nested)
+
+    assert after is outside
+    assert not AD.errors
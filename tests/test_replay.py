@@ -0,0 +1,81 @@
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import appdaemon.plugins.hass.hassapi as hass
+import pytest
+
+import homeassistant_python_typer_testing as hapt_testing
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+@pytest.fixture
+def PowerApp(hapt: ModuleType) -> type[hass.Hass]:
+    class PowerApp(hass.Hass):
+        "Turns the hallway lamp on while the power is above a threshold, for at least 30s"
+
+        threshold = 100
+        timer: str | None = None
+
+        def initialize(self):
+            self.ha = hapt.HomeAssistant(self)
+            if self.args.get("record"):
+                self.ha.hapt.enable_recording(self.args["record"])
+            self.ha.sensor.power.listen_state(self.on_power)
+
+        def on_power(self) -> None:
+            if self.ha.sensor.power.state() > self.threshold:
+                self.ha.light.hallway_lamp.turn_on()
+                if self.timer is not None:
+                    self.cancel_timer(self.timer)
+                self.timer = self.run_in(self.turn_lamp_off, 30)
+
+        def turn_lamp_off(self, kwargs: dict[str, Any]) -> None:
+            self.ha.light.hallway_lamp.turn_off()
+
+    return PowerApp
+
+
+@pytest.fixture
+def recording(AD: StandInAppDaemon, PowerApp: type[hass.Hass], tmp_path: Path) -> str:
+    "Records the app while the power goes up and down"
+    log_path = str(tmp_path / "recording.jsonl")
+    app: Any = hapt_testing.stand_in(PowerApp, AD, args={"record": log_path})
+    AD.run(app, app.initialize)
+    for power in [50, 120, 130, 200, 20, 160, 10]:
+        AD.advance(20)
+        AD.set_state("sensor.power", str(power))
+    AD.advance(100)
+    app.ha.hapt.recorder.close()
+    assert [service for _, service, _, _ in AD.services.calls] == [
+        "turn_on",
+        "turn_on",
+        "turn_on",
+        "turn_off",
+        "turn_on",
+        "turn_off",
+    ]
+    return log_path
+
+
+def test_replaying_the_same_app_makes_the_same_calls(
+    PowerApp: type[hass.Hass], recording: str
+):
+    report = hapt_testing.replay(PowerApp, recording)
+
+    assert report.events == 7
+    assert report.calls_match
+    assert not report.errors
+    assert "identical" in report.summary()
+
+
+def test_replaying_a_changed_app_tells_the_calls_apart(
+    PowerApp: type[hass.Hass], recording: str
+):
+    class HigherThreshold(PowerApp):
+        threshold = 150
+
+    report = hapt_testing.replay(HigherThreshold, recording)
+
+    assert not report.calls_match
+    assert "DIFFERENT" in report.summary()
@@ -0,0 +1,116 @@
+import asyncio
+from functools import partial
+from typing import Any, Callable
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def forecast_response(data: dict[str, Any], n: int) -> dict[str, Any]:
+    "What Home Assistant's websocket API returns for `weather.get_forecasts`, with `n` as the forecast"
+    return {
+        "id": n,
+        "type": "result",
+        "success": True,
+        "result": {
+            "context": {},
+            "response": {data["entity_id"]: {"forecast": [n]}},
+        },
+    }
+
+
+def test_responses_are_cached_and_shared(
+    app: Any, AD: StandInAppDaemon, new_app: Callable[[str], Any]
+):
+    calls: list[str] = []
+
+    async def on_call(
+        domain: str, service: str, data: dict[str, Any], namespace: str
+    ) -> Any:
+        calls.append(data["type"])
+        await asyncio.sleep(0.01)
+        return forecast_response(data, len(calls))
+
+    AD.services.on_call = on_call
+    other = new_app("other")
+    weather = app.ha.weather.home
+
+    daily = [AD.run(app, lambda: weather.get_forecasts(type="daily")) for _ in range(5)]
+    daily.append(
+        AD.run(other, lambda: other.ha.weather.home.get_forecasts(type="daily"))
+    )
+    assert daily[0] == {"weather.home": {"forecast": [1]}}
+    assert all(response is daily[0] for response in daily)
+
+    AD.run(app, lambda: weather.get_forecasts(type="hourly"))
+    assert calls == ["daily", "hourly"]
+
+    AD.advance(app.ha.hapt.response_ttl_s + 1)
+    refreshed = AD.run(app, lambda: weather.get_forecasts(type="daily"))
+    assert refreshed == {"weather.home": {"forecast": [3]}}
+    AD.run(app, lambda: weather.get_forecasts(type="daily", ttl_s=0))
+    assert len(calls) == 4
+
+    async def concurrently() -> list[Any]:
+        return await asyncio.gather(
+            *(weather.get_forecasts_async(type="twice_daily") for _ in range(5))
+        )
+
+    responses = AD.run(app, concurrently)
+    # Sent once, the others waited for it
+    assert len(calls) == 5
+    assert all(response is responses[0] for response in responses)
+    assert not AD.errors
+
+
+def test_failed_responses_are_not_cached(app: Any, AD: StandInAppDaemon):
+    failures: list[dict[str, Any]] = []
+
+    def on_call(domain: str, service: str, data: dict[str, Any], namespace: str) -> Any:
+        failures.append(data)
+        return {"success": False, "error": {"code": "x", "message": "nope"}}
+
+    AD.services.on_call = on_call
+    for _ in range(2):
+        AD.run(app, lambda: app.ha.weather.home.get_forecasts(type="daily"))
+
+    assert len(failures) == 2
+    assert len(AD.errors) == 2
+    assert "RuntimeError" in AD.errors[0]
+    assert not hapth.RESPONSE_CACHE.in_flight
+
+
+def test_optional_responses_are_not_cached(app: Any, AD: StandInAppDaemon):
+    results: list[Any] = [None, {"context": {}, "response": {"stdout": "1"}}]
+
+    def on_call(domain: str, service: str, data: dict[str, Any], namespace: str) -> Any:
+        return {"success": True, "result": results.pop(0) if results else None}
+
+    AD.services.on_call = on_call
+    shell_command = app.ha.shell_command
+
+    assert AD.run(app, shell_command.backup_with_response) is None
+    assert AD.run(app, shell_command.backup_with_response) == {"stdout": "1"}
+    assert AD.run(app, shell_command.backup) is None
+
+    assert len(AD.services.calls) == 3
+    assert not hapth.RESPONSE_CACHE.entries
+    assert not AD.errors
+
+
+def test_least_recently_used_responses_are_dropped():
+    cache = hapth.ResponseCache(max_entries=2)
+
+    async def fill() -> list[Any]:
+        async def fetch(key: str) -> str:
+            return key.upper()
+
+        responses: list[Any] = []
+        for key in ["a", "b", "a", "c", "b"]:
+            responses.append(await cache.get(key, 60, 0.0, partial(fetch, key)))
+        return responses
+
+    assert asyncio.run(fill()) == ["A", "B", "A", "C", "B"]
+    # "b" was dropped when "c" came in, as "a" had been used since
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert list(cache.entries) == ["c", "b"]
@@ -0,0 +1,79 @@
+from typing import Any
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def record_power(AD: StandInAppDaemon) -> None:
+    "Two minutes of changes of `sensor.power`, the last one 80 seconds ago"
+    start = AD.now
+    for second in range(1, 120):
+        AD.now = start + second
+        AD.set_state("sensor.power", str(second % 10 + 100), run_callbacks=False)
+    AD.now = start + 200
+
+
+def test_rolling_windows(app: Any, AD: StandInAppDaemon):
+    record_power(AD)
+    power = app.ha.sensor.power
+
+    cold = AD.run(app, lambda: power.rolling_window(60))
+    warm = AD.run(app, lambda: power.rolling_window(60, warm_start=True))
+    assert (cold.count(), cold.mean()) == (1, 109)
+    # The last change was long before the window, but the state was held since
+    assert (warm.count(), warm.max()) == (1, 109)
+
+    for value in ["1", "5", "3", "unavailable"]:
+        AD.advance(10)
+        AD.set_state("sensor.power", value)
+    assert (cold.count(), cold.sum(), cold.min(), cold.max()) == (4, 118, 1, 109)
+
+    AD.advance(45)
+    assert (cold.count(), cold.min(), cold.max()) == (2, 3, 5)
+
+    assert cold.cancel()
+    assert not cold.cancel()
+    AD.set_state("sensor.power", "20")
+    assert cold.count() == 2
+    assert warm.count() == 3
+    assert not AD.errors
+
+
+def test_rolling_windows_can_be_awaited(app: Any, AD: StandInAppDaemon):
+    record_power(AD)
+    power = app.ha.sensor.power
+
+    async def start_windows() -> list[Any]:
+        return [
+            await power.rolling_window_async(60),
+            await power.rolling_window_async(300, warm_start=True),
+        ]
+
+    cold, warm = AD.run(app, start_windows)
+    assert (cold.count(), cold.mean()) == (1, 109)
+    # All the changes of the last two minutes, and the state before them
+    assert (warm.count(), warm.min(), warm.max()) == (120, 12.5, 109)
+
+    AD.advance(10)
+    AD.set_state("sensor.power", "1")
+    assert (cold.count(), cold.min()) == (2, 1)
+    assert warm.min() == 1
+    assert not AD.errors
+
+
+def test_rolling_windows_keep_at_most_max_samples():
+    window = hapth.RollingWindow(1e9, max_samples=5, clock=lambda: 0.0)
+    window.add_history([])
+    for i in range(20):
+        window.add(i, float(i))
+
+    assert window.count() == 5
+    assert (window.sum(), window.min(), window.max()) == (sum(range(15, 20)), 15, 19)
+
+
+def test_rolling_windows_keep_the_changes_made_while_backfilling():
+    window = hapth.RollingWindow(100, clock=lambda: 50.0)
+    window.on_state("sensor.power", "state", None, "7")
+    window.add_history([(10.0, 1.0), (49.0, 2.0), (50.0, 7.0)])
+
+    assert list(window.samples) == [(10.0, 1.0), (49.0, 2.0), (50.0, 7.0)]
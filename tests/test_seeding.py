@@ -0,0 +1,62 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_triggering_entity_is_seeded_from_the_event(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    metrics = ha.hapt.enable_metrics()
+    seen: list[float] = []
+
+    def on_power() -> None:
+        seen.append(ha.sensor.power.state())
+
+    AD.run(app, lambda: ha.sensor.power.listen_state(on_power))
+    AD.set_state("sensor.power", "40")
+    # Only the attributes changed: AppDaemon doesn't dispatch it
+    AD.set_state("sensor.power", "40", {"unit_of_measurement": "kW"})
+
+    assert seen == [40]
+    assert metrics.counters.get("loop_hops", 0) == 0
+    assert [listener.attribute for listener in AD.listeners.values()] == [None]
+
+
+def test_full_state_is_seeded_when_enabled(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.seed_full_state = True
+    metrics = ha.hapt.enable_metrics()
+    seen: list[tuple[Any, ...]] = []
+
+    def on_power() -> None:
+        seen.append(
+            (
+                ha.sensor.power.state(),
+                ha.sensor.power.get_state_repeatable_read("unit_of_measurement"),
+            )
+        )
+
+    AD.run(app, lambda: ha.sensor.power.listen_state(on_power, new="40"))
+    AD.set_state("sensor.power", "40")
+    AD.set_state("sensor.power", "40", {"unit_of_measurement": "kW"})
+    AD.set_state("sensor.power", "41")
+
+    assert seen == [(40, "W")]
+    assert metrics.counters.get("loop_hops", 0) == 0
+
+
+def test_duration_is_left_to_appdaemon(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    ha.hapt.seed_full_state = True
+    lamp = ha.light.hallway_lamp
+    seen: list[str] = []
+
+    def on_lamp_on() -> None:
+        seen.append(lamp.state())
+
+    AD.run(app, lambda: lamp.listen_state(on_lamp_on, new="on", duration_s=60))
+    AD.set_state("light.hallway_lamp", "on")
+    AD.advance(30)
+    assert seen == []
+
+    AD.advance(30)
+    assert seen == ["on"]
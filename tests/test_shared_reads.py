@@ -0,0 +1,74 @@
+import json
+from typing import Any, Callable
+
+import pytest
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def read_full_state(app: Any) -> Any:
+    hapt = app.ha.hapt
+    return app.AD.run(
+        app,
+        lambda: hapt.run_callback(
+            {}, lambda: app.ha.sensor.temp.get_state_repeatable_read("all")
+        ),
+    )
+
+
+def test_apps_share_one_copy_per_state(
+    new_app: Callable[[str], Any], AD: StandInAppDaemon
+):
+    apps = [new_app("first"), new_app("second")]
+    for app in apps:
+        app.ha.hapt.shared_reads = True
+    copies_made = hapth.SHARED_READS.copies_made
+
+    first, second = [read_full_state(app) for app in apps]
+
+    assert first is second
+    assert first["attributes"]["unit_of_measurement"] == "°C"
+    assert hapth.SHARED_READS.copies_made == copies_made + 1
+
+    AD.set_state("sensor.temp", "21", run_callbacks=False)
+    changed = read_full_state(apps[0])
+
+    assert changed["state"] == "21"
+    assert hapth.SHARED_READS.copies_made == copies_made + 2
+    assert not AD.errors
+
+
+def test_shared_copies_are_read_only(app: Any, AD: StandInAppDaemon):
+    app.ha.hapt.shared_reads = True
+    entity_state = read_full_state(app)
+
+    with pytest.raises(TypeError):
+        entity_state["state"] = "0"
+    with pytest.raises(TypeError):
+        entity_state["attributes"]["unit_of_measurement"] = "°F"
+    # AppDaemon's own dict is untouched by the copy
+    assert AD.state.state["default"]["sensor.temp"] is not entity_state
+    assert json.loads(json.dumps(entity_state, default=hapth.json_default)) == {
+        **AD.state.state["default"]["sensor.temp"]
+    }
+
+
+def test_callbacks_keep_their_copy_while_others_refresh_it(
+    new_app: Callable[[str], Any], AD: StandInAppDaemon
+):
+    reader, refresher = new_app("reader"), new_app("refresher")
+    for app in (reader, refresher):
+        app.ha.hapt.shared_reads = True
+    seen: list[Any] = []
+
+    def read_twice() -> None:
+        seen.append(reader.ha.sensor.temp.state())
+        AD.set_state("sensor.temp", "25", run_callbacks=False)
+        seen.append(read_full_state(refresher)["state"])
+        seen.append(reader.ha.sensor.temp.state())
+
+    AD.run(reader, lambda: reader.ha.hapt.run_callback({}, read_twice))
+
+    assert seen == [20, "25", 20]
+    assert not AD.errors
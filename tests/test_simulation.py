@@ -0,0 +1,126 @@
+import datetime as dt
+from types import ModuleType
+from typing import Any
+
+import appdaemon.plugins.hass.hassapi as hass
+
+import homeassistant_python_typer_testing as hapt_testing
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_simulation_runs_days_in_virtual_time(hapt: ModuleType):
+    class NightLight(hass.Hass):
+        def initialize(self):
+            self.ha = hapt.HomeAssistant(self)
+            self.run_daily(self.evening, dt.time(22))
+            self.run_daily(self.morning, dt.time(7))
+
+            def is_high(value: Any) -> bool:
+                return float(value) > 1000
+
+            self.ha.sensor.power.listen_state(
+                self.high_power, new=is_high, duration_s=600
+            )
+
+        def evening(self, cb_args: dict[str, Any]):
+            self.ha.light.hallway_lamp.turn_on(brightness=50)
+
+        def morning(self, cb_args: dict[str, Any]):
+            self.ha.light.hallway_lamp.turn_off()
+
+        def high_power(self):
+            self.ha.light.kitchen_lamp.toggle()
+
+    start = dt.datetime(2026, 1, 1, 12).astimezone()
+    days = 3
+    timeline = (
+        # Long enough to trigger the duration listener
+        hapt_testing.daily_changes(start, days, dt.time(18), "sensor.power", "1500")
+        # Too short
+        + hapt_testing.daily_changes(start, days, dt.time(19), "sensor.power", "2000")
+        + hapt_testing.daily_changes(start, days, dt.time(19, 5), "sensor.power", "100")
+    )
+    result = hapt_testing.simulate(
+        hapt_testing.Scenario(
+            NightLight,
+            start,
+            dt.timedelta(days=days),
+            {
+                "sensor.power": "10",
+                "light.hallway_lamp": ("off", {}),
+                "light.kitchen_lamp": "off",
+            },
+            timeline,
+        )
+    )
+
+    assert not result.errors
+    assert [
+        (moment.hour, moment.minute, service, data["entity_id"])
+        for moment, _, service, data in result.calls[:3]
+    ] == [
+        (18, 10, "toggle", "light.kitchen_lamp"),
+        (22, 0, "turn_on", "light.hallway_lamp"),
+        (7, 0, "turn_off", "light.hallway_lamp"),
+    ]
+    assert len(result.calls) == 3 * days
+    # Service calls change the states of the entities they target
+    assert result.final_states["light.kitchen_lamp"] == "on"
+    assert result.final_states["light.hallway_lamp"] == "off"
+
+
+def test_stand_in_filters_state_changes_like_appdaemon(app: Any, AD: StandInAppDaemon):
+    seen: list[tuple[str, Any, Any]] = []
+
+    def on_change(entity: str, attribute: str, old: Any, new: Any, kwargs: Any) -> None:
+        seen.append((attribute, old, new))
+
+    def above_100(value: Any) -> bool:
+        return float(value) > 100
+
+    AD.run(app, lambda: app.listen_state(on_change, "sensor.power", new=above_100))
+    AD.run(
+        app,
+        lambda: app.listen_state(
+            on_change, "sensor.temp", attribute="unit_of_measurement"
+        ),
+    )
+    AD.set_state("sensor.power", "50")
+    AD.set_state("sensor.power", "150", {"friendly_name": "Power"})
+    # Only an attribute changed, not the state
+    AD.set_state("sensor.power", "150", {"friendly_name": "Mains power"})
+    AD.set_state("sensor.temp", "21")
+    AD.set_state("sensor.temp", "21", {"unit_of_measurement": "°F"})
+
+    assert seen == [("state", "50", "150"), ("unit_of_measurement", "°C", "°F")]
+    assert not AD.errors
+
+
+def test_stand_in_restarts_durations_like_appdaemon(app: Any, AD: StandInAppDaemon):
+    fired_at: list[float] = []
+
+    def on_high(entity: str, attribute: str, old: Any, new: Any, kwargs: Any) -> None:
+        fired_at.append(AD.now)
+
+    def above_100(value: Any) -> bool:
+        return float(value) > 100
+
+    AD.run(
+        app,
+        lambda: app.listen_state(on_high, "sensor.power", new=above_100, duration=60),
+    )
+    start = AD.now
+    AD.set_state("sensor.power", "150")
+    AD.advance(30)
+    # Still above 100, but a change all the same: the duration starts over
+    AD.set_state("sensor.power", "200")
+    AD.advance(50)
+    assert fired_at == []
+    AD.advance(10)
+    assert fired_at == [start + 90]
+    AD.set_state("sensor.power", "300")
+    AD.advance(30)
+    AD.set_state("sensor.power", "50")
+    AD.advance(60)
+    assert fired_at == [start + 90]
+    assert not AD.errors
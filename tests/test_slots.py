@@ -0,0 +1,8 @@
+from typing import Any
+
+
+def test_runtime_objects_have_no_instance_dict(app: Any):
+    ha = app.ha
+    for runtime_object in [ha.hapt, ha.light, ha.light.hallway_lamp, ha.sensor.power]:
+        assert not hasattr(runtime_object, "__dict__"), runtime_object
+    assert ha.light.hallway_lamp.name == "app"
@@ -0,0 +1,72 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def nothing() -> None:
+    pass
+
+
+def test_subscriptions_are_tracked_and_cancelled_by_scope(
+    app: Any, AD: StandInAppDaemon
+):
+    ha = app.ha
+    subscriptions = ha.hapt.subscriptions
+    handles = [
+        AD.run(app, lambda: ha.sensor.power.listen_state(nothing)) for _ in range(3)
+    ]
+    assert subscriptions.per_entity() == {"sensor.power": 3}
+
+    # Cancelled through AppDaemon directly
+    AD.run(app, lambda: app.cancel_listen_state(handles[0]))
+    assert len(subscriptions) == 2
+
+    with subscriptions.scoped("kitchen"):
+        AD.run(app, lambda: ha.light.kitchen_lamp.listen_state(nothing))
+        AD.run(app, lambda: ha.sensor.power.listen_numeric_threshold(nothing, 5))
+        ha.hapt.timers.set("kitchen", 60, nothing)
+    assert subscriptions.per_entity() == {"sensor.power": 3, "light.kitchen_lamp": 1}
+
+    assert AD.run(app, lambda: subscriptions.cancel_scope("kitchen")) == 3
+    assert "kitchen" not in ha.hapt.timers
+    assert subscriptions.per_entity() == {"sensor.power": 2}
+    assert len(AD.listeners) == 2
+
+    app.terminate()
+    assert len(subscriptions) == 0
+    assert len(ha.hapt.timers) == 0
+
+
+def test_subscriptions_can_be_cancelled_while_being_registered(
+    app: Any, AD: StandInAppDaemon
+):
+    subscriptions = app.ha.hapt.subscriptions
+
+    async def subscribe_and_cancel() -> bool:
+        # From the event loop, AppDaemon only hands back the task registering the subscription
+        handle = app.ha.sensor.power.listen_state(nothing)
+        return subscriptions.cancel(handle)
+
+    assert AD.run(app, subscribe_and_cancel)
+    assert len(subscriptions) == 0
+    assert not AD.listeners
+    assert not AD.errors
+
+
+def test_leaking_subscriptions_are_reported(app: Any, AD: StandInAppDaemon):
+    subscriptions = app.ha.hapt.subscriptions
+    subscriptions.leak_warning_threshold = 5
+    warnings: list[str] = []
+
+    def log(message: str, *args: Any, level: str = "INFO", **kwargs: Any) -> None:
+        if level == "WARNING":
+            warnings.append(message % args)
+
+    app.log = log
+    for _ in range(12):
+        AD.run(app, lambda: app.ha.sensor.power.listen_state(nothing))
+
+    # At the threshold, then each time the count doubles
+    assert len(warnings) == 2
+    assert "5 live subscriptions to sensor.power with callback nothing" in warnings[0]
+    assert "10 live subscriptions" in warnings[1]
@@ -0,0 +1,86 @@
+from typing import Any
+
+import homeassistant_python_typer_helpers as hapth
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_thresholds_only_fire_when_crossed(app: Any, AD: StandInAppDaemon):
+    power = app.ha.sensor.power
+    start = AD.now
+    hits: list[tuple[str, float]] = []
+
+    def hot() -> None:
+        assert power.state() > 25
+        hits.append(("hot", AD.now))
+
+    def band() -> None:
+        hits.append(("band", AD.now))
+
+    async def cold() -> None:
+        hits.append(("cold", AD.now))
+
+    AD.set_state("sensor.power", "30")
+    AD.run(app, lambda: power.listen_numeric_threshold(hot, above=25, hysteresis=1))
+    AD.run(
+        app,
+        lambda: power.listen_numeric_threshold(
+            band, above=10, below=20, min_duration_s=30
+        ),
+    )
+    AD.run(app, lambda: power.listen_numeric_threshold(cold, below=5))
+    values = ["30", "26", "24.5", "25.5", "23.9", "26", "unavailable", "26.5"]
+    values += ["15", "16", "21", "15", "3", "4"]
+    for value in values:
+        AD.advance(20)
+        AD.set_state("sensor.power", value)
+    AD.advance(60)
+
+    def at(step: int) -> float:
+        return start + 20 * step
+
+    # 25.5 doesn't fire again until the power went back below 24, and the band has to be held for 30s, which the
+    # second 15 isn't
+    assert hits == [("hot", at(6)), ("band", at(9) + 30), ("cold", at(13))]
+    assert not AD.errors
+
+
+def test_cancelling_a_threshold_cancels_its_pending_crossing(
+    app: Any, AD: StandInAppDaemon
+):
+    power = app.ha.sensor.power
+    hits: list[float] = []
+
+    handle = AD.run(
+        app,
+        lambda: power.listen_numeric_threshold(
+            hits.append, 100, None, 0.0, 30, "above 100"
+        ),
+    )
+    AD.set_state("sensor.power", "150")
+    AD.advance(10)
+    assert AD.run(app, lambda: app.ha.hapt.subscriptions.cancel(handle))
+    AD.advance(60)
+
+    assert hits == []
+    assert len(app.ha.hapt.timers) == 0
+    assert not app.ha.hapt.timers.learned_read_sets
+    assert not AD.errors
+
+
+def test_threshold_transitions():
+    threshold = hapth.Threshold(above=10, below=20, hysteresis=2)
+
+    transitions = [
+        threshold.update(old, new)
+        for old, new in [
+            ("5", "15"),
+            ("15", "21"),
+            ("21", "23"),
+            ("23", "unavailable"),
+            ("unavailable", "19"),
+        ]
+    ]
+
+    # Within 2 of the band, 21 still matches, and values that aren't numbers change nothing
+    assert transitions == [True, None, False, None, True]
+    assert (threshold.transitions, threshold.ignored) == (3, 2)
@@ -0,0 +1,81 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_bursts_are_coalesced_into_one_invocation(app: Any, AD: StandInAppDaemon):
+    ha = app.ha
+    lamps = [ha.light.hallway_lamp, ha.light.kitchen_lamp]
+    runs: list[tuple[str, list[str]]] = []
+
+    def on_scene(entity: Any) -> None:
+        runs.append((entity.entity_id, [lamp.state() for lamp in lamps]))
+
+    AD.run(app, lambda: ha.hapt.listen_many(lamps, on_scene, coalesce_ms=100))
+    AD.set_state("light.hallway_lamp", "on")
+    AD.set_state("light.kitchen_lamp", "on")
+    assert runs == []
+
+    AD.advance(0.1)
+    # Given the entity that changed last, and reading the states as of the invocation
+    assert runs == [("light.kitchen_lamp", ["on", "on"])]
+    assert not AD.errors
+
+
+def test_throttled_callbacks_get_the_latest_state(app: Any, AD: StandInAppDaemon):
+    power = app.ha.sensor.power
+    runs: list[float] = []
+
+    def on_power() -> None:
+        runs.append(power.state())
+
+    AD.run(app, lambda: power.listen_state(on_power, throttle_s=10))
+    for value in range(1, 6):
+        AD.set_state("sensor.power", str(value))
+        AD.advance(1)
+    # The first change runs right away, the next ones wait for the end of the interval
+    assert runs == [1]
+
+    AD.advance(5)
+    assert runs == [1, 5]
+
+    AD.advance(20)
+    AD.set_state("sensor.power", "6")
+    assert runs == [1, 5, 6]
+
+
+def test_pending_invocations_are_cancelled_with_the_subscription(
+    app: Any, AD: StandInAppDaemon
+):
+    power = app.ha.sensor.power
+    runs: list[float] = []
+
+    def on_power() -> None:
+        runs.append(power.state())
+
+    handle = AD.run(app, lambda: power.listen_state(on_power, coalesce_ms=1000))
+    AD.set_state("sensor.power", "40")
+    assert len(AD.timers) == 1
+
+    AD.run(app, lambda: app.ha.hapt.subscriptions.cancel(handle))
+    AD.advance(5)
+
+    assert runs == []
+    assert not AD.timers
+
+
+def test_no_invocation_is_scheduled_past_the_timeout(app: Any, AD: StandInAppDaemon):
+    power = app.ha.sensor.power
+    runs: list[float] = []
+
+    def on_power() -> None:
+        runs.append(power.state())
+
+    AD.run(
+        app,
+        lambda: power.listen_state(on_power, None, None, None, None, 5, 8000),
+    )
+    AD.set_state("sensor.power", "40")
+    AD.advance(20)
+
+    assert runs == []
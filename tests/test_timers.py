@@ -0,0 +1,82 @@
+from typing import Any
+
+from homeassistant_python_typer_testing import StandInAppDaemon
+
+
+def test_rescheduling_timers_arms_few_appdaemon_timers(app: Any, AD: StandInAppDaemon):
+    timers = app.ha.hapt.timers
+    fired: list[tuple[int, float]] = []
+
+    def off(index: int) -> None:
+        fired.append((index, app.ha.sensor.temp.state()))
+
+    # Occupancy timers pushed back on every sensor update
+    for _ in range(10):
+        for index in range(300):
+            AD.run(app, timers.set, index, 60, off, index)
+        AD.advance(5)
+
+    assert timers.armed <= 3
+    assert len(timers) == 300
+    assert timers.cancel(5)
+    assert not timers.cancel(5)
+    AD.set_state("sensor.temp", "25", run_callbacks=False)
+    AD.advance(60)
+
+    assert sorted(index for index, _ in fired) == [i for i in range(300) if i != 5]
+    assert {temperature for _, temperature in fired} == {25}
+    assert len(timers) == 0
+    assert not AD.errors
+
+
+def test_one_failing_timer_does_not_stop_the_others(app: Any, AD: StandInAppDaemon):
+    timers = app.ha.hapt.timers
+    fired: list[str] = []
+
+    def fail() -> None:
+        raise RuntimeError("boom")
+
+    async def remember(key: str) -> None:
+        fired.append(key)
+
+    AD.run(app, timers.set, "first", 1, fail)
+    AD.run(app, timers.set, "second", 1, remember, "second")
+    AD.advance(2)
+
+    assert fired == ["second"]
+    assert len(AD.errors) == 1
+    assert "boom" in AD.errors[0]
+
+
+def test_clear_disarms_the_appdaemon_timer(app: Any, AD: StandInAppDaemon):
+    timers = app.ha.hapt.timers
+    fired: list[str] = []
+
+    AD.run(app, timers.set, "early", 10, fired.append, "early")
+    AD.run(app, timers.clear)
+
+    assert timers.armed_at is None
+    # Arms a new AppDaemon timer, even though it is due after the one armed before
+    AD.run(app, timers.set, "late", 30, fired.append, "late")
+    assert timers.armed == 2
+    AD.advance(20)
+    assert fired == []
+    AD.advance(10)
+    assert fired == ["late"]
+    assert not AD.errors
+
+
+def test_learned_read_sets_are_capped(app: Any, AD: StandInAppDaemon):
+    timers = app.ha.hapt.timers
+    timers.MAX_LEARNED_READ_SETS = 10
+
+    def read() -> None:
+        app.ha.sensor.temp.state()
+
+    for index in range(25):
+        AD.run(app, timers.set, index, 1, read)
+        AD.advance(2)
+
+    assert list(timers.learned_read_sets) == list(range(15, 25))
+    assert timers.learned_read_sets[24] == {"sensor.temp": ("default", False)}
+    assert not AD.errors